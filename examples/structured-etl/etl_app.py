@@ -4,8 +4,8 @@
 
 from distutils.command.config import config
 import boto3
-import csv
 import io
+import tempfile
 import ubiq_security as ubiq
 import ubiq_security.structured as ubiq_structured
 
@@ -34,32 +34,20 @@ if encrypt_full:
 
 # Encrypt specific data
 if encrypt_fields:
-    print('Encrypting line by line')
-    lines = full_doc.splitlines(True)
-    transformed_rows = []
-    headers = lines[0].split(',')
-
-    reader = csv.DictReader(lines)
-    for row in reader: 
-        print(row['id'], row['username'])
-
-        # TODO: Format Preserving Encryption, for now regular encryption.
-        row['full_name_sensitive'] = ubiq_structured.Encrypt(credentials, 'FULL_NAME_ETL', row['full_name_sensitive'])
-        row['email_sensitive'] = ubiq_structured.Encrypt(credentials, 'EMAIL_ETL', row['email_sensitive'], None)
-        row['phone_number_sensitive'] = ubiq_structured.Encrypt(credentials, 'PHONE_ETL', row['phone_number_sensitive'])
-        row['ssn_sensitive'] = ubiq_structured.Encrypt(credentials, 'SSN_ETL', row['ssn_sensitive'])
-        
-        transformed_rows.append(list(row.values()))
-
-    print('Rows transformed, encoding to upload.')
-    # Builing output object for S3
-    csv_buffer = io.StringIO()
-    writer = csv.writer(csv_buffer)
-    writer.writerow(headers)
-    writer.writerows(transformed_rows)
-    byte_buff = io.BytesIO(csv_buffer.getvalue().encode())
-    print('Uploading to S3')
-    s3.upload_fileobj(byte_buff, bucket_name, 'TRANSFORMED_DATA.csv')
+    print('Encrypting fields')
+    # The file is streamed from S3 and encrypted a chunk of rows at a time
+    response = s3.get_object(Bucket=bucket_name, Key=file_name)
+    with tempfile.TemporaryFile() as transformed:
+        stats = ubiq_structured.EncryptCSV(credentials, response['Body'], transformed, {
+            'full_name_sensitive': 'FULL_NAME_ETL',
+            'email_sensitive': 'EMAIL_ETL',
+            'phone_number_sensitive': 'PHONE_ETL',
+            'ssn_sensitive': 'SSN_ETL',
+        })
+        print('%d rows transformed (%.0f rows/s)' % (stats['rows'], stats['rows_per_second']))
+        transformed.seek(0)
+        print('Uploading to S3')
+        s3.upload_fileobj(transformed, bucket_name, 'TRANSFORMED_DATA.csv')
     print('Upload complete')
 
 print('Done')
\ No newline at end of file
@@ -2,6 +2,7 @@ import os
 import setuptools
 
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 here = os.path.abspath(os.path.dirname(__file__))
 
@@ -21,6 +22,19 @@ if os.path.isfile(requirementPath):
     with open(requirementPath, "r", encoding="utf-8") as f:
         install_requires = f.read().splitlines()
 
+# optional dependencies, e.g. pip install ubiq-security[pandas]
+extras_require = {
+    "numpy": ["numpy>=1.17"],
+    "pandas": ["pandas>=1.5", "numpy>=1.17"],
+    "arrow": ["pyarrow>=6.0"],
+}
+
+class build_py_without_tests(build_py):
+    """Leave the unit tests, and the fixtures they share, out of the build"""
+    def find_package_modules(self, package, package_dir):
+        return [m for m in super().find_package_modules(package, package_dir)
+                if not (m[1].endswith("_test") or m[1] == "_testutil")]
+
 setuptools.setup(
     name="ubiq-security",
     version=version_contents["VERSION"],
@@ -32,6 +46,8 @@ setuptools.setup(
     url="https://gitlab.com/ubiqsecurity/ubiq-python",
     packages=setuptools.find_packages(),
     install_requires=install_requires,
+    extras_require=extras_require,
+    cmdclass={"build_py": build_py_without_tests},
     license="Free To Use But Restricted",
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+'''
+  Microbenchmark for the structured (FF1) encryption engine.  Runs entirely
+  offline against synthetic keys so that the per-value cost of the cipher
+  itself can be compared between library versions.
+
+@author:     Ubiq Security, Inc
+
+@copyright:  2021- Ubiq Security, Inc. All rights reserved.
+
+@contact:    support@ubiqsecurity.com
+'''
+
+import os
+import random
+import sys
+import time
+
+from argparse import ArgumentParser
+
+import importlib
+ff1 = importlib.import_module('ubiq_security.structured.lib.ff1')
+ffx = importlib.import_module('ubiq_security.structured.lib.ffx')
+common = importlib.import_module('ubiq_security.structured.common')
+
+UTF8 = ('ÑÒÓķĸĹϺϻϼϽϾÔÕϿは世界abcdefghijklmnopqrstuvwxyzこんにちÊʑʒʓËÌÍÎÏðñòóôĵĶʔʕ'
+        '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# name, input character set, plaintext length, tweak length
+DATASETS = [
+    ('SSN', '0123456789', 9, 0),
+    ('SSN_TWEAK', '0123456789', 9, 32),
+    ('SSN_LONG_TWEAK', '0123456789', 9, 256),
+    ('ALPHANUM_SSN', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ', 15, 0),
+    ('BIRTH_DATE', '0123456789', 8, 0),
+    ('UTF8_STRING_COMPLEX', UTF8, 120, 0),
+]
+
+# name, input character set, output character set, length
+CONVERSIONS = [
+    ('SSN', '0123456789', '!"#$%&\'()*', 9),
+    ('ALPHANUM_SSN', '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+     'abcdefghijklmnopqrstuvwxyzABCDEFGHIJ', 15),
+    ('UTF8_STRING_COMPLEX', UTF8, UTF8[::-1], 120),
+]
+
+def make_values(ics, length, count, seed = 0):
+    rnd = random.Random(seed)
+    return [''.join(rnd.choice(ics) for _ in range(length))
+            for _ in range(count)]
+
+def bench_many(fn, values):
+    start = time.perf_counter_ns()
+    fn(values)
+    return (time.perf_counter_ns() - start) / len(values) / 1000
+
+def bench(fn, values):
+    start = time.perf_counter_ns()
+    for v in values:
+        fn(v)
+    return (time.perf_counter_ns() - start) / len(values) / 1000
+
+def run(count, datasets):
+    key = os.urandom(32)
+
+    print(f'{"":<20} {"per value (us/value)":>41} {"batched (us/value)":>41}')
+    print(f'{"dataset":<20} {"encrypt":>20} {"decrypt":>20} {"encrypt":>20} {"decrypt":>20}')
+    for name, ics, length, twklen in datasets:
+        twk = os.urandom(twklen)
+        ctx = ff1.Context(key, twk, 0, max(twklen, 1), len(ics), ics)
+        pts = make_values(ics, length, count)
+        cts = [ctx.Encrypt(pt) for pt in pts]
+
+        enc = bench(ctx.Encrypt, pts)
+        dec = bench(ctx.Decrypt, cts)
+        enc_many = bench_many(ctx.EncryptMany, pts)
+        dec_many = bench_many(ctx.DecryptMany, cts)
+        print(f'{name:<20} {enc:>20.2f} {dec:>20.2f} {enc_many:>20.2f} {dec_many:>20.2f}')
+
+def bignum(s, ics, ocs):
+    return ffx.NumberToString(len(ocs), ocs,
+                              ffx.StringToNumber(len(ics), ics, s),
+                              len(s))
+
+def run_conversions(count):
+    print()
+    print('strConvertRadix, same radix character sets')
+    print(f'{"dataset":<20} {"bignum (us/value)":>20} {"translate (us/value)":>20}')
+    for name, ics, ocs, length in CONVERSIONS:
+        values = make_values(ics, length, count)
+        for v in values:
+            assert bignum(v, ics, ocs) == common.strConvertRadix(v, ics, ocs)
+
+        big = bench(lambda v: bignum(v, ics, ocs), values)
+        tbl = bench(lambda v: common.strConvertRadix(v, ics, ocs), values)
+        print(f'{name:<20} {big:>20.2f} {tbl:>20.2f}')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='FF1 engine microbenchmark')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=5000,
+                        help='Number of values per dataset (default: 5000)')
+    parser.add_argument('-d', '--dataset', dest='datasets', action='append',
+                        help='Only run the named dataset(s)')
+    args = parser.parse_args()
+
+    datasets = DATASETS
+    if args.datasets:
+        datasets = [d for d in DATASETS if d[0] in args.datasets]
+
+    run(args.count, datasets)
+    run_conversions(args.count)
+    sys.exit(0)
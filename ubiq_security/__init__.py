@@ -6,4 +6,4 @@ from .auth import http_auth
 from .encrypt import encryption, encrypt
 from .decrypt import decryption, decrypt
 from .credentials import credentials, configCredentials
-from .configuration import ubiqConfiguration
\ No newline at end of file
+from .configuration import ubiqConfiguration
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+'''
+  Command line interface to the Ubiq Platform Python Client Library
+
+  Encrypts and decrypts lines or CSV columns with structured datasets, and
+  files or directories with unstructured encryption, in bulk.
+
+  Examples:
+    python -m ubiq_security structured-encrypt -n SSN -i ssns.txt -o ssns.enc
+    python -m ubiq_security structured-decrypt --column ssn=SSN -i users.csv
+    python -m ubiq_security encrypt -i reports/ -o reports.enc/ --jobs 4
+'''
+
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+from argparse import RawDescriptionHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+
+from . import configCredentials
+from .encrypt import encryption
+from .decrypt import decryption
+from .structured.common import batched, BATCH
+from .structured.client import Client
+from .structured.pool import ProcessPool
+from .structured.csvstream import cipherCSV
+from .structured.warm import SaveCache, LoadCache
+
+# Read and write 1 MiB of a file at a time
+BLOCK_SIZE = 1024 * 1024
+
+def parse_args(argv = None):
+    '''Parse the command line options.'''
+    parser = ArgumentParser(prog='python -m ubiq_security',
+                            description=__doc__,
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--creds', dest="credentials", help="Set the file name with the API credentials (default: ~/.ubiq/credentials)")
+    parser.add_argument('-P', '--profile', dest="profile", help="Identify the profile within the credentials file (default: default)", default='default')
+    parser.add_argument('-j', '--jobs', dest="jobs", type=int, default=0, help="Number of worker processes (default: 0, work in this process)")
+    parser.add_argument('--cache', dest="cache", metavar="FILE", help="Keep datasets and wrapped keys in FILE between runs, e.g. ~/.ubiq/cache (default: no cache file)")
+    parser.add_argument('--no-cache', dest="cache", action="store_const", const=None, help="Do not read or write the cache file (the default)")
+    parser.add_argument('-q', '--quiet', dest="quiet", action="store_true", help="Do not print the throughput summary")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, text in (('structured-encrypt', 'Encrypt lines, or CSV columns, with structured datasets'),
+                       ('structured-decrypt', 'Decrypt lines, or CSV columns, with structured datasets')):
+        cmd = commands.add_parser(name, help=text, description=text)
+        group = cmd.add_mutually_exclusive_group(required=True)
+        group.add_argument('-n', '--datasetname', dest="dataset_name", help="Dataset for every line of the input")
+        group.add_argument('--column', dest="columns", action="append", metavar="COLUMN=DATASET", help="Treat the input as CSV with a header and process COLUMN with DATASET; may be repeated")
+        cmd.add_argument('-i', '--in', dest="infile", help="Set input file name (default: standard input)")
+        cmd.add_argument('-o', '--out', dest="outfile", help="Set output file name (default: standard output)")
+        cmd.add_argument('--chunk-size', dest="chunk_size", type=int, default=BATCH, help="Number of lines processed together (default: %d)" % (BATCH))
+
+    for name, text in (('encrypt', 'Encrypt a file, or all of the files in a directory'),
+                       ('decrypt', 'Decrypt a file, or all of the files in a directory')):
+        cmd = commands.add_parser(name, help=text, description=text)
+        cmd.add_argument('-i', '--in', dest="infile", required=True, help="Set input file or directory name")
+        cmd.add_argument('-o', '--out', dest="outfile", required=True, help="Set output file or directory name")
+
+    return parser.parse_args(argv)
+
+def structured_lines(creds, args, ENC, src, dst):
+    '''Process each line of src with one dataset. Returns the number of values'''
+    count = 0
+    pool = None
+    if args.jobs > 0:
+        pool = ProcessPool(creds, args.dataset_name, args.jobs)
+    client = Client(creds)
+    try:
+        for lines in batched(src, args.chunk_size):
+            values = [l.rstrip('\r\n') for l in lines]
+            # empty lines are copied as they are
+            pos = [i for i, v in enumerate(values) if v]
+            todo = [values[i] for i in pos]
+            if pool:
+                done = pool.Encrypt(todo) if ENC else pool.Decrypt(todo)
+            elif ENC:
+                done = client.EncryptMany(args.dataset_name, todo)
+            else:
+                done = client.DecryptMany(args.dataset_name, todo)
+            for i, v in zip(pos, done):
+                values[i] = v
+            dst.write(''.join(v + '\n' for v in values))
+            count += len(values)
+    finally:
+        if pool:
+            pool.close()
+    return count
+
+def structured(creds, args, ENC):
+    src = sys.stdin
+    dst = sys.stdout
+    try:
+        if args.infile:
+            src = open(args.infile, 'r', newline='')
+        if args.outfile:
+            dst = open(args.outfile, 'w', newline='')
+
+        if args.columns:
+            columns = {}
+            for c in args.columns:
+                column, sep, dataset_name = c.rpartition('=')
+                if not sep or not column or not dataset_name:
+                    raise RuntimeError("Invalid column mapping '%s', expected COLUMN=DATASET" % (c))
+                columns[column] = dataset_name
+            stats = cipherCSV(creds, src, dst, columns, ENC,
+                              chunk_size=args.chunk_size,
+                              processes=args.jobs)
+            return stats['rows'], 'rows'
+        return structured_lines(creds, args, ENC, src, dst), 'values'
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+class Files:
+    """
+    Encrypt or decrypt files, a block at a time
+
+    An encryption key is requested for several files at once, and the
+    decryption object keeps the key of the previous file, so that files
+    that share a key do not each fetch it.
+    """
+    def __init__(self, creds, ENC, uses):
+        self._creds = creds
+        self._enc = ENC
+        self._uses = max(uses, 1)
+        self._obj = None
+
+    def cipher(self, infile, outfile):
+        '''Returns the size of the input file'''
+        if self._enc:
+            # the server may allow fewer uses of a key than requested
+            if self._obj is None or self._obj.exhausted:
+                self._obj = encryption(self._creds, self._uses)
+        elif self._obj is None:
+            self._obj = decryption(self._creds)
+
+        obj = self._obj
+        size = 0
+        with open(infile, 'rb') as src, open(outfile, 'wb') as dst:
+            dst.write(obj.begin())
+            for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+                dst.write(obj.update(block))
+                size += len(block)
+            dst.write(obj.end())
+        return size
+
+def _worker_init(credentials_file, profile, ENC, uses):
+    creds = configCredentials(credentials_file, profile)
+    _worker.files = Files(creds, ENC, uses)
+    _worker.creds = creds
+
+def _worker(task):
+    size = _worker.files.cipher(*task)
+    # worker processes do not run exit handlers; report events now
+    _worker.creds.process_events()
+    return size
+
+def unstructured(creds, args, ENC):
+    '''Returns the number of files and bytes processed'''
+    if not os.path.isdir(args.infile):
+        return 1, Files(creds, ENC, 1).cipher(args.infile, args.outfile)
+
+    tasks = []
+    for root, dirs, files in os.walk(args.infile):
+        rel = os.path.relpath(root, args.infile)
+        os.makedirs(os.path.join(args.outfile, rel), exist_ok=True)
+        for name in sorted(files):
+            tasks.append((os.path.join(root, name),
+                          os.path.join(args.outfile, rel, name)))
+
+    if args.jobs > 0:
+        uses = -(-len(tasks) // args.jobs)
+        with ProcessPoolExecutor(args.jobs, initializer=_worker_init,
+                                 initargs=(args.credentials, args.profile,
+                                           ENC, uses)) as pool:
+            sizes = list(pool.map(_worker, tasks))
+    else:
+        files = Files(creds, ENC, len(tasks))
+        sizes = [files.cipher(*task) for task in tasks]
+    return len(tasks), sum(sizes)
+
+def main(argv = None):
+    args = parse_args(argv)
+    program_name = 'ubiq_security'
+
+    try:
+        creds = configCredentials(args.credentials, args.profile)
+        if args.cache:
+            LoadCache(creds, args.cache)
+
+        ENC = args.command in ('structured-encrypt', 'encrypt')
+        start = time.perf_counter()
+        if args.command.startswith('structured-'):
+            count, unit = structured(creds, args, ENC)
+            summary = '%d %s' % (count, unit)
+        else:
+            files, size = unstructured(creds, args, ENC)
+            count, unit = size / (1024 * 1024), 'MiB'
+            summary = '%d files, %.1f MiB' % (files, count)
+        elapsed = time.perf_counter() - start
+
+        if args.cache and creds.configuration.key_caching_structured:
+            os.makedirs(os.path.dirname(os.path.abspath(args.cache)), exist_ok=True)
+            SaveCache(creds, args.cache)
+
+        if not args.quiet:
+            sys.stderr.write('%s %s in %.2f s (%.1f %s/s)\n' % (
+                'encrypted' if ENC else 'decrypted', summary, elapsed,
+                count / max(elapsed, 1e-9), unit))
+        return 0
+    except KeyboardInterrupt:
+        return 1
+    except Exception as e:
+        sys.stderr.write(program_name + ": {0}\n".format(e))
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import csv
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import importlib
+cli = importlib.import_module('ubiq_security.__main__')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestCLI(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [encrypt, decrypt])
+        p = unittest.mock.patch.object(cli, 'configCredentials',
+                                       lambda *args: testutil.Creds())
+        p.start()
+        self.addCleanup(p.stop)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_cache_option(self):
+        cmd = ['structured-encrypt', '-n', 'SSN']
+        self.assertIsNone(cli.parse_args(cmd).cache)
+        self.assertIsNone(cli.parse_args(['--no-cache'] + cmd).cache)
+        self.assertEqual(cli.parse_args(['--cache', 'x'] + cmd).cache, 'x')
+
+    def test_lines(self):
+        pts = ['%03d-45-%04d' % (i, i) for i in range(100)]
+        pts[10] = ''
+        with open(self.path('in'), 'w') as f:
+            f.write('\n'.join(pts) + '\n')
+
+        stderr = io.StringIO()
+        with unittest.mock.patch('sys.stderr', stderr):
+            rc = cli.main(['--cache', self.path('cache'),
+                           'structured-encrypt', '-n', 'SSN',
+                           '-i', self.path('in'), '-o', self.path('enc'),
+                           '--chunk-size', '30'])
+        self.assertEqual(rc, 0)
+        self.assertIn('encrypted 100 values in', stderr.getvalue())
+        self.assertTrue(os.path.exists(self.path('cache')))
+
+        with open(self.path('enc')) as f:
+            cts = f.read().splitlines()
+        creds = testutil.Creds()
+        self.assertEqual(cts[10], '')
+        self.assertEqual(cts[:10], encrypt.EncryptMany(creds, 'SSN', pts[:10]))
+
+        rc = cli.main(['-q', '--no-cache', 'structured-decrypt', '-n', 'SSN',
+                       '-i', self.path('enc'), '-o', self.path('dec')])
+        self.assertEqual(rc, 0)
+        with open(self.path('dec')) as f:
+            self.assertEqual(f.read().splitlines(), pts)
+
+    def test_csv(self):
+        with open(self.path('in.csv'), 'w', newline='') as f:
+            csv.writer(f).writerows([['id', 'ssn']] +
+                                    [[i, '%03d-45-6789' % (i)]
+                                     for i in range(20)])
+
+        rc = cli.main(['-q', '--no-cache', 'structured-encrypt',
+                       '--column', 'ssn=SSN', '-i', self.path('in.csv'),
+                       '-o', self.path('out.csv')])
+        self.assertEqual(rc, 0)
+        with open(self.path('out.csv'), newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[5][1],
+                         encrypt.Encrypt(testutil.Creds(), 'SSN', '004-45-6789'))
+
+        stderr = io.StringIO()
+        with unittest.mock.patch('sys.stderr', stderr):
+            rc = cli.main(['-q', '--no-cache', 'structured-encrypt',
+                           '--column', 'ssn', '-i', self.path('in.csv')])
+        self.assertEqual(rc, 1)
+        self.assertIn('Invalid column mapping', stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
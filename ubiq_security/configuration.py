@@ -4,7 +4,6 @@ import os
 import json
 from enum import Enum
 
-import importlib.util
 
 class TimestampGranularity(Enum):
     MICROS = 1
@@ -37,7 +36,7 @@ def get_timestamp_granularity(value):
 
 class configInfo:
 
-    def __init__(self, event_reporting_wake_interval, event_reporting_minimum_count, event_reporting_flush_interval, event_reporting_trap_exceptions, event_reporting_timestamp_granularity, event_reporting_synchronous, logging_verbose, key_caching_unstructured, key_caching_structured, key_caching_encrypt, key_caching_ttl_seconds):
+    def __init__(self, event_reporting_wake_interval, event_reporting_minimum_count, event_reporting_flush_interval, event_reporting_trap_exceptions, event_reporting_timestamp_granularity, event_reporting_synchronous, logging_verbose, key_caching_unstructured, key_caching_structured, key_caching_encrypt, key_caching_ttl_seconds, codebook_enabled = False, codebook_max_domain_size = 10000000, codebook_directory = None, crypto_aes_backend = 'auto', memo_enabled = False, memo_max_bytes = 16777216, key_caching_current_ttl_seconds = 60):
         self.__event_reporting_wake_interval = event_reporting_wake_interval
         self.__event_reporting_minimum_count = event_reporting_minimum_count
         self.__event_reporting_flush_interval = event_reporting_flush_interval
@@ -49,6 +48,13 @@ class configInfo:
         self.__key_caching_structured = key_caching_structured
         self.__key_caching_encrypt = key_caching_encrypt
         self.__key_caching_ttl_seconds = key_caching_ttl_seconds
+        self.__codebook_enabled = codebook_enabled
+        self.__codebook_max_domain_size = codebook_max_domain_size
+        self.__codebook_directory = codebook_directory
+        self.__crypto_aes_backend = crypto_aes_backend
+        self.__memo_enabled = memo_enabled
+        self.__memo_max_bytes = memo_max_bytes
+        self.__key_caching_current_ttl_seconds = key_caching_current_ttl_seconds
 
     def get_event_reporting_wake_interval(self):
         return self.__event_reporting_wake_interval
@@ -94,6 +100,34 @@ class configInfo:
         return self.__key_caching_ttl_seconds
     key_caching_ttl_seconds = property(get_key_caching_ttl_seconds)
 
+    def get_codebook_enabled(self):
+        return self.__codebook_enabled
+    codebook_enabled = property(get_codebook_enabled)
+
+    def get_codebook_max_domain_size(self):
+        return self.__codebook_max_domain_size
+    codebook_max_domain_size = property(get_codebook_max_domain_size)
+
+    def get_codebook_directory(self):
+        return self.__codebook_directory
+    codebook_directory = property(get_codebook_directory)
+
+    def get_crypto_aes_backend(self):
+        return self.__crypto_aes_backend
+    crypto_aes_backend = property(get_crypto_aes_backend)
+
+    def get_memo_enabled(self):
+        return self.__memo_enabled
+    memo_enabled = property(get_memo_enabled)
+
+    def get_memo_max_bytes(self):
+        return self.__memo_max_bytes
+    memo_max_bytes = property(get_memo_max_bytes)
+
+    def get_key_caching_current_ttl_seconds(self):
+        return self.__key_caching_current_ttl_seconds
+    key_caching_current_ttl_seconds = property(get_key_caching_current_ttl_seconds)
+
     def set(self):
         return (self.__event_reporting_wake_interval != None 
                 and self.__event_reporting_minimum_count != None 
@@ -129,6 +163,23 @@ class ubiqConfiguration(configInfo):
                     self.__key_caching_encrypt = config_dict['key_caching']['encrypt']
                 if 'ttl_seconds' in config_dict['key_caching']:
                     self.__key_caching_ttl_seconds = config_dict['key_caching']['ttl_seconds']
+                if 'current_ttl_seconds' in config_dict['key_caching']:
+                    self.__key_caching_current_ttl_seconds = config_dict['key_caching']['current_ttl_seconds']
+            if 'codebook' in config_dict:
+                if 'enabled' in config_dict['codebook']:
+                    self.__codebook_enabled = config_dict['codebook']['enabled']
+                if 'max_domain_size' in config_dict['codebook']:
+                    self.__codebook_max_domain_size = config_dict['codebook']['max_domain_size']
+                if 'directory' in config_dict['codebook']:
+                    self.__codebook_directory = config_dict['codebook']['directory']
+            if 'crypto' in config_dict:
+                if 'aes_backend' in config_dict['crypto']:
+                    self.__crypto_aes_backend = config_dict['crypto']['aes_backend']
+            if 'memo' in config_dict:
+                if 'enabled' in config_dict['memo']:
+                    self.__memo_enabled = config_dict['memo']['enabled']
+                if 'max_bytes' in config_dict['memo']:
+                    self.__memo_max_bytes = config_dict['memo']['max_bytes']
 
     def load_config_file(self, config_file):
         try:
@@ -151,6 +202,13 @@ class ubiqConfiguration(configInfo):
         self.__key_caching_structured = True
         self.__key_caching_encrypt = False
         self.__key_caching_ttl_seconds = 1800
+        self.__codebook_enabled = False
+        self.__codebook_max_domain_size = 10000000
+        self.__codebook_directory = os.path.join(os.path.expanduser("~"), ".ubiq", "codebooks")
+        self.__crypto_aes_backend = 'auto'
+        self.__memo_enabled = False
+        self.__memo_max_bytes = 16777216
+        self.__key_caching_current_ttl_seconds = 60
 
     def __init__(self, config_file = None, config_dict = None):
         self.__event_reporting_wake_interval = None
@@ -164,6 +222,13 @@ class ubiqConfiguration(configInfo):
         self.__key_caching_structured = None
         self.__key_caching_encrypt = None
         self.__key_caching_ttl_seconds = None
+        self.__codebook_enabled = None
+        self.__codebook_max_domain_size = None
+        self.__codebook_directory = None
+        self.__crypto_aes_backend = None
+        self.__memo_enabled = None
+        self.__memo_max_bytes = None
+        self.__key_caching_current_ttl_seconds = None
 
         self.set_defaults()
         
@@ -191,10 +256,11 @@ class ubiqConfiguration(configInfo):
             self.__key_caching_unstructured,
             self.__key_caching_structured,
             self.__key_caching_encrypt,
-            self.__key_caching_ttl_seconds)
-        
-        # If verbose, warn user if M2Crypto will not be used.
-        if self.__logging_verbose:
-            # Package name is case-sensitive.
-            if importlib.util.find_spec('M2Crypto') is None:
-                print('M2Crypto not found on system. Defaulting to Cryptography (slower, but still functional).')
+            self.__key_caching_ttl_seconds,
+            self.__codebook_enabled,
+            self.__codebook_max_domain_size,
+            self.__codebook_directory,
+            self.__crypto_aes_backend,
+            self.__memo_enabled,
+            self.__memo_max_bytes,
+            self.__key_caching_current_ttl_seconds)
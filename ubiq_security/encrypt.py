@@ -151,6 +151,11 @@ class encryption:
 
         self._algo = algorithm(self._key['algorithm'])
 
+    @property
+    def exhausted(self):
+        """True when the key may not be used to encrypt anything else"""
+        return self._key['uses'] >= self._key['max_uses']
+
     def begin(self):
         """Begin the encryption process
 
@@ -161,7 +166,7 @@ class encryption:
         if hasattr(self, '_enc'):
             raise RuntimeError("encryption already in progress")
 
-        if self._key['uses'] >= self._key['max_uses']:
+        if self.exhausted:
             raise RuntimeError("maximum key uses exceeded")
         self._key['uses'] += 1
         self._creds.add_event(dataset_name="", dataset_group_name="", billing_action="encrypt",
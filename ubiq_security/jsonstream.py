@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Field level encryption of JSON records.
+#
+# Fields are chosen with simple JSON paths, e.g. $.customer.ssn or
+# $.items[*].card, and each path is mapped either to a structured
+# dataset or to unstructured encryption. Records are read a window at a
+# time; the values of every structured dataset in the window are
+# encrypted together with one bulk call, and unstructured values share
+# one data key per window. Records are written out, in order, before
+# the next window is read.
+#
+# Unstructured values are serialized as JSON before they are encrypted
+# and the cipher text is stored as a base64 string, so that decryption
+# restores values of any type.
+
+import base64
+import io
+import json
+import re
+import time
+
+from .encrypt import encryption
+from .decrypt import decryption
+
+# number of records processed together
+WINDOW = 1000
+
+_STEP = re.compile(r"\.([^.\[\]]+)|\[(\d+|\*)\]|\['([^']*)'\]")
+
+def compilePath(path):
+    """
+    Compile a JSON path into a tuple of steps. Supported are the root
+    ($), member names (.name or ['name']), array indexes ([n]) and
+    wildcards ([*]), which match every element of an array or member of
+    an object.
+    """
+    if not path.startswith('$'):
+        raise RuntimeError('Invalid JSON path: %s' % (path))
+
+    steps = []
+    pos = 1
+    while pos < len(path):
+        m = _STEP.match(path, pos)
+        if m is None:
+            raise RuntimeError('Invalid JSON path: %s' % (path))
+        if m.group(1) != None:
+            steps.append(m.group(1))
+        elif m.group(2) == '*':
+            steps.append(None)
+        elif m.group(2) != None:
+            steps.append(int(m.group(2)))
+        else:
+            steps.append(m.group(3))
+        pos = m.end()
+    if not steps:
+        raise RuntimeError('JSON path selects the whole record: %s' % (path))
+    return tuple(steps)
+
+def _slots(node, steps, out):
+    # append (container, key) for every non-null value that the steps
+    # lead to from node
+    step, rest = steps[0], steps[1:]
+    if step is None:
+        if isinstance(node, list):
+            keys = range(len(node))
+        elif isinstance(node, dict):
+            keys = list(node)
+        else:
+            return
+    elif isinstance(step, int):
+        if not isinstance(node, list) or step >= len(node):
+            return
+        keys = (step,)
+    else:
+        if not isinstance(node, dict) or not step in node:
+            return
+        keys = (step,)
+
+    for k in keys:
+        if rest:
+            _slots(node[k], rest, out)
+        elif node[k] != None:
+            out.append((node, k))
+
+class JSONTransformer:
+    """
+    Encrypt or decrypt the mapped fields of JSON records
+
+    mapping is a dictionary of JSON paths to structured dataset names.
+    A path that is mapped to None is encrypted with unstructured
+    encryption instead. Fields that are missing or null are left alone.
+    """
+    def __init__(self, creds, mapping, ENC = True, twk = None,
+                 window = WINDOW):
+        if not creds.set():
+            raise RuntimeError("credentials not set")
+
+        # importing structured encryption takes a while; only do it
+        # when a transformer is made
+        from .structured.client import Client
+
+        self._creds = creds
+        self._client = Client(creds)
+        self._paths = [(compilePath(path), target)
+                       for path, target in mapping.items()]
+        self._enc = ENC
+        self._twk = twk
+        self._decryption = None
+        self.window = window
+
+    def _structured(self, dataset_name, values):
+        for v in values:
+            if not isinstance(v, str):
+                raise RuntimeError(
+                    'Structured values must be strings: %r' % (v,))
+        if self._enc:
+            return self._client.EncryptMany(dataset_name, values, self._twk)
+        return self._client.DecryptMany(dataset_name, values, self._twk)
+
+    def _unstructured(self, values):
+        results = []
+        if self._enc:
+            enc = None
+            for i, v in enumerate(values):
+                # the server may allow fewer uses of a key than requested
+                if enc is None or enc.exhausted:
+                    enc = encryption(self._creds, len(values) - i)
+                ct = (enc.begin() +
+                      enc.update(json.dumps(v).encode('utf-8')) +
+                      enc.end())
+                results.append(base64.b64encode(ct).decode('ascii'))
+        else:
+            # the decryption object keeps the data key between values
+            # that were encrypted with the same one
+            if self._decryption is None:
+                self._decryption = decryption(self._creds)
+            dec = self._decryption
+            for v in values:
+                pt = (dec.begin() + dec.update(base64.b64decode(v)) +
+                      dec.end())
+                results.append(json.loads(pt.decode('utf-8')))
+        return results
+
+    def Transform(self, records):
+        """
+        Encrypt or decrypt the fields of a list of records, in place,
+        with one call per dataset. Returns the number of values changed
+        """
+        groups = {}
+        for record in records:
+            for steps, target in self._paths:
+                _slots(record, steps, groups.setdefault(target, []))
+
+        count = 0
+        for target, slots in groups.items():
+            if not slots:
+                continue
+            values = [c[k] for c, k in slots]
+            if target is None:
+                results = self._unstructured(values)
+            else:
+                results = self._structured(target, values)
+            for (c, k), v in zip(slots, results):
+                c[k] = v
+            count += len(slots)
+
+        if self._creds.configuration.get_event_reporting_synchronous():
+            self._creds.process_events()
+        return count
+
+    def Records(self, records):
+        """
+        Transform an iterable of records a window at a time, yielding
+        each record once its window is done
+        """
+        window = []
+        for record in records:
+            window.append(record)
+            if len(window) >= self.window:
+                self.Transform(window)
+                yield from window
+                window = []
+        if window:
+            self.Transform(window)
+            yield from window
+
+    def Stream(self, src, dst, progress = None):
+        """
+        Transform newline delimited JSON from src to dst. Blank lines
+        are dropped. Returns the number of records and values and the
+        records per second; progress, if given, is called with them
+        after each window is written.
+        """
+        binary = not isinstance(dst, io.TextIOBase) and isinstance(
+            dst, (io.RawIOBase, io.BufferedIOBase))
+
+        stats = {'records': 0, 'values': 0, 'seconds': 0.0,
+                 'records_per_second': 0.0}
+        start = time.perf_counter()
+
+        def flush(window):
+            stats['values'] += self.Transform(window)
+            out = ''.join(json.dumps(r, ensure_ascii=False) + '\n'
+                          for r in window)
+            dst.write(out.encode('utf-8') if binary else out)
+
+            stats['records'] += len(window)
+            stats['seconds'] = time.perf_counter() - start
+            stats['records_per_second'] = (
+                stats['records'] / max(stats['seconds'], 1e-9))
+            if progress:
+                progress(dict(stats))
+
+        window = []
+        for line in src:
+            if not line.strip():
+                continue
+            window.append(json.loads(line))
+            if len(window) >= self.window:
+                flush(window)
+                window = []
+        if window:
+            flush(window)
+        return stats
+
+def EncryptNDJSON(creds, src, dst, mapping, twk = None, window = WINDOW,
+                  progress = None):
+    """Encrypt the mapped fields of newline delimited JSON records"""
+    return JSONTransformer(creds, mapping, True, twk, window).Stream(
+        src, dst, progress)
+
+def DecryptNDJSON(creds, src, dst, mapping, twk = None, window = WINDOW,
+                  progress = None):
+    """Decrypt the mapped fields of newline delimited JSON records"""
+    return JSONTransformer(creds, mapping, False, twk, window).Stream(
+        src, dst, progress)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import unittest
+import unittest.mock
+
+import importlib
+jsonstream = importlib.import_module('ubiq_security.jsonstream')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class _Encryption:
+    # stands in for the unstructured encryption object, which needs the
+    # server for its key; it allows two uses per key
+    keys = 0
+
+    def __init__(self, creds, uses):
+        _Encryption.keys += 1
+        self.uses = 0
+        self.max_uses = min(uses, 2)
+
+    @property
+    def exhausted(self):
+        return self.uses >= self.max_uses
+
+    def begin(self):
+        self.uses += 1
+        return b'hdr:'
+
+    def update(self, data):
+        return bytes(reversed(data))
+
+    def end(self):
+        return b''
+
+class _Decryption:
+    def __init__(self, creds):
+        pass
+
+    def begin(self):
+        return b''
+
+    def update(self, data):
+        assert data.startswith(b'hdr:')
+        return bytes(reversed(data[4:]))
+
+    def end(self):
+        return b''
+
+class TestJSON(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [encrypt, decrypt])
+        patches = [
+            unittest.mock.patch.object(jsonstream, 'encryption', _Encryption),
+            unittest.mock.patch.object(jsonstream, 'decryption', _Decryption),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_paths(self):
+        self.assertEqual(jsonstream.compilePath('$.customer.ssn'),
+                         ('customer', 'ssn'))
+        self.assertEqual(jsonstream.compilePath("$.items[*]['card no'][0]"),
+                         ('items', None, 'card no', 0))
+        for path in ['customer.ssn', '$', '$.a..b', '$.a[x]']:
+            self.assertRaises(RuntimeError, jsonstream.compilePath, path)
+
+    def test_stream(self):
+        records = []
+        for i in range(25):
+            records.append({
+                'id': i,
+                'customer': {'ssn': '%03d-45-6789' % (i) if i % 4 else None,
+                             'name': 'n%d' % (i)},
+                'cards': [{'ssn': '%03d-11-2222' % (j)} for j in range(i % 3)],
+                'notes': {'text': 'note %d' % (i), 'n': i} if i % 2 else 'x',
+            })
+        src = io.StringIO(''.join(json.dumps(r) + '\n\n' for r in records))
+        mapping = {'$.customer.ssn': 'SSN', '$.cards[*].ssn': 'SSN',
+                   '$.missing.ssn': 'SSN', '$.notes': None}
+
+        creds = testutil.Creds()
+        _Encryption.keys = 0
+        dst = io.BytesIO()
+        progress = []
+        stats = jsonstream.EncryptNDJSON(creds, src, dst, mapping,
+                                         window = 10,
+                                         progress = progress.append)
+        self.assertEqual(stats['records'], 25)
+        self.assertEqual([p['records'] for p in progress], [10, 20, 25])
+        self.assertEqual(stats['values'], 18 + 24 + 25)
+
+        # one structured event per window, not per value
+        structured = [e['count'] for e in creds.events
+                      if e['dataset_type'] == 'structured']
+        self.assertEqual(len(structured), 3)
+        self.assertEqual(sum(structured), 18 + 24)
+        # ten unstructured values per window, at two uses per key
+        self.assertEqual(_Encryption.keys, 5 + 5 + 3)
+
+        out = [json.loads(l) for l in dst.getvalue().decode().splitlines()]
+        for r, e in zip(records, out):
+            self.assertEqual(e['id'], r['id'])
+            self.assertEqual(e['customer']['name'], r['customer']['name'])
+            if r['customer']['ssn']:
+                self.assertEqual(e['customer']['ssn'], encrypt.Encrypt(
+                    creds, 'SSN', r['customer']['ssn']))
+            else:
+                self.assertIsNone(e['customer']['ssn'])
+            for ec, rc in zip(e['cards'], r['cards']):
+                self.assertEqual(ec['ssn'],
+                                 encrypt.Encrypt(creds, 'SSN', rc['ssn']))
+            self.assertNotEqual(e['notes'], r['notes'])
+
+        back = io.StringIO()
+        jsonstream.DecryptNDJSON(creds, io.StringIO(dst.getvalue().decode()),
+                                 back, mapping, window = 7)
+        self.assertEqual([json.loads(l) for l in back.getvalue().splitlines()],
+                         records)
+
+if __name__ == '__main__':
+    unittest.main()
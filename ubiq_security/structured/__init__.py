@@ -1,4 +1,15 @@
 #!/usr/bin/env python3
 
 from .encrypt import Encryption, Encrypt, EncryptForSearch
+from .encrypt import EncryptMany, EncryptIter
+from .encrypt import EncryptForSearchMany, EncryptForSearchChunks
 from .decrypt import Decryption, Decrypt
+from .decrypt import DecryptMany, DecryptIter
+from .column import DecryptedColumn, DecryptLazy
+from .frame import EncryptSeries, DecryptSeries, EncryptArrow, DecryptArrow
+from .csvstream import EncryptCSV, DecryptCSV
+from .reencrypt import ReEncryption, ReEncrypt
+from .client import Client
+from .pool import ProcessPool
+from .coalesce import Coalescer
+from .codebook import BuildCodebook
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Fixtures shared by the unit tests of structured encryption and of the
+# modules built on it. Nothing here talks to the server. Like the tests,
+# this module is left out of the distribution (see setup.py).
+
+import base64
+import os
+import tempfile
+import unittest.mock
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from .. import configuration
+from . import common
+
+# nine digits, with the key number in the first character
+DATASET = {
+    'name': 'SSN', 'encryption_algorithm': 'FF1',
+    'passthrough': '-',
+    'input_character_set': '0123456789',
+    'output_character_set': '0123456789',
+    'min_input_length': 9, 'max_input_length': 9,
+    'tweak': base64.b64encode(bytes(range(8))).decode(),
+    'tweak_min_len': 0, 'tweak_max_len': 16,
+    'msb_encoding_bits': 32,
+}
+
+KEY = {'key_number': 0, 'unwrapped_data_key': bytes(32)}
+
+class Creds:
+    """
+    Credentials for tests
+
+    config_dict is passed to the configuration. Events are not reported;
+    the arguments of each add_event call are kept in events.
+    """
+    def __init__(self, config_dict = None, papi = 'papi'):
+        self.access_key_id = papi
+        self.host = 'https://localhost'
+        self.secret_signing_key = 'sapi'
+        self.secret_crypto_access_key = 'srsa'
+        self.configuration = configuration.ubiqConfiguration(
+            config_file=os.path.join(tempfile.gettempdir(), 'none'),
+            config_dict=config_dict)
+        self.events = []
+
+    def set(self):
+        return True
+
+    def add_event(self, **kwargs):
+        self.events.append(kwargs)
+
+    def count(self):
+        """Return the number of values that the events stand for"""
+        return sum(e['count'] for e in self.events)
+
+def wrapKeys(keys, secret = 'srsa'):
+    """
+    Wrap data keys the way that the server does
+
+    Returns the PEM of a new private key, encrypted with secret, and the
+    list of the data keys encrypted with its public key, in base64.
+    """
+    prv = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    oaep = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA1()),
+                        algorithm=hashes.SHA1(), label=None)
+    pem = prv.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.BestAvailableEncryption(secret.encode())).decode()
+    return pem, [base64.b64encode(prv.public_key().encrypt(k, oaep)).decode()
+                 for k in keys]
+
+class Fetches:
+    """
+    Stand in for the server until the end of test
+
+    fetchDataset, as imported by each of modules, returns dataset.
+    fetchKey returns keys[n], or the key with the highest number for the
+    current key, and fetchAllKeys returns all of keys; both are replaced
+    in common and in those of modules that import them. The names and
+    the key numbers that are asked for are kept in datasets and numbers.
+    The key caches are flushed before and after the test.
+    """
+    def __init__(self, test, modules, dataset = DATASET, keys = None):
+        self.dataset = dataset
+        self.keys = keys if keys != None else {0: KEY}
+        self.datasets = []
+        self.numbers = []
+
+        # functions, not methods: flushKey sets attributes of fetchKey
+        def fetchDataset(creds, name):
+            self.datasets.append(name)
+            return self.dataset
+        def fetchKey(creds, name, n = -1, refresh = False):
+            self.numbers.append(n)
+            return self.keys[max(self.keys) if n == -1 else n]
+        def fetchAllKeys(creds, name):
+            return dict(self.keys)
+
+        patches = [unittest.mock.patch.object(m, 'fetchDataset', fetchDataset)
+                   for m in modules]
+        for m in [common] + list(modules):
+            for name, f in (('fetchKey', fetchKey),
+                            ('fetchAllKeys', fetchAllKeys)):
+                if hasattr(m, name):
+                    patches.append(unittest.mock.patch.object(m, name, f))
+        for p in patches:
+            p.start()
+            test.addCleanup(p.stop)
+        common.flushKey()
+        test.addCleanup(common.flushKey)
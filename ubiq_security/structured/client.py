@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+from .encrypt import Encryption
+from .decrypt import Decryption
+
+class Client:
+    """
+    Long-lived structured encryption client
+
+    Encrypt and Decrypt build new Encryption and Decryption objects, with
+    their keys and FF1 contexts, for every call. A Client keeps them for
+    each dataset that it is used with and hands the same objects to all
+    callers, including callers on different threads. The objects are
+    replaced when the key cache TTL from the configuration expires, or
+    on every call if structured key caching is disabled. Encryption
+    objects hold the current key, so they are replaced as often as the
+    pointer to the current key is checked (current_ttl_seconds).
+    """
+    def __init__(self, creds):
+        if not creds.set():
+            raise RuntimeError("credentials not set")
+
+        self._creds = creds
+        self._lock = threading.Lock()
+        # dataset name -> (expiration time, object)
+        self._encryption = {}
+        self._decryption = {}
+
+    def _get(self, cache, cls, dataset_name, current = False):
+        entry = cache.get(dataset_name)
+        if entry is None or entry[0] < time.time():
+            with self._lock:
+                entry = cache.get(dataset_name)
+                if entry is None or entry[0] < time.time():
+                    config = self._creds.configuration
+                    ttl = 0
+                    if config.key_caching_structured:
+                        ttl = config.key_caching_ttl_seconds
+                        if current:
+                            ttl = min(ttl, config.key_caching_current_ttl_seconds)
+                    obj = cls(self._creds, dataset_name)
+                    entry = (time.time() + ttl, obj)
+                    cache[dataset_name] = entry
+        return entry[1]
+
+    def Encryption(self, dataset_name):
+        """Return the Encryption object for the dataset"""
+        return self._get(self._encryption, Encryption, dataset_name, True)
+
+    def Decryption(self, dataset_name):
+        """Return the Decryption object for the dataset"""
+        return self._get(self._decryption, Decryption, dataset_name)
+
+    def _sync(self):
+        if self._creds.configuration.get_event_reporting_synchronous():
+            self._creds.process_events()
+
+    def Encrypt(self, dataset_name, pt, twk = None):
+        result = self.Encryption(dataset_name).Cipher(pt, twk)
+        self._sync()
+        return result
+
+    def EncryptForSearch(self, dataset_name, pt, twk = None):
+        result = self.Encryption(dataset_name).CipherForSearch(pt, twk)
+        self._sync()
+        return result
+
+    def Decrypt(self, dataset_name, ct, twk = None):
+        result = self.Decryption(dataset_name).Cipher(ct, twk)
+        self._sync()
+        return result
+
+    def EncryptMany(self, dataset_name, pts, twk = None):
+        result = self.Encryption(dataset_name).CipherMany(list(pts), twk)
+        self._sync()
+        return result
+
+    def DecryptMany(self, dataset_name, cts, twk = None):
+        result = self.Decryption(dataset_name).CipherMany(list(cts), twk)
+        self._sync()
+        return result
+
+    def Flush(self, dataset_name = None):
+        """
+        Drop the objects for the dataset, or for all datasets, so that
+        they are fetched again on next use
+        """
+        with self._lock:
+            if dataset_name == None:
+                self._encryption = {}
+                self._decryption = {}
+            else:
+                self._encryption.pop(dataset_name, None)
+                self._decryption.pop(dataset_name, None)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+import importlib
+client = importlib.import_module('ubiq_security.structured.client')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        self.server = testutil.Fetches(self, [encrypt, decrypt])
+
+    def test_reuse(self):
+        creds = testutil.Creds()
+        c = client.Client(creds)
+
+        ct = c.Encrypt('SSN', '123-45-6789')
+        self.assertEqual(ct, encrypt.Encrypt(creds, 'SSN', '123-45-6789'))
+        self.server.datasets = []
+
+        errors = []
+        def run():
+            for i in range(200):
+                pt = '%03d-45-%04d' % (i, i)
+                if c.Decrypt('SSN', c.Encrypt('SSN', pt)) != pt:
+                    errors.append(pt)
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        # one Decryption object; the Encryption object already existed
+        self.assertEqual(len(self.server.datasets), 1)
+        self.assertIs(c.Encryption('SSN'), c.Encryption('SSN'))
+        self.assertEqual(creds.count(), 2 + 1600)
+
+        c.Flush('SSN')
+        c.Encrypt('SSN', '123-45-6789')
+        self.assertEqual(len(self.server.datasets), 2)
+
+    def test_many(self):
+        creds = testutil.Creds()
+        pts = ['%03d-45-%04d' % (i, i * 7) for i in range(500)]
+        c = client.Client(creds)
+        cts = c.EncryptMany('SSN', pts)
+        self.assertEqual(cts, encrypt.EncryptMany(creds, 'SSN', pts))
+        self.assertEqual(c.DecryptMany('SSN', cts), pts)
+        self.assertEqual(creds.count(), 3 * 500)
+
+    def test_expiry(self):
+        creds = testutil.Creds({'key_caching': {'ttl_seconds': 0.05}})
+        c = client.Client(creds)
+        c.Encrypt('SSN', '123-45-6789')
+        c.Encrypt('SSN', '123-45-6789')
+        self.assertEqual(len(self.server.datasets), 1)
+        time.sleep(0.1)
+        c.Encrypt('SSN', '123-45-6789')
+        self.assertEqual(len(self.server.datasets), 2)
+
+        creds = testutil.Creds({'key_caching': {'structured': False}})
+        c = client.Client(creds)
+        c.Encrypt('SSN', '123-45-6789')
+        c.Encrypt('SSN', '123-45-6789')
+        self.assertEqual(len(self.server.datasets), 4)
+
+if __name__ == '__main__':
+    unittest.main()
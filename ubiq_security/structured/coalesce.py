@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Micro-batching of single structured encrypt and decrypt requests.
+#
+# Every call to Encrypt or Decrypt pays a fixed cost for formatting,
+# fetching its context and recording its event, and callers on different
+# threads contend for the same locks. A Coalescer queues the values
+# submitted by many threads (or asyncio tasks) and hands them to
+# EncryptMany and DecryptMany from one background thread, either when
+# enough of them are waiting or when the oldest one has waited long
+# enough. Each caller gets a future for its own value.
+
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+
+from .client import Client
+
+ENCRYPT = 'encrypt'
+DECRYPT = 'decrypt'
+
+# largest number of values processed together
+MAX_BATCH = 256
+# longest time, in seconds, that a value waits for others to join it
+MAX_WAIT = 0.0005
+
+class Coalescer:
+    """
+    Collect single values from many callers and encrypt or decrypt them
+    in batches
+
+    A batch is processed when max_batch values are waiting or when the
+    first of them has waited max_wait seconds. Values for different
+    datasets, tweaks and operations can share a batch; they are grouped
+    before they are processed. Results are the same as those of Encrypt
+    and Decrypt.
+    """
+    def __init__(self, creds, max_batch = MAX_BATCH, max_wait = MAX_WAIT):
+        if max_batch < 1:
+            raise RuntimeError('max_batch must be at least 1')
+
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._client = Client(creds)
+        self._cond = threading.Condition()
+        # (deadline, op, dataset name, tweak, value, future)
+        self._queue = collections.deque()
+        self._closed = False
+
+        self._batches = 0
+        self._values = 0
+        self._largest = 0
+        self._deepest = 0
+        self._full = 0
+        self._expired = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='ubiq-coalescer')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Process the values that are still queued and stop the
+        background thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def Submit(self, dataset_name, value, twk = None, op = ENCRYPT):
+        """
+        Queue a value and return a concurrent.futures.Future for its
+        result
+        """
+        if op != ENCRYPT and op != DECRYPT:
+            raise RuntimeError('unsupported operation: %s' % (op))
+        if twk != None:
+            twk = bytes(twk)
+
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('coalescer is closed')
+            self._queue.append((time.monotonic() + self.max_wait,
+                                op, dataset_name, twk, value, future))
+            depth = len(self._queue)
+            if depth > self._deepest:
+                self._deepest = depth
+            # the thread waits without a timeout when the queue is
+            # empty, and until the deadline of the first value otherwise
+            if depth == 1 or depth == self.max_batch:
+                self._cond.notify()
+        return future
+
+    def Encrypt(self, dataset_name, pt, twk = None):
+        return self.Submit(dataset_name, pt, twk, ENCRYPT).result()
+
+    def Decrypt(self, dataset_name, ct, twk = None):
+        return self.Submit(dataset_name, ct, twk, DECRYPT).result()
+
+    async def EncryptAsync(self, dataset_name, pt, twk = None):
+        return await asyncio.wrap_future(
+            self.Submit(dataset_name, pt, twk, ENCRYPT))
+
+    async def DecryptAsync(self, dataset_name, ct, twk = None):
+        return await asyncio.wrap_future(
+            self.Submit(dataset_name, ct, twk, DECRYPT))
+
+    def Stats(self):
+        """Return queue depth and batch size metrics"""
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self._deepest,
+                'batches': self._batches,
+                'values': self._values,
+                'mean_batch_size':
+                    self._values / self._batches if self._batches else 0.0,
+                'max_batch_size': self._largest,
+                # number of batches started because they were full and
+                # because their first value reached its deadline
+                'full_batches': self._full,
+                'expired_batches': self._expired,
+            }
+
+    def _next(self):
+        # -> list of queued requests, or None when closed and drained
+        with self._cond:
+            while True:
+                if len(self._queue) >= self.max_batch:
+                    self._full += 1
+                    break
+                if self._queue:
+                    wait = self._queue[0][0] - time.monotonic()
+                    if wait <= 0 or self._closed:
+                        self._expired += 1
+                        break
+                    self._cond.wait(wait)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            batch = [self._queue.popleft()
+                     for i in range(min(self.max_batch, len(self._queue)))]
+            self._batches += 1
+            self._values += len(batch)
+            if len(batch) > self._largest:
+                self._largest = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next()
+            if batch is None:
+                break
+
+            groups = {}
+            for req in batch:
+                if req[5].set_running_or_notify_cancel():
+                    groups.setdefault(req[1:4], []).append(req)
+            for (op, dataset_name, twk), reqs in groups.items():
+                self._process(op, dataset_name, twk, reqs)
+
+    def _process(self, op, dataset_name, twk, reqs):
+        if op == ENCRYPT:
+            many = self._client.EncryptMany
+        else:
+            many = self._client.DecryptMany
+
+        try:
+            results = many(dataset_name, [req[4] for req in reqs], twk)
+        except Exception as e:
+            if len(reqs) == 1:
+                reqs[0][5].set_exception(e)
+                return
+            # an invalid value fails the whole batch; process the values
+            # one at a time so that only its caller sees the error
+            for req in reqs:
+                self._process(op, dataset_name, twk, [req])
+            return
+
+        for req, result in zip(reqs, results):
+            req[5].set_result(result)
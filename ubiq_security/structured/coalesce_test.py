@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import unittest
+
+import importlib
+coalesce = importlib.import_module('ubiq_security.structured.coalesce')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestCoalescer(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [encrypt, decrypt])
+
+    def test_threads(self):
+        creds = testutil.Creds()
+        pts = ['%03d-45-%04d' % (i, i * 7) for i in range(800)]
+        cts = encrypt.EncryptMany(creds, 'SSN', pts)
+        creds.events = []
+
+        errors = []
+        with coalesce.Coalescer(creds, max_batch = 64,
+                                max_wait = 0.01) as c:
+            def run(k):
+                for i in range(k, len(pts), 8):
+                    if c.Encrypt('SSN', pts[i]) != cts[i]:
+                        errors.append(i)
+                    if c.Decrypt('SSN', cts[i]) != pts[i]:
+                        errors.append(i)
+            threads = [threading.Thread(target=run, args=(k,))
+                       for k in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            stats = c.Stats()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(stats['values'], 1600)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertLessEqual(stats['max_batch_size'], 64)
+        # the eight callers share batches, and events
+        self.assertGreater(stats['mean_batch_size'], 1)
+        self.assertEqual(creds.count(), 1600)
+        self.assertLess(len(creds.events), 1600)
+
+    def test_full(self):
+        creds = testutil.Creds()
+        with coalesce.Coalescer(creds, max_batch = 10, max_wait = 60) as c:
+            futures = [c.Submit('SSN', '%03d-45-6789' % (i))
+                       for i in range(20)]
+            results = [f.result(timeout = 10) for f in futures]
+            stats = c.Stats()
+        self.assertEqual(results,
+                         encrypt.EncryptMany(creds, 'SSN',
+                                             ['%03d-45-6789' % (i)
+                                              for i in range(20)]))
+        self.assertEqual(stats['full_batches'], 2)
+        self.assertGreaterEqual(stats['max_queue_depth'], 10)
+
+    def test_errors(self):
+        creds = testutil.Creds()
+        with coalesce.Coalescer(creds, max_wait = 0.01) as c:
+            good = c.Submit('SSN', '123-45-6789')
+            bad = c.Submit('SSN', '123')
+            self.assertEqual(good.result(),
+                             encrypt.Encrypt(creds, 'SSN', '123-45-6789'))
+            self.assertRaises(RuntimeError, bad.result)
+        self.assertRaises(RuntimeError, c.Submit, 'SSN', '123-45-6789')
+
+    def test_asyncio(self):
+        creds = testutil.Creds()
+        pts = ['%03d-45-%04d' % (i, i) for i in range(100)]
+
+        async def run(c):
+            cts = await asyncio.gather(
+                *[c.EncryptAsync('SSN', pt) for pt in pts])
+            return cts, await asyncio.gather(
+                *[c.DecryptAsync('SSN', ct) for ct in cts])
+
+        with coalesce.Coalescer(creds) as c:
+            cts, results = asyncio.run(run(c))
+        self.assertEqual(results, pts)
+        self.assertEqual(cts, encrypt.EncryptMany(creds, 'SSN', pts))
+
+if __name__ == '__main__':
+    unittest.main()
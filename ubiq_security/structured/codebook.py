@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# Codebook mode for structured datasets with a small domain.
+#
+# For a given key and tweak, FF1 over strings of length n is a fixed
+# permutation of the radix**n possible inputs. When that domain is small,
+# the permutation (and its inverse) can be computed once and stored, and
+# encryption and decryption become table lookups.
+#
+# The tables are kept in a memory mapped file so that every process on
+# the host shares a single copy. A codebook is equivalent to the data key
+# for its domain: anyone who can read the file can encrypt and decrypt
+# those values. Files are created with owner-only permissions in a
+# directory that is also owner-only.
+#
+# A table that is not on disk yet is built in a background thread; FF1
+# is used until it is ready. BuildCodebook builds one up front, across
+# several processes.
+
+import array
+import base64
+import glob
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import struct
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .common import aesBackend, fetchDataset, fetchContext
+from .lib import ff1, ffx
+
+MAGIC = b'UBIQCB01'
+HEADER = struct.Struct('=8sQ')
+
+# number of values encrypted per unit of work while building
+CHUNK = 1 << 16
+
+class Codebook:
+    """
+    Forward and inverse FF1 tables for one key, tweak and input length
+
+    The tables are arrays of 32-bit unsigned integers in a read-only
+    memory map: the forward table at index i holds the number of the
+    ciphertext for the plaintext numbered i, and the inverse table holds
+    the reverse mapping.
+    """
+    def __init__(self, path, alpha, n):
+        self.path = path
+        self.n = n
+        self.converter = ffx.RadixConverter(len(alpha), alpha)
+
+        size = len(alpha) ** n
+        with open(path, 'rb') as f:
+            # a truncated (or empty) file cannot be mapped as a whole
+            if os.fstat(f.fileno()).st_size != HEADER.size + 8 * size:
+                raise RuntimeError('Invalid codebook file: %s' % (path))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or count != size:
+            self._mmap.close()
+            raise RuntimeError('Invalid codebook file: %s' % (path))
+
+        tables = memoryview(self._mmap)[HEADER.size:].cast('I')
+        self._fwd = tables[:size]
+        self._inv = tables[size:]
+
+    def Encrypt(self, pt):
+        conv = self.converter
+        return conv.NumberToString(self._fwd[conv.StringToNumber(pt)], self.n)
+
+    def Decrypt(self, ct):
+        conv = self.converter
+        return conv.NumberToString(self._inv[conv.StringToNumber(ct)], self.n)
+
+    # the tweak is part of the codebook; the argument is accepted so that
+    # a codebook can be used in place of an ff1.Context
+    def EncryptMany(self, pts, twk = None):
+        return [self.Encrypt(pt) for pt in pts]
+
+    def DecryptMany(self, cts, twk = None):
+        return [self.Decrypt(ct) for ct in cts]
+
+def _init(key, twk, mintwklen, maxtwklen, alpha, backend):
+    # runs once in each worker process
+    _init.ctx = ff1.Context(key, twk, mintwklen, maxtwklen, len(alpha), alpha,
+                            backend=backend)
+    _init.twk = twk
+
+def _fill(args):
+    path, n, start, end = args
+
+    ctx = _init.ctx
+    conv = ctx.ffx.converter
+    size = conv.radix ** n
+
+    pts = [conv.NumberToString(i, n) for i in range(start, end)]
+    cts = ctx.EncryptMany(pts, _init.twk)
+
+    # each plaintext (and so each ciphertext) belongs to exactly one
+    # chunk, so workers never write to the same entries
+    with open(path, 'r+b') as f:
+        m = mmap.mmap(f.fileno(), 0)
+        try:
+            tables = memoryview(m)[HEADER.size:].cast('I')
+            fwd = tables[:size]
+            inv = tables[size:]
+            for i, ct in zip(range(start, end), cts):
+                c = conv.StringToNumber(ct)
+                fwd[i] = c
+                inv[c] = i
+            fwd.release()
+            inv.release()
+            tables.release()
+        finally:
+            m.close()
+
+def Build(path, key, twk, mintwklen, maxtwklen, alpha, n, processes = None,
+          backend = None):
+    """
+    Compute the tables for the key, tweak, alphabet and length into path
+
+    The work is split across a pool of processes. The file is written
+    under a temporary name and moved into place once it is complete.
+    """
+    size = len(alpha) ** n
+    if size >= 2**32:
+        raise RuntimeError('Domain too large for a codebook')
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.ftruncate(fd, HEADER.size + 8 * size)
+        os.write(fd, HEADER.pack(b'\0' * len(MAGIC), size))
+    finally:
+        os.close(fd)
+
+    try:
+        work = [(tmp, n, i, min(i + CHUNK, size))
+                for i in range(0, size, CHUNK)]
+        # workers select the backend by name; the objects are per process
+        if backend != None and not isinstance(backend, str):
+            backend = backend.name
+        init = (key, twk, mintwklen, maxtwklen, alpha, backend)
+
+        if processes == None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(work))
+
+        if processes > 1:
+            with ProcessPoolExecutor(processes,
+                                     initializer=_init,
+                                     initargs=init) as pool:
+                list(pool.map(_fill, work))
+        else:
+            _init(*init)
+            for w in work:
+                _fill(w)
+
+        # the header is written last, marking the file complete
+        with open(tmp, 'r+b') as f:
+            f.write(HEADER.pack(MAGIC, size))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+def _open(config, path, alpha, n):
+    # the codebook in path, or None if there is no valid file
+    if not os.path.exists(path):
+        return None
+    try:
+        return Codebook(path, alpha, n)
+    except RuntimeError:
+        # left incomplete, e.g. by a full disk, or changed; it is
+        # built again
+        if config.logging_verbose:
+            print('****** INVALID CODEBOOK ----- %s' % (path))
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return None
+
+def _path(creds, dataset, key, n, twk):
+    # the name (identifying the table) and path of a codebook file
+    if twk == None:
+        twk = base64.b64decode(dataset['tweak'])
+
+    ident = json.dumps([creds.access_key_id, dataset['name'],
+                        int(key['key_number']), n, bytes(twk).hex()])
+    params = json.dumps([dataset['encryption_algorithm'],
+                         dataset['input_character_set'],
+                         dataset['tweak'],
+                         dataset['tweak_min_len'],
+                         dataset['tweak_max_len']])
+
+    config = creds.configuration
+    name = hashlib.sha256(ident.encode()).hexdigest()[:32]
+    return name, os.path.join(
+        config.codebook_directory, name + '-' + hmac.new(
+            key['unwrapped_data_key'], params.encode(),
+            hashlib.sha256).hexdigest()[:32])
+
+def _build(creds, dataset, key, n, twk, processes):
+    # build, unless another process already did, and open the codebook
+    config = creds.configuration
+    alpha = dataset['input_character_set']
+    name, path = _path(creds, dataset, key, n, twk)
+
+    cb = _open(config, path, alpha, n)
+    if cb is None:
+        if config.logging_verbose:
+            print('****** BUILDING CODEBOOK ----- %s (%d values)' %
+                  (dataset['name'], len(alpha) ** n))
+
+        os.makedirs(config.codebook_directory, mode=0o700,
+                    exist_ok=True)
+        for old in glob.glob(os.path.join(
+                config.codebook_directory, name + '-*')):
+            if not old.endswith('.tmp'):
+                os.unlink(old)
+
+        if twk == None:
+            twk = base64.b64decode(dataset['tweak'])
+        Build(path, key['unwrapped_data_key'], bytes(twk),
+              dataset['tweak_min_len'], dataset['tweak_max_len'],
+              alpha, n, processes=processes, backend=aesBackend(creds))
+        cb = Codebook(path, alpha, n)
+    return cb
+
+def _cacheKey(creds, dataset, key, n, twk):
+    # the cache key of a codebook, or None if there can be no codebook
+    config = creds.configuration
+    if not config.codebook_enabled:
+        return None
+
+    alpha = dataset['input_character_set']
+    if (len(alpha) ** n > config.codebook_max_domain_size or
+        len(alpha) ** n >= 2**32 or
+        array.array('I').itemsize != 4):
+        return None
+
+    if twk != None:
+        twk = bytes(twk)
+    # the data key is used as it is: a bytes object computes its hash
+    # once, so the key is not hashed again for every value
+    return (creds.access_key_id, dataset['name'],
+            dataset['encryption_algorithm'], alpha, dataset['tweak'],
+            dataset['tweak_min_len'], dataset['tweak_max_len'],
+            int(key['key_number']), key['unwrapped_data_key'], n, twk)
+
+def _store(k, cb):
+    with fetchCodebook.lock:
+        if len(fetchCodebook.cache) >= 256:
+            fetchCodebook.cache.clear()
+        fetchCodebook.cache[k] = cb
+        fetchCodebook.pending.discard(k)
+
+def _background(creds, dataset, key, n, twk, k):
+    try:
+        # a single process: forking from a thread of an application is
+        # not safe
+        _store(k, _build(creds, dataset, key, n, twk, 1))
+    except Exception as e:
+        # the codebook stays pending, and FF1 is used instead, until
+        # the cache is flushed
+        if creds.configuration.logging_verbose:
+            print('****** CODEBOOK FAILED ----- %s: %s' % (dataset['name'], e))
+
+def fetchCodebook(creds, dataset, key, n, twk = None):
+    """
+    Return the codebook for the dataset, key and input length, or None
+    if codebooks are disabled, the domain is too large or the codebook
+    is not ready
+
+    A codebook file that already exists is opened right away. Otherwise
+    it is built by a background thread, and None is returned, so that
+    the caller uses its FF1 context, until the table is complete; see
+    BuildCodebook to build one up front.
+
+    The file name is derived from the dataset, key number, length and
+    tweak (which identify the table) and from an HMAC over the dataset's
+    cipher parameters keyed with the data key (which identifies its
+    contents). A new key or a change to the dataset definition produces
+    a new file; the table it replaces is deleted.
+    """
+    k = _cacheKey(creds, dataset, key, n, twk)
+    if k is None:
+        return None
+
+    cb = fetchCodebook.cache.get(k)
+    if cb is None and not k in fetchCodebook.pending:
+        # only this codebook is locked while it is looked for, or built
+        with fetchCodebook.lock:
+            if k in fetchCodebook.pending or k in fetchCodebook.cache:
+                return fetchCodebook.cache.get(k)
+            fetchCodebook.pending.add(k)
+
+        try:
+            name, path = _path(creds, dataset, key, n, twk)
+            cb = _open(creds.configuration, path,
+                       dataset['input_character_set'], n)
+        except:
+            with fetchCodebook.lock:
+                fetchCodebook.pending.discard(k)
+            raise
+
+        if cb is not None:
+            _store(k, cb)
+        else:
+            threading.Thread(target=_background,
+                             args=(creds, dataset, key, n, twk, k),
+                             daemon=True).start()
+    return cb
+fetchCodebook.cache = {}
+fetchCodebook.pending = set()
+fetchCodebook.lock = threading.Lock()
+
+def BuildCodebook(creds, dataset_name, n, twk = None, processes = None):
+    """
+    Build the codebook for values of length n of a dataset, with its
+    current key, and wait for it to be ready
+
+    Unlike the codebooks that are built when values are encrypted, the
+    work is split across processes, one per CPU by default. Returns the
+    codebook, or None if codebooks are disabled or the domain is too
+    large.
+    """
+    dataset = fetchDataset(creds, dataset_name)
+    key, _ = fetchContext(creds, dataset)
+    k = _cacheKey(creds, dataset, key, n, twk)
+    if k is None:
+        return None
+
+    cb = fetchCodebook.cache.get(k)
+    if cb is None:
+        cb = _build(creds, dataset, key, n, twk, processes)
+        _store(k, cb)
+    return cb
+
+def flushCodebook():
+    with fetchCodebook.lock:
+        fetchCodebook.cache = {}
+        fetchCodebook.pending = set()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import base64
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import importlib
+codebook = importlib.import_module('ubiq_security.structured.codebook')
+ff1 = importlib.import_module('ubiq_security.structured.lib.ff1')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestCodebook(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.creds = testutil.Creds({'codebook': {
+            'enabled': True,
+            'max_domain_size': 10**6,
+            'directory': os.path.join(self.dir, 'codebooks')}})
+        self.dataset = {
+            'name': 'TEST', 'encryption_algorithm': 'FF1',
+            'input_character_set': '0123456789',
+            'tweak': base64.b64encode(bytes(range(8))).decode(),
+            'tweak_min_len': 0, 'tweak_max_len': 16}
+        self.key = {'key_number': 0, 'unwrapped_data_key': bytes(range(16))}
+        codebook.flushCodebook()
+
+    def tearDown(self):
+        codebook.flushCodebook()
+        shutil.rmtree(self.dir)
+
+    def fetch(self, n):
+        # codebooks are built in the background; FF1 is used until then
+        for i in range(6000):
+            cb = codebook.fetchCodebook(self.creds, self.dataset, self.key, n)
+            if cb:
+                return cb
+            time.sleep(0.01)
+        self.fail('codebook was not built')
+
+    def test_matches_ff1(self):
+        self.assertIsNone(
+            codebook.fetchCodebook(self.creds, self.dataset, self.key, 6))
+        cb = self.fetch(6)
+        ctx = ff1.Context(self.key['unwrapped_data_key'], bytes(range(8)),
+                          0, 16, 10)
+        for i in range(0, 10**6, 9973):
+            pt = '%06d' % (i)
+            ct = ctx.Encrypt(pt)
+            self.assertEqual(cb.Encrypt(pt), ct)
+            self.assertEqual(cb.Decrypt(ct), pt)
+
+        self.assertIs(
+            codebook.fetchCodebook(self.creds, self.dataset, self.key, 6), cb)
+        self.assertEqual(os.stat(cb.path).st_mode & 0o777, 0o600)
+
+        # a new key replaces the table
+        self.key['unwrapped_data_key'] = bytes(range(1, 17))
+        cb2 = self.fetch(6)
+
+        self.assertNotEqual(cb.path, cb2.path)
+        self.assertFalse(os.path.exists(cb.path))
+        self.assertNotEqual(cb.Encrypt('123456'), cb2.Encrypt('123456'))
+
+    def test_invalid_file(self):
+        cb = self.fetch(6)
+        ct = cb.Encrypt('123456')
+        path = cb.path
+
+        # a truncated file, and one with a bad header, are built again
+        for damage in (lambda f: f.truncate(100),
+                       lambda f: f.write(b'XXXXXXXX')):
+            codebook.flushCodebook()
+            with open(path, 'r+b') as f:
+                damage(f)
+            self.assertRaises(RuntimeError, codebook.Codebook, path,
+                              '0123456789', 6)
+            cb = self.fetch(6)
+            self.assertEqual(cb.path, path)
+            self.assertEqual(cb.Encrypt('123456'), ct)
+
+    def test_build(self):
+        dataset = dict(testutil.DATASET, min_input_length=6,
+                       max_input_length=6, **self.dataset)
+        testutil.Fetches(self, [codebook], dataset, {0: self.key})
+
+        cb = codebook.BuildCodebook(self.creds, 'TEST', 6, processes=2)
+        # the codebook is ready for encryption
+        self.assertIs(
+            codebook.fetchCodebook(self.creds, dataset, self.key, 6), cb)
+        self.assertIsNone(codebook.BuildCodebook(self.creds, 'TEST', 7))
+
+    def test_domain_too_large(self):
+        self.assertIsNone(
+            codebook.fetchCodebook(self.creds, self.dataset, self.key, 7))
+
+    def test_disabled(self):
+        self.assertIsNone(codebook.fetchCodebook(
+            testutil.Creds(), self.dataset, self.key, 6))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import collections.abc
+
+from .common import BATCH
+from .decrypt import Decryption
+
+# marks values that have not been decrypted
+_MISSING = object()
+
+class DecryptedColumn(collections.abc.Sequence):
+    """
+    Read-only sequence of the plain texts of a list of cipher texts
+
+    Values are decrypted when they are first accessed and kept. Slices
+    decrypt all of their missing values together, and iteration decrypts
+    batch_size values at a time, so paging through a large column costs
+    only the pages that are read. The Decryption object, and so the
+    dataset and its keys, is not fetched until the first access.
+
+    A column is not safe to use from several threads at once.
+    """
+    def __init__(self, creds, dataset_name, cts, twk = None,
+                 batch_size = BATCH):
+        if not creds.set():
+            raise RuntimeError("credentials not set")
+
+        self._creds = creds
+        self._dataset_name = dataset_name
+        self._twk = twk
+        self._cts = list(cts)
+        self._pts = [_MISSING] * len(self._cts)
+        self._decryption = None
+        self.batch_size = batch_size
+        # number of values that have been decrypted
+        self.decrypted = 0
+
+    def __len__(self):
+        return len(self._cts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            idx = range(*i.indices(len(self._cts)))
+            self._fetch(idx)
+            return [self._pts[j] for j in idx]
+
+        if i < 0:
+            i += len(self._cts)
+        if i < 0 or i >= len(self._cts):
+            raise IndexError('column index out of range')
+        if self._pts[i] is _MISSING:
+            self._fetch((i,))
+        return self._pts[i]
+
+    def __iter__(self):
+        for i in range(0, len(self._cts), self.batch_size):
+            yield from self[i:i + self.batch_size]
+
+    def Ciphertexts(self):
+        """Return the cipher texts, without decrypting them"""
+        return list(self._cts)
+
+    def _fetch(self, idx):
+        missing = [i for i in idx if self._pts[i] is _MISSING]
+        if not missing:
+            return
+
+        if self._decryption is None:
+            self._decryption = Decryption(self._creds, self._dataset_name)
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            pts = self._decryption.CipherMany(
+                [self._cts[j] for j in batch], self._twk)
+            for j, pt in zip(batch, pts):
+                self._pts[j] = pt
+            self.decrypted += len(batch)
+
+        if self._creds.configuration.get_event_reporting_synchronous():
+            self._creds.process_events()
+
+def DecryptLazy(creds, dataset_name, cts, twk = None, batch_size = BATCH):
+    """
+    Return a DecryptedColumn for the cipher texts; values are decrypted
+    as they are accessed
+    """
+    return DecryptedColumn(creds, dataset_name, cts, twk, batch_size)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import importlib
+column = importlib.import_module('ubiq_security.structured.column')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestDecryptedColumn(unittest.TestCase):
+    def setUp(self):
+        self.server = testutil.Fetches(self, [encrypt, decrypt])
+
+    def test_lazy(self):
+        creds = testutil.Creds()
+        pts = ['%03d-45-%04d' % (i % 1000, i) for i in range(2000)]
+        cts = encrypt.EncryptMany(creds, 'SSN', pts)
+        creds.events = []
+        self.server.datasets = []
+
+        col = column.DecryptLazy(creds, 'SSN', iter(cts), batch_size = 100)
+        self.assertEqual(len(col), 2000)
+        self.assertEqual(len(self.server.datasets), 0)
+        self.assertEqual(col.decrypted, 0)
+
+        self.assertEqual(col[5], pts[5])
+        self.assertEqual(col[-1], pts[-1])
+        self.assertEqual(col.decrypted, 2)
+
+        self.assertEqual(col[0:50], pts[0:50])
+        self.assertEqual(col[1990:], pts[1990:])
+        self.assertEqual(col[100:400:3], pts[100:400:3])
+        # values that were already decrypted are not decrypted again
+        self.assertEqual(col.decrypted, 2 + 49 + 9 + 100)
+        self.assertEqual(creds.count(), col.decrypted)
+        self.assertEqual(len(self.server.datasets), 1)
+
+        self.assertRaises(IndexError, col.__getitem__, 2000)
+        self.assertEqual(list(col), pts)
+        self.assertEqual(col.decrypted, 2000)
+        self.assertEqual(col.Ciphertexts(), cts)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,55 +7,154 @@ import requests
 import urllib
 import time
 import copy
+import collections
+import itertools
+import threading
 
 from ..auth import http_auth
-from .lib import ffx
+from .lib import aes, ff1, ffx
+from .memo import flushMemo
 
 
 import cryptography.hazmat.primitives as crypto
 import cryptography.hazmat.primitives.serialization as serialize 
 from cryptography.hazmat.backends import default_backend as crypto_backend
 
-def strConvertRadix(s, ics, ocs):
-    return ffx.NumberToString(len(ocs), ocs,
-                              ffx.StringToNumber(len(ics), ics, s),
-                              len(s))
-
-def fmtInput(s, pth, ics, ocs, rules = []):
-    fmt = ''
-    trm = '%s'%(s)
-    
-    # Check if there's a passthrough rule. If not, create for legacy passthrough.
-    if not any(rule.get('type') == 'passthrough' for rule in rules):
-        rules.insert(0, {'type': 'passthrough', 'value': pth, 'priority': 1})
-        
-    # Sort the rules by priority
-    rules.sort(key=lambda x: x['priority'])
-    for idx, rule in enumerate(rules):
-        if(rule['type'] == 'passthrough'):
-            pth = rule['value']
-            o = ''
-            for c in trm:
-                if c in pth:
-                    fmt += c
-                else:
-                    fmt += ocs[0]
-                    o += c
-            trm = o
-        elif(rule['type'] == 'prefix'):
-            rules[idx]['buffer'] = trm[:rule['value']]
-            trm = trm[rule['value']:]
-        elif(rule['type'] == 'suffix'):
-            rules[idx]['buffer'] = trm[(-1 * rule['value']):]
-            trm = trm[:(-1 * rule['value'])]
-        else:
-            raise RuntimeError('Ubiq Python Library does not support rule type "%s" at this time.'%(rule['type']))
+# number of values processed at a time by the streaming interfaces
+BATCH = 4096
 
-    # Validate final string contains only allowed characters.
-    if not all((c in ics) for c in trm):
-        raise RuntimeError('Invalid input string character(s)')
+def batched(iterable, n):
+    """Yield lists of up to n items from iterable"""
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, n))
+        if not batch:
+            return
+        yield batch
 
-    return fmt, trm, rules
+def strConvertRadix(s, ics, ocs):
+    # when both character sets have the same radix, converting
+    # through a number maps each digit to the digit in the same
+    # position of the other set, so a translation table will do
+    tbl = strConvertRadix.cache.get((ics, ocs))
+    if tbl is None:
+        tbl = False
+        if len(ics) == len(ocs):
+            tbl = str.maketrans(ics, ocs)
+        strConvertRadix.cache[(ics, ocs)] = tbl
+    if tbl:
+        return s.translate(tbl)
+
+    return ffx.RadixConverter(len(ocs), ocs).NumberToString(
+        ffx.RadixConverter(len(ics), ics).StringToNumber(s),
+        len(s))
+strConvertRadix.cache = {}
+
+class Format:
+    """
+    Passthrough and prefix/suffix rules of a dataset, compiled
+
+    The rules are sorted and their character sets turned into sets and
+    translation tables once, when the plan is created. A plan is not
+    modified after that, so it can be shared between threads; the parts
+    of a value that are removed on input are returned to the caller and
+    passed back in on output.
+    """
+    PASSTHROUGH = 0
+    PREFIX = 1
+    SUFFIX = 2
+
+    def __init__(self, dataset):
+        rules = list(dataset.get('passthrough_rules', []))
+        # create a passthrough rule for legacy datasets that don't have one
+        if not any(rule.get('type') == 'passthrough' for rule in rules):
+            rules.insert(0, {'type': 'passthrough',
+                             'value': dataset['passthrough'],
+                             'priority': 1})
+
+        steps = []
+        for rule in sorted(rules, key=lambda x: x['priority']):
+            if rule['type'] == 'passthrough':
+                steps.append((self.PASSTHROUGH,
+                              (frozenset(rule['value']),
+                               str.maketrans('', '', rule['value']))))
+            elif rule['type'] == 'prefix':
+                steps.append((self.PREFIX, int(rule['value'])))
+            elif rule['type'] == 'suffix':
+                steps.append((self.SUFFIX, int(rule['value'])))
+            else:
+                raise RuntimeError('Ubiq Python Library does not support rule type "%s" at this time.'%(rule['type']))
+        self.steps = tuple(steps)
+
+        self.ics = frozenset(dataset['input_character_set'])
+        self.ocs = frozenset(dataset['output_character_set'])
+
+    def Input(self, s, ENC):
+        """
+        Remove the passthrough characters, prefix and suffix from s
+
+        Returns the state needed to put them back and the remaining
+        characters, which must all belong to the input character set of
+        the dataset when encrypting, or its output character set when
+        decrypting.
+        """
+        fmt = []
+        for kind, value in self.steps:
+            if kind == self.PASSTHROUGH:
+                t = s.translate(value[1])
+                # the original string is kept only if it has
+                # characters that need to be put back
+                fmt.append(s if len(t) != len(s) else None)
+                s = t
+            elif kind == self.PREFIX:
+                fmt.append(s[:value])
+                s = s[value:]
+            else:
+                i = max(len(s) - value, 0)
+                fmt.append(s[i:])
+                s = s[:i]
+
+        if not (self.ics if ENC else self.ocs).issuperset(s):
+            raise RuntimeError('Invalid input string character(s)')
+
+        return tuple(fmt), s
+
+    def Output(self, fmt, s):
+        """Reverse Input, using the state that it returned"""
+        for (kind, value), f in zip(reversed(self.steps), reversed(fmt)):
+            if kind == self.PASSTHROUGH:
+                if f != None:
+                    pth = value[0]
+                    it = iter(s)
+                    try:
+                        o = [c if c in pth else next(it) for c in f]
+                    except StopIteration:
+                        o = None
+                    if o is None or next(it, None) is not None:
+                        raise RuntimeError('mismatched format and output strings')
+                    s = ''.join(o)
+            elif kind == self.PREFIX:
+                s = f + s
+            else:
+                s = s + f
+
+        return s
+
+def datasetFormat(dataset):
+    """
+    Return the compiled format of a dataset
+
+    Plans are cached by the identity of the dataset object, which is
+    never modified once it has been fetched.
+    """
+    entry = datasetFormat.cache.get(id(dataset))
+    if entry is None or entry[0] is not dataset:
+        entry = (dataset, Format(dataset))
+        if len(datasetFormat.cache) >= 256:
+            datasetFormat.cache.clear()
+        datasetFormat.cache[id(dataset)] = entry
+    return entry[1]
+datasetFormat.cache = {}
 
 def encKeyNumber(s, ocs, n, sft):    
     return ocs[ocs.find(s[0]) + (int(n) << sft)] + s[1:]
@@ -67,30 +166,33 @@ def decKeyNumber(s, ocs, sft):
 
     return ocs[encoded_value - (key_num << sft)] + s[1:], key_num
 
-def fmtOutput(fmt, s, pth, rules):
-    # Sort the rules by decreasing priority
-    rules.sort(key=lambda x: x['priority'], reverse=True)
+def aesBackend(creds):
+    """
+    Return the AES backend selected by the configuration
 
-    for rule in rules:
-        if(rule['type'] == 'passthrough'):
-            o = ''
-            for c in fmt:
-                if c not in pth:
-                    o, s = o + s[0], s[1:]
+    The choice, and the state of every backend (its measured
+    throughput, or why it cannot be used), is printed the first time
+    that it is made if verbose logging is enabled.
+    """
+    config = creds.configuration
+    name = config.crypto_aes_backend
+    backend = aes.Get(name)
+    if backend.name not in aesBackend.reported:
+        aesBackend.reported.add(backend.name)
+        if config.logging_verbose:
+            states = []
+            for b in aes.Info()['backends']:
+                if b['error'] != None:
+                    state = 'unusable: %s' % (b['error'])
+                elif b['throughput_mbps'] != None:
+                    state = '%.1f MB/s' % (b['throughput_mbps'])
                 else:
-                    o += c
-                
-            if len(s) > 0:
-                raise RuntimeError('mismatched format and output strings')
-            s = o
-        elif(rule['type'] == 'prefix'):
-            s = rule['buffer'] + s
-        elif(rule['type'] == 'suffix'):
-            s = s + rule['buffer']
-        else:
-            raise RuntimeError('Ubiq Python Library does not support rule type "%s" at this time.'%(rule['type']))
-
-    return s
+                    state = 'not measured'
+                states.append('%s %s' % (b['name'], state))
+            print('****** AES BACKEND ----- %s (%s)' %
+                  (backend.name, ', '.join(states)))
+    return backend
+aesBackend.reported = set()
 
 def fetchDataset(creds, dataset_name):
     papi = creds.access_key_id
@@ -127,6 +229,7 @@ def fetchDataset(creds, dataset_name):
 fetchDataset.cache = {}
 
 def flushDataset(papi = None, dataset_name = None):
+    flushMemo(papi, dataset_name)
     if papi == None:
         fetchDataset.cache = {}
     elif papi in fetchDataset.cache:
@@ -135,7 +238,7 @@ def flushDataset(papi = None, dataset_name = None):
         elif dataset_name in fetchDataset.cache[papi]:
             del fetchDataset.cache[papi][dataset_name]
             
-def add_to_fetchkey_cache(papi, dataset_name, n, key, ttl_seconds):
+def add_to_fetchkey_cache(papi, dataset_name, n, key, ttl_seconds, current_ttl_seconds = None):
     cache_entry = { "key" : key, "expires": time.time() + ttl_seconds }
     
     if not papi in fetchKey.cache:
@@ -145,21 +248,30 @@ def add_to_fetchkey_cache(papi, dataset_name, n, key, ttl_seconds):
 
     # the -1 entry points to the "current" key at the
     # server. it is cached so that the next caller that
-    # wants the "current" key can get it, but it should
-    # be timed-out occasionally in case the "current"
-    # pointer changes at the server.
-    #
-    # that timeout is future work
+    # wants the "current" key can get it, but the pointer
+    # changes when the key is rotated, so it expires
+    # sooner than the key itself. until the key expires
+    # (the "limit"), an expired pointer is still used while
+    # it is revalidated in the background; see fetchKey.
     if n == -1:
+        if current_ttl_seconds == None:
+            current_ttl_seconds = ttl_seconds
         # -1 can be an index because keys are stored
         # in a dictionary, not a list
-        fetchKey.cache[papi][dataset_name][n] = cache_entry
+        fetchKey.cache[papi][dataset_name][n] = {
+            "key": key,
+            "expires": time.time() + min(current_ttl_seconds, ttl_seconds),
+            "limit": cache_entry["expires"] }
 
     # also cache the key at its "real" identifier
     n = int(key['key_number'])
     fetchKey.cache[papi][dataset_name][n] = cache_entry
 
-def fetchKey(creds, dataset_name, n = -1):
+def fetchKey(creds, dataset_name, n = -1, refresh = False):
+    """
+    Return the key with number n, or the current key if n is -1. With
+    refresh, the key is fetched from the server even if it is cached.
+    """
     papi = creds.access_key_id
     sapi = creds.secret_signing_key
     srsa = creds.secret_crypto_access_key
@@ -167,16 +279,24 @@ def fetchKey(creds, dataset_name, n = -1):
     
     config = creds.configuration
     ttl_seconds = config.key_caching_ttl_seconds
+    current_ttl_seconds = config.key_caching_current_ttl_seconds
     structured_cache_enabled = creds.configuration.key_caching_structured
     cache_encrypted = creds.configuration.key_caching_encrypt
     
     key = None
-    
-    if (not structured_cache_enabled or
-        not papi in fetchKey.cache or
-        not dataset_name in fetchKey.cache[papi] or
-        not n in fetchKey.cache[papi][dataset_name] or
-        fetchKey.cache[papi][dataset_name][n]["expires"] < time.time()):
+
+    entry = None
+    if structured_cache_enabled and not refresh:
+        entry = fetchKey.cache.get(papi, {}).get(dataset_name, {}).get(n)
+    if entry != None and entry["expires"] < time.time():
+        if n == -1 and entry.get("limit", 0) >= time.time():
+            # the pointer to the current key is due to be checked,
+            # but the key that it points to is still good
+            refreshCurrentKey(creds, dataset_name)
+        else:
+            entry = None
+
+    if entry == None:
         
         if config.logging_verbose:
             print('****** PERFORMING EXPENSIVE CALL ----- fetchKey')
@@ -195,11 +315,16 @@ def fetchKey(creds, dataset_name, n = -1):
         key = json.loads(resp.content.decode())
         
         if structured_cache_enabled and cache_encrypted:
-            add_to_fetchkey_cache(papi, dataset_name, n, copy.deepcopy(key), ttl_seconds)
+            add_to_fetchkey_cache(papi, dataset_name, n, copy.deepcopy(key), ttl_seconds, current_ttl_seconds)
     else:
-        key = fetchKey.cache[papi][dataset_name][n]["key"]
-    
+        key = entry["key"]
+
     if key != None and not 'unwrapped_data_key' in key:
+        if entry != None:
+            # a wrapped key from the cache; the cached copy is only
+            # replaced, below, if unwrapped keys are cached
+            key = copy.deepcopy(key)
+
         prvkey = serialize.load_pem_private_key(
             key['encrypted_private_key'].encode(), srsa.encode(),
             crypto_backend())
@@ -212,11 +337,145 @@ def fetchKey(creds, dataset_name, n = -1):
                 algorithm=crypto.hashes.SHA1(),
                 label=None))
 
-        if structured_cache_enabled and not cache_encrypted:
-            add_to_fetchkey_cache(papi, dataset_name, n, copy.deepcopy(key), ttl_seconds)
+        if structured_cache_enabled and not cache_encrypted and entry != None:
+            # keep the expiration (and limit) of the cached entry,
+            # e.g. one loaded from a file
+            entry["key"] = copy.deepcopy(key)
+        elif structured_cache_enabled and not cache_encrypted:
+            add_to_fetchkey_cache(papi, dataset_name, n, copy.deepcopy(key), ttl_seconds, current_ttl_seconds)
     return key
 fetchKey.cache = {}
 
+def refreshCurrentKey(creds, dataset_name):
+    """
+    Fetch the current key of the dataset in a background thread and
+    replace the cached pointer to it. The entries of the keys
+    themselves are left alone. At most one refresh per dataset runs at
+    a time.
+    """
+    papi = creds.access_key_id
+    k = (papi, dataset_name)
+    with refreshCurrentKey.lock:
+        if k in refreshCurrentKey.running:
+            return
+        refreshCurrentKey.running.add(k)
+
+    def run():
+        try:
+            if creds.configuration.logging_verbose:
+                print('****** REFRESHING CURRENT KEY ----- ' + dataset_name)
+            entry = fetchKey.cache.get(papi, {}).get(dataset_name, {}).get(-1)
+            key = fetchKey(creds, dataset_name, -1, refresh = True)
+            new = fetchKey.cache.get(papi, {}).get(dataset_name, {}).get(-1)
+            if entry != None and new != None and "seen" in entry:
+                new["seen"] = entry["seen"]
+            if (entry != None and
+                int(entry["key"]["key_number"]) != int(key["key_number"])):
+                # the keys used for searching end with the current key
+                fetchAllKeys.cache.get(papi, {}).pop(dataset_name, None)
+        except Exception as e:
+            # the old pointer stays in use until its key expires
+            if creds.configuration.logging_verbose:
+                print('****** CURRENT KEY REFRESH FAILED ----- %s' % (e))
+        finally:
+            with refreshCurrentKey.lock:
+                refreshCurrentKey.running.discard(k)
+
+    threading.Thread(target=run, daemon=True).start()
+refreshCurrentKey.lock = threading.Lock()
+refreshCurrentKey.running = set()
+
+def checkKeyNumber(creds, dataset_name, n):
+    """
+    Note that a value encrypted with key number n was seen. If n is
+    newer than the cached current key, the key was rotated and the
+    pointer is refreshed without waiting for it to expire.
+    """
+    entry = fetchKey.cache.get(creds.access_key_id, {}).get(dataset_name, {}).get(-1)
+    if (entry != None and n > int(entry["key"]["key_number"]) and
+        n > entry.get("seen", -1)):
+        # if the server does not agree that n is newer, the pointer
+        # is not refreshed again for the same number
+        entry["seen"] = n
+        refreshCurrentKey(creds, dataset_name)
+
+def newContext(creds, dataset, key):
+    """Create the cipher context for a dataset and one of its keys"""
+    if dataset['encryption_algorithm'] != 'FF1':
+        raise RuntimeError('unsupported algorithm: ' +
+                           dataset['encryption_algorithm'])
+    return ff1.Context(
+        key['unwrapped_data_key'],
+        base64.b64decode(dataset['tweak']),
+        dataset['tweak_min_len'], dataset['tweak_max_len'],
+        len(dataset['input_character_set']),
+        dataset['input_character_set'],
+        backend=aesBackend(creds))
+
+def fetchContext(creds, dataset, n = -1, key = None):
+    """
+    Return the key with number n (or the current key if n is -1) and
+    its cipher context
+
+    Contexts are kept in a process-wide cache, shared by all Encryption
+    and Decryption objects, of at most fetchContext.size entries. They
+    expire along with the keys that they were made from and are
+    removed by flushKey. Nothing is cached if structured key caching is
+    disabled or if keys are only to be cached in encrypted form.
+
+    If the caller already has the key, it can be passed in, and is used
+    if there is no context for it in the cache.
+    """
+    papi = creds.access_key_id
+    config = creds.configuration
+    enabled = config.key_caching_structured and not config.key_caching_encrypt
+
+    if key == None and n == -1 and enabled:
+        # the pointer to the current key expires sooner than contexts
+        # do, so it is resolved first, and contexts are only kept under
+        # real key numbers
+        key = fetchKey(creds, dataset['name'], -1)
+    if key != None:
+        n = int(key['key_number'])
+    # a context is only reused for a dataset with the same definition
+    params = (dataset['encryption_algorithm'], dataset['tweak'],
+              dataset['tweak_min_len'], dataset['tweak_max_len'],
+              dataset['input_character_set'])
+    k = (papi, dataset['name'], n)
+
+    if enabled:
+        with fetchContext.lock:
+            entry = fetchContext.cache.get(k)
+            if (entry != None and entry['expires'] >= time.time() and
+                entry['params'] == params):
+                fetchContext.cache.move_to_end(k)
+                return entry['key'], entry['ctx']
+
+    if key == None:
+        key = fetchKey(creds, dataset['name'], n)
+    ctx = newContext(creds, dataset, key)
+
+    if enabled:
+        entry = {'key': key, 'ctx': ctx, 'params': params,
+                 'expires': time.time() + config.key_caching_ttl_seconds}
+        with fetchContext.lock:
+            fetchContext.cache[k] = entry
+            fetchContext.cache.move_to_end(k)
+            while len(fetchContext.cache) > fetchContext.size:
+                fetchContext.cache.popitem(last=False)
+    return key, ctx
+fetchContext.cache = collections.OrderedDict()
+fetchContext.lock = threading.Lock()
+fetchContext.size = 256
+
+def flushContext(papi = None, dataset_name = None, n = None):
+    with fetchContext.lock:
+        for k, entry in list(fetchContext.cache.items()):
+            if ((papi == None or k[0] == papi) and
+                (dataset_name == None or k[1] == dataset_name) and
+                (n == None or n in (k[2], int(entry['key']['key_number'])))):
+                del fetchContext.cache[k]
+
 def allKeysToNInCache(papi, dataset_name, n):
     present = True
     for i in range(0,n+1):
@@ -234,20 +493,34 @@ def fetchAllKeys(creds, dataset_name):
     structured_cache_enabled = config.key_caching_structured
     cache_encrypted = config.key_caching_encrypt
     
-    if config.logging_verbose:
-        print('****** PERFORMING EXPENSIVE CALL ----- fetchAllKeys')
-    
-    url=f"{host}/api/v0/fpe/def_keys?ffs_name={dataset_name}&papi={papi}"
-    resp = requests.get(url, auth=http_auth(papi, sapi))
-    
-    all_keys = {}
+    # the response holds the wrapped keys, so it can be kept whether
+    # or not keys are to be cached encrypted
+    if (not structured_cache_enabled or
+        not papi in fetchAllKeys.cache or
+        not dataset_name in fetchAllKeys.cache[papi] or
+        fetchAllKeys.cache[papi][dataset_name]["expires"] < time.time()):
+
+        if config.logging_verbose:
+            print('****** PERFORMING EXPENSIVE CALL ----- fetchAllKeys')
 
-    if resp.status_code != http.HTTPStatus.OK:
-        raise urllib.error.HTTPError(
-            url, resp.status_code,
-            http.HTTPStatus(resp.status_code).phrase,
-            resp.headers, resp.content)
-    keys = json.loads(resp.content.decode())
+        url=f"{host}/api/v0/fpe/def_keys?ffs_name={dataset_name}&papi={papi}"
+        resp = requests.get(url, auth=http_auth(papi, sapi))
+
+        if resp.status_code != http.HTTPStatus.OK:
+            raise urllib.error.HTTPError(
+                url, resp.status_code,
+                http.HTTPStatus(resp.status_code).phrase,
+                resp.headers, resp.content)
+        keys = json.loads(resp.content.decode())
+
+        if structured_cache_enabled:
+            if not papi in fetchAllKeys.cache:
+                fetchAllKeys.cache[papi] = {}
+            fetchAllKeys.cache[papi][dataset_name] = { "keys" : keys, "expires" : time.time() + ttl_seconds }
+    else:
+        keys = fetchAllKeys.cache[papi][dataset_name]["keys"]
+
+    all_keys = {}
 
     if structured_cache_enabled:
         if not papi in fetchKey.cache:
@@ -255,10 +528,10 @@ def fetchAllKeys(creds, dataset_name):
         if not dataset_name in fetchKey.cache[papi]:
             fetchKey.cache[papi][dataset_name] = {}
 
-    prvkey = serialize.load_pem_private_key(
-        keys[dataset_name]['encrypted_private_key'].encode(), srsa.encode(),
-        crypto_backend())
-    
+    # decrypting the private key is expensive; it is only done if
+    # some of the keys are not already in the cache
+    prvkey = None
+
     for i, enc_key in enumerate(keys[dataset_name]['keys']):
         if (structured_cache_enabled and # Cache is Enabled
             i in fetchKey.cache[papi][dataset_name] and # Key in cache
@@ -277,9 +550,14 @@ def fetchAllKeys(creds, dataset_name):
         
         # Store cache encrpypted (don't store unwrapped)
         if structured_cache_enabled and cache_encrypted:
-            cache_entry = { "key" : key, "expires": time.time() + ttl_seconds }
+            cache_entry = { "key" : copy.deepcopy(key), "expires": time.time() + ttl_seconds }
             fetchKey.cache[papi][dataset_name][i] = cache_entry
         
+        if prvkey == None:
+            prvkey = serialize.load_pem_private_key(
+                keys[dataset_name]['encrypted_private_key'].encode(),
+                srsa.encode(), crypto_backend())
+
         key['unwrapped_data_key'] = prvkey.decrypt(
             base64.b64decode(key['wrapped_data_key']),
             crypto.asymmetric.padding.OAEP(
@@ -296,12 +574,22 @@ def fetchAllKeys(creds, dataset_name):
         all_keys[i] = key
 
     return all_keys
+fetchAllKeys.cache = {}
 
 def fetchCurrentKeys(creds, dataset_name):
     return fetchAllKeys(creds, dataset_name)
 
 
 def flushKey(papi = None, dataset_name = None, n = None):
+    flushContext(papi, dataset_name, n)
+    flushMemo(papi, dataset_name, n)
+    if papi == None:
+        fetchAllKeys.cache = {}
+    elif papi in fetchAllKeys.cache:
+        if dataset_name == None:
+            del fetchAllKeys.cache[papi]
+        elif dataset_name in fetchAllKeys.cache[papi]:
+            del fetchAllKeys.cache[papi][dataset_name]
     if papi == None:
         fetchKey.cache = {}
     elif papi in fetchKey.cache:
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import base64
+import json
+import threading
+import unittest
+import unittest.mock
+
+import importlib
+common = importlib.import_module('ubiq_security.structured.common')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+DATASET = {
+    'passthrough': '-',
+    'input_character_set': '0123456789',
+    'output_character_set': 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdef',
+    'passthrough_rules': [
+        {'type': 'suffix', 'value': 2, 'priority': 3},
+        {'type': 'passthrough', 'value': '-()', 'priority': 2},
+        {'type': 'prefix', 'value': 1, 'priority': 1},
+    ],
+}
+
+class TestFormat(unittest.TestCase):
+    def test_roundtrip(self):
+        plan = common.Format(DATASET)
+
+        fmt, trm = plan.Input('1(234)-567-8901', True)
+        self.assertEqual(trm, '23456789')
+        self.assertEqual(plan.Output(fmt, 'ABCDEFGH'), '1(ABC)-DEF-GH01')
+
+        fmt, trm = plan.Input('1(ABC)-DEF-GH01', False)
+        self.assertEqual(trm, 'ABCDEFGH')
+        self.assertEqual(plan.Output(fmt, '23456789'), '1(234)-567-8901')
+
+        with self.assertRaises(RuntimeError):
+            plan.Output(fmt, '2345678')
+        with self.assertRaises(RuntimeError):
+            plan.Output(fmt, '234567890')
+
+        with self.assertRaises(RuntimeError):
+            plan.Input('1(23A)-567-8901', True)
+        with self.assertRaises(RuntimeError):
+            plan.Input('1(234)-567-8901', False)
+
+    def test_legacy_passthrough(self):
+        plan = common.Format({'passthrough': '-',
+                              'input_character_set': '0123456789',
+                              'output_character_set': '0123456789'})
+        fmt, trm = plan.Input('123-45-6789', True)
+        self.assertEqual(trm, '123456789')
+        self.assertEqual(plan.Output(fmt, '987654321'), '987-65-4321')
+
+    def test_unsupported_rule(self):
+        with self.assertRaises(RuntimeError):
+            common.Format({'passthrough': '',
+                           'input_character_set': '0123456789',
+                           'output_character_set': '0123456789',
+                           'passthrough_rules': [
+                               {'type': 'regex', 'value': '', 'priority': 1}]})
+
+    def test_shared(self):
+        plan = common.datasetFormat(DATASET)
+        self.assertIs(common.datasetFormat(DATASET), plan)
+        self.assertIsNot(common.datasetFormat(dict(DATASET)), plan)
+
+        # values formatted concurrently keep their own prefix and suffix
+        errors = []
+        def run(i):
+            for j in range(2000):
+                v = '%d(%03d)-%03d-%d%02d' % (i, j % 1000, j, i, i)
+                fmt, trm = plan.Input(v, True)
+                if plan.Output(fmt, trm) != v:
+                    errors.append(v)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+class TestContextCache(unittest.TestCase):
+    def setUp(self):
+        self.dataset = dict(DATASET, name='TEST',
+                            encryption_algorithm='FF1',
+                            tweak=base64.b64encode(bytes(8)).decode(),
+                            tweak_min_len=0, tweak_max_len=16)
+        self.fetches = []
+        def fetchKey(creds, name, n = -1):
+            self.fetches.append(n)
+            return {'key_number': n if n >= 0 else 3,
+                    'unwrapped_data_key': bytes([n % 256] * 32)}
+        p = unittest.mock.patch.object(common, 'fetchKey', fetchKey)
+        p.start()
+        self.addCleanup(p.stop)
+        common.flushKey()
+        self.addCleanup(common.flushKey)
+
+    def test_interleaved(self):
+        creds = testutil.Creds()
+        ctxs = {}
+        for i in range(100):
+            for n in range(3):
+                key, ctx = common.fetchContext(creds, self.dataset, n)
+                self.assertEqual(key['key_number'], n)
+                self.assertIs(ctxs.setdefault(n, ctx), ctx)
+        self.assertEqual(self.fetches, [0, 1, 2])
+
+        # the current key is also cached under its number
+        key, ctx = common.fetchContext(creds, self.dataset)
+        self.assertIs(common.fetchContext(creds, self.dataset, 3)[1], ctx)
+
+        common.flushKey('papi', 'TEST', 1)
+        common.fetchContext(creds, self.dataset, 0)
+        common.fetchContext(creds, self.dataset, 1)
+        self.assertEqual(self.fetches, [0, 1, 2, -1, 1])
+
+        # a changed dataset definition needs a new context
+        dataset = dict(self.dataset, tweak_max_len=8)
+        self.assertIsNot(common.fetchContext(creds, dataset, 0)[1], ctxs[0])
+
+    def test_disabled(self):
+        for config in ({'key_caching': {'structured': False}},
+                       {'key_caching': {'encrypt': True}}):
+            creds = testutil.Creds(config)
+            common.fetchContext(creds, self.dataset, 0)
+            common.fetchContext(creds, self.dataset, 0)
+        self.assertEqual(self.fetches, [0, 0, 0, 0])
+
+class _Response:
+    def __init__(self, content):
+        self.status_code = 200
+        self.content = json.dumps(content).encode()
+
+class TestAllKeys(unittest.TestCase):
+    def setUp(self):
+        self.keys = [bytes([i] * 32) for i in range(3)]
+        pem, wrapped = testutil.wrapKeys(self.keys)
+        self.response = {'TEST': {'encrypted_private_key': pem,
+                                  'keys': wrapped}}
+
+        self.requests = 0
+        def get(url, auth = None):
+            self.requests += 1
+            return _Response(self.response)
+        p = unittest.mock.patch.object(common.requests, 'get', get)
+        p.start()
+        self.addCleanup(p.stop)
+        common.flushKey()
+        self.addCleanup(common.flushKey)
+
+    def test_cached(self):
+        creds = testutil.Creds()
+        keys = common.fetchAllKeys(creds, 'TEST')
+        self.assertEqual([keys[i]['unwrapped_data_key'] for i in range(3)],
+                         self.keys)
+        self.assertEqual(common.fetchAllKeys(creds, 'TEST'), keys)
+        self.assertEqual(self.requests, 1)
+
+        common.flushKey('papi', 'TEST')
+        common.fetchAllKeys(creds, 'TEST')
+        self.assertEqual(self.requests, 2)
+
+    def test_encrypted(self):
+        creds = testutil.Creds({'key_caching': {'encrypt': True}})
+        keys = common.fetchAllKeys(creds, 'TEST')
+        self.assertEqual(common.fetchAllKeys(creds, 'TEST'), keys)
+        self.assertEqual(self.requests, 1)
+        for entry in common.fetchKey.cache['papi']['TEST'].values():
+            self.assertNotIn('unwrapped_data_key', entry['key'])
+
+    def test_disabled(self):
+        creds = testutil.Creds({'key_caching': {'structured': False}})
+        common.fetchAllKeys(creds, 'TEST')
+        common.fetchAllKeys(creds, 'TEST')
+        self.assertEqual(self.requests, 2)
+
+class TestCurrentKey(unittest.TestCase):
+    def setUp(self):
+        pem, wrapped = testutil.wrapKeys([bytes([i] * 32) for i in range(3)])
+        self.keys = [{'key_number': i, 'encrypted_private_key': pem,
+                      'wrapped_data_key': w}
+                     for i, w in enumerate(wrapped)]
+        self.current = 0
+
+        self.requests = []
+        def get(url, auth = None):
+            n = -1
+            if '&key_number=' in url:
+                n = int(url.split('&key_number=')[1])
+            self.requests.append(n)
+            return _Response(self.keys[self.current if n < 0 else n])
+        p = unittest.mock.patch.object(common.requests, 'get', get)
+        p.start()
+        self.addCleanup(p.stop)
+        common.flushKey()
+        self.addCleanup(common.flushKey)
+
+        self.dataset = dict(DATASET, name='TEST',
+                            encryption_algorithm='FF1',
+                            tweak=base64.b64encode(bytes(8)).decode(),
+                            tweak_min_len=0, tweak_max_len=16)
+
+    def wait(self):
+        for i in range(500):
+            if not common.refreshCurrentKey.running:
+                return
+            threading.Event().wait(0.01)
+        self.fail('refresh did not finish')
+
+    def test_revalidate(self):
+        creds = testutil.Creds({'key_caching': {'current_ttl_seconds': 0}})
+        self.assertEqual(common.fetchKey(creds, 'TEST')['key_number'], 0)
+        self.assertEqual(self.requests, [-1])
+        old = common.fetchKey.cache['papi']['TEST'][0]
+
+        # the key is rotated. the expired pointer is still used, while
+        # it is checked in the background
+        self.current = 1
+        self.assertEqual(common.fetchKey(creds, 'TEST')['key_number'], 0)
+        self.wait()
+        self.assertEqual(self.requests, [-1, -1])
+        self.assertEqual(
+            common.fetchKey.cache['papi']['TEST'][-1]['key']['key_number'], 1)
+        # the entry of the old key is left alone
+        self.assertIs(common.fetchKey.cache['papi']['TEST'][0], old)
+
+        # contexts follow the pointer
+        key, ctx = common.fetchContext(creds, self.dataset)
+        self.assertEqual(key['key_number'], 1)
+        self.assertEqual(key['unwrapped_data_key'], bytes([1] * 32))
+        self.assertIs(common.fetchContext(creds, self.dataset, 1)[1], ctx)
+
+    def test_limit(self):
+        # once the key itself has expired, the pointer is fetched again
+        # before it is used
+        creds = testutil.Creds({'key_caching': {'ttl_seconds': 0}})
+        common.fetchKey(creds, 'TEST')
+        self.current = 2
+        self.assertEqual(common.fetchKey(creds, 'TEST')['key_number'], 2)
+        self.assertEqual(self.requests, [-1, -1])
+
+    def test_newer(self):
+        creds = testutil.Creds()
+        common.fetchKey(creds, 'TEST')
+        self.current = 2
+
+        common.checkKeyNumber(creds, 'TEST', 0)
+        self.wait()
+        self.assertEqual(self.requests, [-1])
+
+        common.checkKeyNumber(creds, 'TEST', 2)
+        self.wait()
+        self.assertEqual(self.requests, [-1, -1])
+        self.assertEqual(common.fetchKey(creds, 'TEST')['key_number'], 2)
+
+        # a number that the server does not consider current only
+        # causes one more check
+        common.checkKeyNumber(creds, 'TEST', 5)
+        self.wait()
+        common.checkKeyNumber(creds, 'TEST', 5)
+        self.wait()
+        self.assertEqual(self.requests, [-1, -1, -1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Streaming encryption of CSV columns.
+#
+# Rows are read from the input a chunk at a time. The values of each
+# mapped column are encrypted (or decrypted) together, with one bulk
+# call per column and chunk, and the chunk is written out before the
+# next one is read, so memory use depends on the chunk size and not on
+# the size of the file.
+
+import codecs
+import csv
+import io
+import time
+
+from .common import batched, BATCH
+from .client import Client
+from .pool import ProcessPool
+
+def _reader(src, encoding):
+    # csv needs text; binary streams, including those that are not
+    # io objects (e.g. HTTP response bodies), are decoded as they are
+    # read
+    if isinstance(src, io.TextIOBase) or not isinstance(src.read(0), bytes):
+        return src
+    return codecs.getreader(encoding)(src)
+
+def _writer(dst, encoding):
+    if isinstance(dst, (io.RawIOBase, io.BufferedIOBase)):
+        return codecs.getwriter(encoding)(dst)
+    return dst
+
+def cipherCSV(creds, src, dst, columns, ENC, twk = None,
+              chunk_size = BATCH, processes = 0, header = True,
+              dialect = 'excel', encoding = 'utf-8', progress = None):
+    """
+    Copy CSV rows from src to dst, encrypting (or decrypting) the
+    columns named in columns, a dictionary of column names or indexes
+    to dataset names. Names can only be used when the first row is a
+    header. Empty values are copied as they are.
+
+    With processes > 0, each dataset gets a ProcessPool with that many
+    workers; otherwise values are processed in this process.
+
+    progress, if given, is called with the statistics after each chunk
+    is written. Returns the statistics: the number of rows and values,
+    the elapsed time and the rows per second.
+    """
+    if not creds.set():
+        raise RuntimeError("credentials not set")
+
+    reader = csv.reader(_reader(src, encoding), dialect)
+    writer = csv.writer(_writer(dst, encoding), dialect)
+
+    stats = {'rows': 0, 'values': 0, 'seconds': 0.0, 'rows_per_second': 0.0}
+    start = time.perf_counter()
+
+    names = None
+    if header:
+        names = next(reader, None)
+        if names is None:
+            return stats
+        writer.writerow(names)
+
+    idx = {}
+    for col, dataset_name in columns.items():
+        if isinstance(col, int):
+            idx[col] = dataset_name
+        elif names != None and col in names:
+            idx[names.index(col)] = dataset_name
+        else:
+            raise RuntimeError('Unknown column: %s' % (col))
+
+    client = Client(creds)
+    pools = {}
+    def cipher(dataset_name, values):
+        if processes > 0:
+            pool = pools.get(dataset_name)
+            if pool is None:
+                pool = ProcessPool(creds, dataset_name, processes)
+                pools[dataset_name] = pool
+            if ENC:
+                return pool.Encrypt(values, twk)
+            return pool.Decrypt(values, twk)
+        if ENC:
+            return client.EncryptMany(dataset_name, values, twk)
+        return client.DecryptMany(dataset_name, values, twk)
+
+    try:
+        for rows in batched(reader, chunk_size):
+            for i, dataset_name in idx.items():
+                pos = [r for r, row in enumerate(rows)
+                       if i < len(row) and row[i] != '']
+                if pos:
+                    values = cipher(dataset_name, [rows[r][i] for r in pos])
+                    for r, value in zip(pos, values):
+                        rows[r][i] = value
+                    stats['values'] += len(pos)
+            writer.writerows(rows)
+
+            if pools and creds.configuration.get_event_reporting_synchronous():
+                creds.process_events()
+
+            stats['rows'] += len(rows)
+            stats['seconds'] = time.perf_counter() - start
+            stats['rows_per_second'] = stats['rows'] / max(stats['seconds'], 1e-9)
+            if progress:
+                progress(dict(stats))
+    finally:
+        for pool in pools.values():
+            pool.close()
+
+    return stats
+
+def EncryptCSV(creds, src, dst, columns, twk = None, chunk_size = BATCH,
+               processes = 0, header = True, dialect = 'excel',
+               encoding = 'utf-8', progress = None):
+    """
+    Encrypt the columns of a CSV stream that are mapped to datasets;
+    see cipherCSV
+    """
+    return cipherCSV(creds, src, dst, columns, True, twk, chunk_size,
+                     processes, header, dialect, encoding, progress)
+
+def DecryptCSV(creds, src, dst, columns, twk = None, chunk_size = BATCH,
+               processes = 0, header = True, dialect = 'excel',
+               encoding = 'utf-8', progress = None):
+    """
+    Decrypt the columns of a CSV stream that are mapped to datasets;
+    see cipherCSV
+    """
+    return cipherCSV(creds, src, dst, columns, False, twk, chunk_size,
+                     processes, header, dialect, encoding, progress)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import csv
+import io
+import unittest
+
+import importlib
+csvstream = importlib.import_module('ubiq_security.structured.csvstream')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestCSV(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [encrypt, decrypt])
+
+        self.rows = [['id', 'bio', 'ssn', 'other']]
+        for i in range(250):
+            self.rows.append([str(i), 'line one\nline, two "q"',
+                              '%03d-45-%04d' % (i, i) if i % 10 else '',
+                              '%03d-11-2222' % (i)])
+        buf = io.StringIO()
+        csv.writer(buf).writerows(self.rows)
+        self.text = buf.getvalue()
+
+    def test_roundtrip(self):
+        creds = testutil.Creds()
+        src = io.BytesIO(self.text.encode())
+        dst = io.BytesIO()
+        progress = []
+        stats = csvstream.EncryptCSV(creds, src, dst,
+                                     {'ssn': 'SSN', 3: 'SSN'},
+                                     chunk_size = 100,
+                                     progress = progress.append)
+        self.assertEqual(stats['rows'], 250)
+        self.assertEqual(stats['values'], 225 + 250)
+        self.assertEqual([p['rows'] for p in progress], [100, 200, 250])
+        self.assertGreater(stats['rows_per_second'], 0)
+        self.assertEqual(creds.count(), 225 + 250)
+
+        out = list(csv.reader(io.StringIO(dst.getvalue().decode())))
+        self.assertEqual(out[0], self.rows[0])
+        for row, orig in zip(out[1:], self.rows[1:]):
+            self.assertEqual(row[:2], orig[:2])
+            if orig[2]:
+                self.assertEqual(row[2],
+                                 encrypt.Encrypt(creds, 'SSN', orig[2]))
+            else:
+                self.assertEqual(row[2], '')
+            self.assertEqual(row[3], encrypt.Encrypt(creds, 'SSN', orig[3]))
+
+        back = io.StringIO()
+        csvstream.DecryptCSV(creds, io.StringIO(dst.getvalue().decode()),
+                             back, {'ssn': 'SSN', 'other': 'SSN'})
+        self.assertEqual(back.getvalue(), self.text)
+
+    def test_columns(self):
+        creds = testutil.Creds()
+        self.assertRaises(RuntimeError, csvstream.EncryptCSV, creds,
+                          io.StringIO(self.text), io.StringIO(),
+                          {'missing': 'SSN'})
+
+        # without a header, columns are given by index
+        body = self.text.split('\r\n', 1)[1]
+        dst = io.StringIO()
+        stats = csvstream.EncryptCSV(creds, io.StringIO(body), dst,
+                                     {3: 'SSN'}, header = False)
+        self.assertEqual(stats['rows'], 250)
+        out = list(csv.reader(io.StringIO(dst.getvalue())))
+        self.assertEqual(out[7][3], encrypt.Encrypt(creds, 'SSN', '007-11-2222'))
+        self.assertRaises(RuntimeError, csvstream.EncryptCSV, creds,
+                          io.StringIO(self.text), io.StringIO(),
+                          {'ssn': 'SSN'}, header = False)
+
+        empty = csvstream.EncryptCSV(creds, io.StringIO(''), io.StringIO(),
+                                     {'ssn': 'SSN'})
+        self.assertEqual(empty['rows'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
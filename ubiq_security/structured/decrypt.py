@@ -1,13 +1,14 @@
 #/usr/bin/env python3
 
-import base64
+import collections
 
 from ..credentials import credentials
 
 
-from .common import fmtInput, strConvertRadix, decKeyNumber, fmtOutput
-from .common import fetchDataset, fetchKey
-from .lib import ff1
+from .common import datasetFormat, strConvertRadix, decKeyNumber, batched, BATCH
+from .common import fetchDataset, fetchContext, checkKeyNumber
+from .codebook import fetchCodebook
+from .memo import fetchMemo
 
 class Decryption:
     def __del__(self):
@@ -28,45 +29,172 @@ class Decryption:
         self._srsa = creds.secret_crypto_access_key
 
         self._dataset = fetchDataset(self._creds, dataset_name)
+        # key number -> (key, ff1 context). entries are only ever added,
+        # so the object can be used by several threads at once
+        self._ctxs = {}
+
+    def context(self, n):
+        """Return the key with number n and its FF1 context"""
+        entry = self._ctxs.get(n)
+        if entry is None:
+            entry = fetchContext(self._creds, self._dataset, n)
+            self._ctxs[n] = entry
+        return entry
 
     def Cipher(self, ct, twk = None):
-        pth = self._dataset['passthrough']
+        memo = fetchMemo(self._creds)
+        if memo:
+            if twk != None:
+                twk = bytes(twk)
+            hit = memo.get(self._papi, self._dataset['name'], None, twk, False, ct)
+            if hit:
+                pt, n = hit
+            else:
+                pt, n = self._cipher(ct, twk)
+                memo.put(self._papi, self._dataset['name'], n, twk, pt, ct,
+                         self._creds.configuration.key_caching_ttl_seconds)
+        else:
+            pt, n = self._cipher(ct, twk)
+
+        checkKeyNumber(self._creds, self._dataset['name'], n)
+        self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="decrypt",
+            dataset_type="structured", key_number=n, count=1)
+        return pt
+
+    def _cipher(self, ct, twk):
         ics = self._dataset['input_character_set']
         ocs = self._dataset['output_character_set']
-        rules = self._dataset.get('passthrough_rules', [])
+        plan = datasetFormat(self._dataset)
 
         input_min = self._dataset['min_input_length']
         input_max = self._dataset['max_input_length']
         
-        fmt, ct, rules = fmtInput(ct, pth, ocs, ics, rules)
+        fmt, ct = plan.Input(ct, False)
 
         input_len = len(ct)
         if input_len < input_min or input_len > input_max:
             raise RuntimeError('Invalid input len (%s) min: %s max %s'%(input_len, input_min, input_max))
 
         ct, n = decKeyNumber(ct, ocs, self._dataset['msb_encoding_bits'])
-        if not hasattr(self, '_key') or self._key['key_number'] != n:
-            self._key = fetchKey(self._creds,
-                                 self._dataset['name'], n)
-            if self._dataset['encryption_algorithm'] == 'FF1':
-                self._ctx = ff1.Context(
-                    self._key['unwrapped_data_key'],
-                    base64.b64decode(self._dataset['tweak']),
-                    self._dataset['tweak_min_len'], self._dataset['tweak_max_len'],
-                    len(ics), ics)
-            else:
-                raise RuntimeError('unsupported algorithm: ' +
-                                   self._dataset['encryption_algorithm'])
+        key, ctx = self.context(n)
         ct = strConvertRadix(ct, ocs, ics)
 
-        pt = self._ctx.Decrypt(ct, twk)
+        cb = fetchCodebook(self._creds, self._dataset, key, input_len, twk)
+        if cb:
+            pt = cb.Decrypt(ct)
+        else:
+            pt = ctx.Decrypt(ct, twk)
+
+        return plan.Output(fmt, pt), n
+
+    def CipherMany(self, cts, twk = None):
+        """
+        Decrypt a list of values, recording a single event for each key
+        number used
+        """
+        def context(n, l):
+            key, ctx = self.context(n)
+            cb = fetchCodebook(self._creds, self._dataset, key, l, twk)
+            return cb if cb else ctx
+
+        memo = fetchMemo(self._creds)
+        if memo:
+            if twk != None:
+                twk = bytes(twk)
+
+            pts = [None] * len(cts)
+            nums = [None] * len(cts)
+            miss = []
+            for i, ct in enumerate(cts):
+                hit = memo.get(self._papi, self._dataset['name'], None, twk, False, ct)
+                if hit:
+                    pts[i], nums[i] = hit
+                else:
+                    miss.append(i)
+
+            # repeated values in the batch are only decrypted once
+            uniq = list(dict.fromkeys(cts[i] for i in miss))
+            res = dict(zip(uniq, zip(*decryptMany(
+                self._dataset, context, uniq, twk))))
+            ttl = self._creds.configuration.key_caching_ttl_seconds
+            for ct, (pt, n) in res.items():
+                memo.put(self._papi, self._dataset['name'], n, twk, pt, ct, ttl)
+            for i in miss:
+                pts[i], nums[i] = res[cts[i]]
+        else:
+            pts, nums = decryptMany(self._dataset, context, cts, twk)
+
+        counts = collections.Counter(nums)
+        if counts:
+            checkKeyNumber(self._creds, self._dataset['name'], max(counts))
+        for n, count in counts.items():
+            self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="decrypt",
+                dataset_type="structured", key_number=n, count=count)
+        return pts
+
+def decryptMany(dataset, context, cts, twk = None):
+    """
+    Decrypt a list of values
+
+    context(n, l) must return the object (an FF1 context or a codebook)
+    that decrypts values of length l with key number n. Values are
+    grouped by the key number encoded in them and by length, and each
+    group is decrypted as a batch. Returns the plain texts, in the order
+    of the input, and the key number of each of them. Events are not
+    recorded; that is up to the caller.
+    """
+    ics = dataset['input_character_set']
+    ocs = dataset['output_character_set']
+    plan = datasetFormat(dataset)
+
+    input_min = dataset['min_input_length']
+    input_max = dataset['max_input_length']
+
+    fmts = []
+    groups = {}
+    for i, ct in enumerate(cts):
+        fmt, ct = plan.Input(ct, False)
 
-        self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="decrypt",
-            dataset_type="structured", key_number=n, count=1)
-        return fmtOutput(fmt, pt, pth, rules)
+        input_len = len(ct)
+        if input_len < input_min or input_len > input_max:
+            raise RuntimeError('Invalid input len (%s) min: %s max %s'%(input_len, input_min, input_max))
+
+        ct, n = decKeyNumber(ct, ocs, dataset['msb_encoding_bits'])
+        fmts.append(fmt)
+        groups.setdefault((n, input_len), ([], []))
+        groups[(n, input_len)][0].append(i)
+        groups[(n, input_len)][1].append(strConvertRadix(ct, ocs, ics))
+
+    pts = [None] * len(fmts)
+    nums = [None] * len(fmts)
+    for (n, input_len), (idx, grp) in groups.items():
+        for i, pt in zip(idx, context(n, input_len).DecryptMany(grp, twk)):
+            pts[i] = plan.Output(fmts[i], pt)
+            nums[i] = n
+    return pts, nums
 
 def Decrypt(creds, dataset_name, ct, twk = None):
     result = Decryption(creds, dataset_name).Cipher(ct, twk)
     if creds.configuration.get_event_reporting_synchronous():
         creds.process_events()
     return result
+
+def DecryptMany(creds, dataset_name, cts, twk = None):
+    """Decrypt every value of an iterable, returning a list"""
+    results = Decryption(creds, dataset_name).CipherMany(list(cts), twk)
+    if creds.configuration.get_event_reporting_synchronous():
+        creds.process_events()
+    return results
+
+def DecryptIter(creds, dataset_name, cts, twk = None, batch_size = BATCH):
+    """
+    Decrypt the values of an iterable as they are consumed
+
+    Values are read and decrypted batch_size at a time, so that streams
+    of any length are processed in constant memory.
+    """
+    dec = Decryption(creds, dataset_name)
+    for batch in batched(cts, batch_size):
+        yield from dec.CipherMany(batch, twk)
+        if creds.configuration.get_event_reporting_synchronous():
+            creds.process_events()
@@ -1,12 +1,11 @@
 #/usr/bin/env python3
 
-import base64
-from .lib import ff1
-
 from ..credentials import credentials
 
-from .common import fmtInput, strConvertRadix, encKeyNumber, fmtOutput
-from .common import fetchDataset, fetchKey, fetchCurrentKeys
+from .common import datasetFormat, strConvertRadix, encKeyNumber, batched, BATCH
+from .common import fetchDataset, fetchContext, fetchCurrentKeys
+from .codebook import fetchCodebook
+from .memo import fetchMemo
 
 class Encryption:
     def __del__(self):
@@ -27,78 +26,177 @@ class Encryption:
         self._srsa = creds.secret_crypto_access_key
 
         self._dataset = fetchDataset(self._creds, dataset_name)
-        self._key = fetchKey(self._creds,
-                             dataset_name)
-
-        if self._dataset['encryption_algorithm'] == 'FF1':
-            self._algo = ff1.Context(
-                self._key['unwrapped_data_key'],
-                base64.b64decode(self._dataset['tweak']),
-                self._dataset['tweak_min_len'], self._dataset['tweak_max_len'],
-                len(self._dataset['input_character_set']),
-                self._dataset['input_character_set'])
-        else:
-            raise RuntimeError('unsupported algorithm: ' +
-                               self._dataset['encryption_algorithm'])
+        self._key, self._algo = fetchContext(self._creds, self._dataset)
 
     def Cipher(self, pt, twk = None):
-        pth = self._dataset['passthrough']
+        n = int(self._key['key_number'])
+
+        memo = fetchMemo(self._creds)
+        if memo:
+            if twk != None:
+                twk = bytes(twk)
+            hit = memo.get(self._papi, self._dataset['name'], n, twk, True, pt)
+            if hit:
+                ct = hit[0]
+            else:
+                ct = self._cipher(pt, twk)
+                memo.put(self._papi, self._dataset['name'], n, twk, pt, ct,
+                         self._creds.configuration.key_caching_ttl_seconds)
+        else:
+            ct = self._cipher(pt, twk)
+
+        self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="encrypt",
+                dataset_type="structured", key_number=self._key['key_number'], count=1)
+
+        return ct
+
+    def _cipher(self, pt, twk):
         ics = self._dataset['input_character_set']
         ocs = self._dataset['output_character_set']
-        rules = self._dataset.get('passthrough_rules', [])
+        plan = datasetFormat(self._dataset)
 
         input_min = self._dataset['min_input_length']
         input_max = self._dataset['max_input_length']
 
-        fmt, pt, rules = fmtInput(pt, pth, ics, ocs, rules)
+        fmt, pt = plan.Input(pt, True)
 
         input_len = len(pt)
         if input_len < input_min or input_len > input_max:
             raise RuntimeError('Invalid input len (%s) min: %s max %s'%(input_len, input_min, input_max))
 
-        ct = self._algo.Encrypt(pt, twk)
+        cb = fetchCodebook(self._creds, self._dataset, self._key, input_len, twk)
+        if cb:
+            ct = cb.Encrypt(pt)
+        else:
+            ct = self._algo.Encrypt(pt, twk)
 
         ct = strConvertRadix(ct, ics, ocs)
         ct = encKeyNumber(ct, ocs,
                           self._key['key_number'],
                           self._dataset['msb_encoding_bits'])
-        
-        self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="encrypt",
-                dataset_type="structured", key_number=self._key['key_number'], count=1)
-        
-        return fmtOutput(fmt, ct, pth, rules)
+
+        return plan.Output(fmt, ct)
     
     def CipherForSearch(self, pt, twk=None):
+        """
+        Return the list of the encryptions of pt with every key of the
+        dataset
+        """
+        return self.CipherForSearchMany([pt], twk)[pt]
+
+    def CipherForSearchMany(self, pts, twk = None):
+        """
+        Return a dictionary mapping each distinct value in pts to the
+        list of its encryptions with every key of the dataset
+
+        The values are encrypted as a batch for each key, and the keys
+        are fetched once for the whole batch.
+        """
         keys = fetchCurrentKeys(self._creds,
                             self._dataset['name'])
-        
-        pth = self._dataset['passthrough']
-        ics = self._dataset['input_character_set']
-        ocs = self._dataset['output_character_set']
-        rules = self._dataset.get('passthrough_rules', [])
-        
 
-        fmt, pt, rules = fmtInput(pt, pth, ics, ocs, rules)
+        pts = list(dict.fromkeys(pts))
+        results = {pt: [] for pt in pts}
+        for key_num, key in sorted(keys.items()):
+            context = self._context(key, twk)
+            for pt, ct in zip(pts, encryptMany(
+                    self._dataset, key, context, pts, twk)):
+                results[pt].append(ct)
+        return results
+
+    def _context(self, key, twk, algo = None):
+        """
+        Return the function that encryptMany calls to get the object
+        that encrypts values of a given length with key: the codebook
+        for that length if it is ready, or else the FF1 context
+        """
+        if algo is None:
+            _, algo = fetchContext(self._creds, self._dataset, key=key)
+        def context(n):
+            cb = fetchCodebook(self._creds, self._dataset, key, n, twk)
+            return cb if cb else algo
+        return context
+
+    def CipherMany(self, pts, twk = None):
+        """
+        Encrypt a list of values, recording a single event for all of
+        them
+        """
+        context = self._context(self._key, twk, self._algo)
+
+        memo = fetchMemo(self._creds)
+        if memo:
+            n = int(self._key['key_number'])
+            if twk != None:
+                twk = bytes(twk)
+
+            cts = [None] * len(pts)
+            miss = []
+            for i, pt in enumerate(pts):
+                hit = memo.get(self._papi, self._dataset['name'], n, twk, True, pt)
+                if hit:
+                    cts[i] = hit[0]
+                else:
+                    miss.append(i)
+
+            # repeated values in the batch are only encrypted once
+            uniq = list(dict.fromkeys(pts[i] for i in miss))
+            res = dict(zip(uniq, encryptMany(
+                self._dataset, self._key, context, uniq, twk)))
+            ttl = self._creds.configuration.key_caching_ttl_seconds
+            for pt, ct in res.items():
+                memo.put(self._papi, self._dataset['name'], n, twk, pt, ct, ttl)
+            for i in miss:
+                cts[i] = res[pts[i]]
+        else:
+            cts = encryptMany(self._dataset, self._key, context, pts, twk)
 
+        if cts:
+            self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="encrypt",
+                    dataset_type="structured", key_number=self._key['key_number'], count=len(cts))
+        return cts
 
-        searchCipher = []
-        for _, (key_num, key) in enumerate(keys.items()):
-            algo = ff1.Context(
-                key['unwrapped_data_key'],
-                base64.b64decode(self._dataset['tweak']),
-                self._dataset['tweak_min_len'], self._dataset['tweak_max_len'],
-                len(ics),
-                ics)
-            ct = algo.Encrypt(pt, twk)
-            ct = strConvertRadix(ct, ics, ocs)
-            ct = encKeyNumber(ct, ocs,
-                          key_num,
-                          self._dataset['msb_encoding_bits'])
-            searchCipher.append(fmtOutput(fmt, ct, pth, rules))
 
-        return searchCipher
+def encryptMany(dataset, key, context, pts, twk = None):
+    """
+    Encrypt a list of values with one key
+
+    context(n) must return the object (an FF1 context or a codebook)
+    that encrypts values of length n with the key. Values are grouped by
+    length after formatting and each group is encrypted as a batch.
+    Returns the cipher texts in the order of the input. Events are not
+    recorded; that is up to the caller.
+    """
+    ics = dataset['input_character_set']
+    ocs = dataset['output_character_set']
+    plan = datasetFormat(dataset)
+
+    input_min = dataset['min_input_length']
+    input_max = dataset['max_input_length']
 
+    fmts = []
+    groups = {}
+    for i, pt in enumerate(pts):
+        fmt, pt = plan.Input(pt, True)
 
+        input_len = len(pt)
+        if input_len < input_min or input_len > input_max:
+            raise RuntimeError('Invalid input len (%s) min: %s max %s'%(input_len, input_min, input_max))
+
+        fmts.append(fmt)
+        groups.setdefault(input_len, ([], []))
+        groups[input_len][0].append(i)
+        groups[input_len][1].append(pt)
+
+    cts = [None] * len(fmts)
+    for input_len, (idx, grp) in groups.items():
+        for i, ct in zip(idx, context(input_len).EncryptMany(grp, twk)):
+            ct = strConvertRadix(ct, ics, ocs)
+            ct = encKeyNumber(ct, ocs,
+                              key['key_number'],
+                              dataset['msb_encoding_bits'])
+            cts[i] = plan.Output(fmts[i], ct)
+    return cts
 
 def Encrypt(creds, dataset_name, pt, twk = None):
     results = Encryption(creds, dataset_name).Cipher(pt, twk)
@@ -106,8 +204,52 @@ def Encrypt(creds, dataset_name, pt, twk = None):
         creds.process_events()
     return results
 
+def EncryptMany(creds, dataset_name, pts, twk = None):
+    """Encrypt every value of an iterable, returning a list"""
+    results = Encryption(creds, dataset_name).CipherMany(list(pts), twk)
+    if creds.configuration.get_event_reporting_synchronous():
+        creds.process_events()
+    return results
+
+def EncryptIter(creds, dataset_name, pts, twk = None, batch_size = BATCH):
+    """
+    Encrypt the values of an iterable as they are consumed
+
+    Values are read and encrypted batch_size at a time, so that streams
+    of any length are processed in constant memory.
+    """
+    enc = Encryption(creds, dataset_name)
+    for batch in batched(pts, batch_size):
+        yield from enc.CipherMany(batch, twk)
+        if creds.configuration.get_event_reporting_synchronous():
+            creds.process_events()
+
 def EncryptForSearch(creds, dataset_name, pt, twk = None):
     result = Encryption(creds, dataset_name).CipherForSearch(pt, twk)
     if creds.configuration.get_event_reporting_synchronous():
         creds.process_events()
     return result
+
+def EncryptForSearchMany(creds, dataset_name, pts, twk = None):
+    """
+    Return a dictionary mapping each distinct plain text to the list of
+    its cipher texts with every key of the dataset
+    """
+    result = Encryption(creds, dataset_name).CipherForSearchMany(pts, twk)
+    if creds.configuration.get_event_reporting_synchronous():
+        creds.process_events()
+    return result
+
+def EncryptForSearchChunks(creds, dataset_name, pts, chunk_size, twk = None):
+    """
+    Yield the distinct cipher texts of all of the plain texts, for all
+    keys of the dataset, in lists of at most chunk_size values
+
+    This is meant for building IN lists for queries with a limit on the
+    number of parameters.
+    """
+    if chunk_size < 1:
+        raise RuntimeError('Invalid chunk size: %s' % (chunk_size))
+    result = EncryptForSearchMany(creds, dataset_name, pts, twk)
+    cts = dict.fromkeys(ct for v in result.values() for ct in v)
+    yield from batched(cts, chunk_size)
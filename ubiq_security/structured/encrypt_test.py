@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import importlib
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestEncrypt(unittest.TestCase):
+    def setUp(self):
+        self.server = testutil.Fetches(self, [encrypt, decrypt])
+
+    def test_many(self):
+        creds = testutil.Creds()
+        pts = ['%03d-45-%04d' % (i, i * 7) for i in range(500)]
+        cts = [encrypt.Encrypt(creds, 'SSN', pt) for pt in pts]
+        creds.events = []
+
+        self.assertEqual(encrypt.EncryptMany(creds, 'SSN', iter(pts)), cts)
+        self.assertEqual(decrypt.DecryptMany(creds, 'SSN', cts), pts)
+        self.assertEqual(encrypt.EncryptMany(creds, 'SSN', []), [])
+
+        it = encrypt.EncryptIter(creds, 'SSN', iter(pts), batch_size = 64)
+        self.assertEqual(next(it), cts[0])
+        self.assertEqual([cts[0]] + list(it), cts)
+        self.assertEqual(
+            list(decrypt.DecryptIter(creds, 'SSN', cts, batch_size = 64)), pts)
+        self.assertEqual(creds.count(), 4 * 500)
+
+        with self.assertRaises(RuntimeError):
+            encrypt.EncryptMany(creds, 'SSN', pts + ['12-34'])
+
+    def test_search(self):
+        # room in the output character set for 3 key numbers
+        self.server.dataset = dict(testutil.DATASET, msb_encoding_bits = 4,
+                                   output_character_set = ''.join(
+                                       chr(c) for c in range(0x30, 0x30 + 64)))
+        self.server.keys = {
+            n: {'key_number': n, 'unwrapped_data_key': bytes([n] * 32)}
+            for n in range(3)}
+        creds = testutil.Creds()
+
+        pts = ['%03d-45-%04d' % (i, i * 7) for i in range(100)]
+        result = encrypt.EncryptForSearchMany(creds, 'SSN', pts + pts[:10])
+        self.assertEqual(list(result), pts)
+        for pt in pts[::10]:
+            self.assertEqual(result[pt],
+                             encrypt.EncryptForSearch(creds, 'SSN', pt))
+
+        with self.assertRaises(RuntimeError):
+            encrypt.EncryptForSearch(creds, 'SSN', '12-34')
+        with self.assertRaises(RuntimeError):
+            encrypt.EncryptForSearchMany(creds, 'SSN', pts + ['12-34'])
+
+        chunks = list(encrypt.EncryptForSearchChunks(creds, 'SSN', pts, 64))
+        self.assertEqual([len(c) for c in chunks], [64] * 4 + [44])
+        self.assertEqual(set(sum(chunks, [])),
+                         set(sum(result.values(), [])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Encryption of whole pandas and Arrow columns.
+#
+# Columns often hold far fewer distinct values than rows. The helpers
+# here find the distinct values with the column library's own (native)
+# routines, encrypt or decrypt each of them once through the batched
+# FF1 path and scatter the results back to the rows, so that the cost
+# follows the number of distinct values. Nulls are kept as they are and
+# never reach FF1.
+#
+# pandas and pyarrow are optional; only the helpers for the library
+# that a column comes from need it to be installed. They are imported
+# when those helpers are first called.
+
+from .common import fetchDataset, fetchContext
+from .codebook import fetchCodebook
+from .encrypt import encryptMany
+from .decrypt import decryptMany
+
+def cipherUnique(creds, dataset_name, values, counts, twk, ENC):
+    """
+    Encrypt (or decrypt) a list of distinct values
+
+    counts holds the number of rows that each value stands for. Events
+    are recorded for all of those rows, as if each of them had been
+    processed, but each value is only processed once. Returns the
+    results in the order of values.
+    """
+    if not creds.set():
+        raise RuntimeError("credentials not set")
+
+    dataset = fetchDataset(creds, dataset_name)
+    events = {}
+    if ENC:
+        key, ctx = fetchContext(creds, dataset)
+        def context(l):
+            cb = fetchCodebook(creds, dataset, key, l, twk)
+            return cb if cb else ctx
+
+        results = encryptMany(dataset, key, context, values, twk)
+        events['encrypt', int(key['key_number'])] = sum(counts)
+    else:
+        ctxs = {}
+        def context(n, l):
+            if not n in ctxs:
+                ctxs[n] = fetchContext(creds, dataset, n)
+            key, ctx = ctxs[n]
+            cb = fetchCodebook(creds, dataset, key, l, twk)
+            return cb if cb else ctx
+
+        results, nums = decryptMany(dataset, context, values, twk)
+        for n, count in zip(nums, counts):
+            events['decrypt', n] = events.get(('decrypt', n), 0) + count
+
+    for (action, n), count in events.items():
+        if count:
+            creds.add_event(dataset_name=dataset['name'], dataset_group_name="", billing_action=action,
+                dataset_type="structured", key_number=n, count=count)
+    if creds.configuration.get_event_reporting_synchronous():
+        creds.process_events()
+    return results
+
+def _series(creds, dataset_name, series, twk, ENC):
+    try:
+        import numpy
+        import pandas
+    except ImportError:
+        raise RuntimeError('pandas is not installed')
+
+    # codes are -1 for nulls
+    codes, uniques = pandas.factorize(series, use_na_sentinel=True)
+    counts = numpy.bincount(codes[codes >= 0], minlength=len(uniques))
+
+    # the extra, last, element is picked by the -1 codes
+    results = numpy.empty(len(uniques) + 1, dtype=object)
+    results[:-1] = cipherUnique(creds, dataset_name, list(uniques),
+                                counts.tolist(), twk, ENC)
+
+    out = pandas.Series(results[codes], index=series.index,
+                        name=series.name, dtype=object)
+    # nulls keep their original value, whichever of None, NaN or NA
+    # the caller used, and string columns keep their dtype
+    nulls = codes < 0
+    out[nulls] = series.to_numpy(dtype=object)[nulls]
+    if isinstance(series.dtype, pandas.StringDtype):
+        out = out.astype(series.dtype)
+    return out
+
+def EncryptSeries(creds, dataset_name, series, twk = None):
+    """
+    Encrypt a pandas Series of strings. Returns a Series with the same
+    index and, for string dtypes, the same dtype; null entries are left
+    as they are (None, NaN or NA)
+    """
+    return _series(creds, dataset_name, series, twk, True)
+
+def DecryptSeries(creds, dataset_name, series, twk = None):
+    """
+    Decrypt a pandas Series of strings. Returns a Series with the same
+    index and, for string dtypes, the same dtype; null entries are left
+    as they are (None, NaN or NA)
+    """
+    return _series(creds, dataset_name, series, twk, False)
+
+def _arrow(creds, dataset_name, array, twk, ENC):
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:
+        raise RuntimeError('pyarrow is not installed')
+
+    # distinct, non-null values and the number of rows of each
+    counts = pyarrow.compute.value_counts(array)
+    uniques = counts.field('values')
+    valid = pyarrow.compute.is_valid(uniques)
+    uniques = uniques.filter(valid)
+    counts = counts.field('counts').filter(valid)
+
+    results = pyarrow.array(
+        cipherUnique(creds, dataset_name, uniques.to_pylist(),
+                     counts.to_pylist(), twk, ENC),
+        type=array.type)
+    # the index of each row in uniques, null for nulls, which take
+    # turns back into nulls
+    indices = pyarrow.compute.index_in(array, value_set=uniques)
+    return pyarrow.compute.take(results, indices)
+
+def EncryptArrow(creds, dataset_name, array, twk = None):
+    """
+    Encrypt a pyarrow Array or ChunkedArray of strings. Nulls are
+    preserved
+    """
+    return _arrow(creds, dataset_name, array, twk, True)
+
+def DecryptArrow(creds, dataset_name, array, twk = None):
+    """
+    Decrypt a pyarrow Array or ChunkedArray of strings. Nulls are
+    preserved
+    """
+    return _arrow(creds, dataset_name, array, twk, False)
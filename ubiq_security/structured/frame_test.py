@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import importlib.util
+import unittest
+
+import importlib
+frame = importlib.import_module('ubiq_security.structured.frame')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestFrame(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [encrypt, frame])
+
+        self.creds = testutil.Creds()
+        self.pts = ['%03d-45-6789' % (i) for i in range(50)]
+        self.cts = encrypt.EncryptMany(self.creds, 'SSN', self.pts)
+        self.creds.events = []
+
+    def test_unique(self):
+        cts = frame.cipherUnique(self.creds, 'SSN', self.pts,
+                                 [3] * len(self.pts), None, True)
+        self.assertEqual(cts, self.cts)
+        pts = frame.cipherUnique(self.creds, 'SSN', cts,
+                                 [2] * len(cts), None, False)
+        self.assertEqual(pts, self.pts)
+        # events count rows, not distinct values
+        self.assertEqual([(e['billing_action'], e['count'])
+                          for e in self.creds.events],
+                         [('encrypt', 150), ('decrypt', 100)])
+
+    @unittest.skipIf(importlib.util.find_spec('pandas') is None,
+                     'pandas is not installed')
+    def test_series(self):
+        import pandas
+        import pandas.testing
+        rows = [self.pts[i % 50] if i % 7 else None for i in range(1000)]
+        cts = [self.cts[i % 50] if i % 7 else None for i in range(1000)]
+        index = range(1000, 2000)
+
+        # nulls come back as the sentinel of the input, in its dtype
+        for dtype in (object, None, 'string'):
+            series = pandas.Series(rows, index=index, name='ssn', dtype=dtype)
+            ct = frame.EncryptSeries(self.creds, 'SSN', series)
+            pandas.testing.assert_series_equal(
+                ct, pandas.Series(cts, index=index, name='ssn', dtype=dtype))
+            pt = frame.DecryptSeries(self.creds, 'SSN', ct)
+            pandas.testing.assert_series_equal(pt, series)
+
+        empty = frame.EncryptSeries(self.creds, 'SSN',
+                                    pandas.Series([None, None], dtype=object))
+        self.assertEqual(list(empty), [None, None])
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None,
+                     'pyarrow is not installed')
+    def test_arrow(self):
+        import pyarrow
+        rows = [self.pts[i % 50] if i % 7 else None for i in range(1000)]
+
+        ct = frame.EncryptArrow(self.creds, 'SSN', pyarrow.array(rows))
+        self.assertTrue(ct.equals(pyarrow.array(
+            [self.cts[i % 50] if i % 7 else None for i in range(1000)])))
+
+        chunked = pyarrow.chunked_array([ct[:500], ct[500:]])
+        self.assertTrue(frame.DecryptArrow(self.creds, 'SSN', chunked).equals(
+            pyarrow.chunked_array([pyarrow.array(rows)])))
+
+if __name__ == '__main__':
+    unittest.main()
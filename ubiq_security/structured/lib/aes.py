@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# Registry of AES implementations used by the FFX PRF.
+#
+# Each backend creates engines for a key. An engine provides:
+#
+#   ecb(buf) - encrypt each 16-byte block of buf independently
+#   mac(buf) - return the last block of the CBC encryption of buf
+#              using a zero IV
+#
+# Backends are verified against known answers before they are used. By
+# default, every verified backend runs a short benchmark and the fastest
+# one is used; a backend can also be chosen explicitly by name.
+
+import time
+import threading
+
+BLKSZ = 16
+
+class AES:
+    """
+    Key-scheduled AES engine built from persistent ECB and CBC contexts
+
+    The contexts are created once and reused for every block that is
+    encrypted. They are stateful, so an engine must not be shared between
+    threads; see ffx.Context.aes.
+    """
+    BLKSZ = BLKSZ
+
+    def __init__(self, ecb, cbc):
+        self._ecb = ecb
+        self._cbc = cbc
+        # the CBC context is never finalized. it chains from the last
+        # block that it produced, which has to be cancelled out of the
+        # next buffer so that each MAC starts from a zero IV
+        self._iv = 0
+
+    def ecb(self, buf):
+        """Encrypt each block of buf independently"""
+        return self._ecb.update(buf)
+
+    def mac(self, buf):
+        """Return the last block of the CBC encryption of buf (zero IV)"""
+        if len(buf) == self.BLKSZ:
+            return self._ecb.update(buf)
+
+        if self._iv:
+            buf = ((int.from_bytes(buf[:self.BLKSZ], byteorder='big') ^
+                    self._iv).to_bytes(self.BLKSZ, byteorder='big') +
+                   bytes(buf[self.BLKSZ:]))
+        dst = self._cbc.update(buf)[-self.BLKSZ:]
+        self._iv = int.from_bytes(dst, byteorder='big')
+        return dst
+
+class CBC:
+    """
+    Engine that creates a new cipher context for every call
+
+    This is how the PRF was originally computed. It is kept as a
+    reference and for platforms where reusing contexts is not possible.
+    """
+    BLKSZ = BLKSZ
+
+    def __init__(self, key):
+        import cryptography.hazmat.primitives.ciphers as crypto
+
+        self._crypto = crypto
+        self._aes = crypto.algorithms.AES(key)
+
+    def ecb(self, buf):
+        cipher = self._crypto.Cipher(
+            self._aes, self._crypto.modes.ECB()).encryptor()
+        return cipher.update(buf) + cipher.finalize()
+
+    def mac(self, buf):
+        cipher = self._crypto.Cipher(
+            self._aes, self._crypto.modes.CBC(bytes(BLKSZ))).encryptor()
+        return (cipher.update(buf) + cipher.finalize())[-BLKSZ:]
+
+def _cryptography(key):
+    import cryptography.hazmat.primitives.ciphers as crypto
+
+    aes = crypto.algorithms.AES(key)
+    return AES(crypto.Cipher(aes, crypto.modes.ECB()).encryptor(),
+               crypto.Cipher(aes, crypto.modes.CBC(bytes(BLKSZ))).encryptor())
+
+def _m2crypto(key):
+    from M2Crypto import EVP
+
+    alg = 'aes_%d' % (len(key) * 8)
+    return AES(EVP.Cipher(alg=alg + '_ecb', key=key, iv=bytes(BLKSZ),
+                          op=1, padding=0),
+               EVP.Cipher(alg=alg + '_cbc', key=key, iv=bytes(BLKSZ),
+                          op=1, padding=0))
+
+class Backend:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+
+        self.verified = None
+        self.error = None
+        # millions of bytes encrypted per second, if benchmarked
+        self.throughput = None
+
+    def new(self, key):
+        return self.factory(key)
+
+    def verify(self):
+        """Check the backend against known answers"""
+        if self.verified is None:
+            try:
+                # NIST SP 800-38A, F.1.1 ECB-AES128.Encrypt
+                engine = self.new(bytes.fromhex(
+                    '2b7e151628aed2a6abf7158809cf4f3c'))
+                pt = bytes.fromhex('6bc1bee22e409f96e93d7e117393172a'
+                                   'ae2d8a571e03ac9c9eb76fac45af8e51')
+                ct = bytes.fromhex('3ad77bb40d7a3660a89ecaf32466ef97'
+                                   'f5d3d58503b9699de785895a96fdbaaf')
+                ok = engine.ecb(pt) == ct
+
+                # CBC-MAC with a zero IV, repeated to check that state
+                # does not carry over from one call to the next
+                mac = engine.ecb(bytes(
+                    a ^ b for a, b in zip(ct[:BLKSZ], pt[BLKSZ:])))
+                for i in range(3):
+                    ok = ok and engine.mac(pt) == mac
+                    ok = ok and engine.mac(pt[:BLKSZ]) == ct[:BLKSZ]
+
+                self.verified = ok
+                if not ok:
+                    self.error = 'known answer test failed'
+            except Exception as e:
+                self.verified = False
+                self.error = '%s: %s' % (type(e).__name__, e)
+        return self.verified
+
+    def benchmark(self):
+        """
+        Measure throughput with a mix of calls similar to FF1's: single
+        blocks, short MACs and a few large batches
+        """
+        engine = self.new(bytes(BLKSZ))
+        one = bytes(BLKSZ)
+        two = bytes(2 * BLKSZ)
+        many = bytes(256 * BLKSZ)
+
+        start = time.perf_counter()
+        for i in range(200):
+            engine.ecb(one)
+            engine.mac(two)
+        for i in range(10):
+            engine.ecb(many)
+        elapsed = time.perf_counter() - start
+
+        size = 200 * (len(one) + len(two)) + 10 * len(many)
+        self.throughput = size / max(elapsed, 1e-9) / 1e6
+        return self.throughput
+
+_backends = {}
+_lock = threading.Lock()
+_selected = None
+
+def Register(name, factory):
+    """
+    Add a backend
+
+    factory(key) must return an engine for the key and should raise
+    ImportError if the library it needs is not installed.
+    """
+    global _selected
+    with _lock:
+        _backends[name] = Backend(name, factory)
+        _selected = None
+
+Register('cryptography-ecb', _cryptography)
+Register('cryptography-cbc', lambda key: CBC(key))
+Register('m2crypto', _m2crypto)
+
+def Backends():
+    """Return the names of all registered backends"""
+    return list(_backends)
+
+def Available():
+    """Return the names of the backends that pass verification"""
+    return [name for name, b in list(_backends.items()) if b.verify()]
+
+def Get(name = None):
+    """
+    Return the named backend, or the fastest verified backend if no
+    name (or 'auto') is given
+    """
+    global _selected
+
+    if name != None and name != 'auto':
+        backend = _backends.get(name)
+        if backend is None:
+            raise RuntimeError('Unknown AES backend: %s' % (name))
+        if not backend.verify():
+            raise RuntimeError('AES backend %s is not usable (%s)' %
+                               (name, backend.error))
+        return backend
+
+    if _selected is None:
+        with _lock:
+            if _selected is None:
+                best = None
+                for backend in list(_backends.values()):
+                    if backend.verify():
+                        backend.benchmark()
+                        if best is None or backend.throughput > best.throughput:
+                            best = backend
+                if best is None:
+                    raise RuntimeError('No usable AES backend')
+                _selected = best
+    return _selected
+
+def Info():
+    """Describe the registered backends and which one is selected"""
+    return {
+        'selected': _selected.name if _selected else None,
+        'backends': [{'name': b.name,
+                      'verified': b.verified,
+                      'error': b.error,
+                      'throughput_mbps': b.throughput}
+                     for b in list(_backends.values())],
+    }
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import importlib
+aes = importlib.import_module('ubiq_security.structured.lib.aes')
+ff1 = importlib.import_module('ubiq_security.structured.lib.ff1')
+
+class TestAES(unittest.TestCase):
+    def test_backends_agree(self):
+        names = aes.Available()
+        self.assertIn('cryptography-ecb', names)
+        self.assertIn('cryptography-cbc', names)
+
+        key = bytes(range(32))
+        pts = ['%09d' % (i * 7919) for i in range(20)]
+        res = None
+        for name in names:
+            ctx = ff1.Context(key, bytes(range(7)), 0, 7, 10, backend=name)
+            cts = [ctx.Encrypt(pt) for pt in pts]
+            if res == None:
+                res = cts
+            self.assertEqual(cts, res)
+            self.assertEqual([ctx.Decrypt(ct) for ct in cts], pts)
+
+    def test_auto(self):
+        backend = aes.Get()
+        self.assertTrue(backend.verified)
+        self.assertIsNotNone(backend.throughput)
+        self.assertIs(aes.Get('auto'), backend)
+        self.assertEqual(aes.Info()['selected'], backend.name)
+
+    def test_unknown(self):
+        with self.assertRaises(RuntimeError):
+            aes.Get('rot13')
+
+    def test_broken(self):
+        class Broken(aes.AES):
+            def ecb(self, buf):
+                return bytes(len(buf))
+
+        aes.Register('broken', lambda key: Broken(None, None))
+        try:
+            self.assertNotIn('broken', aes.Available())
+            with self.assertRaises(RuntimeError):
+                aes.Get('broken')
+            self.assertNotEqual(aes.Get().name, 'broken')
+        finally:
+            del aes._backends['broken']
+
+if __name__ == '__main__':
+    unittest.main()
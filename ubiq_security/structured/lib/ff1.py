@@ -3,82 +3,171 @@
 import math
 
 from . import ffx
+from . import ff1_numpy
+
+class _Params:
+    """
+    Values that depend only on the input length and the tweak.
+
+    The P block and the tweak portion of Q are the same in every round,
+    so the CBC-MAC is run over them once and its chaining value is folded
+    into the blocks that change from round to round. Only those trailing
+    blocks, with the round number and B filled in, are encrypted per round.
+    """
+    def __init__(self, ctx, n, T):
+        BLKSZ = ctx.BLKSZ
+        radix = ctx.radix
+
+        self.u = u = n // 2
+        self.v = v = n - u
+
+        self.b = b = (math.ceil(math.log2(radix) * v) + 7) // 8
+        self.d = 4 * ((b + 3) // 4) + 4
+        self.nR = (self.d + (BLKSZ - 1)) // BLKSZ
+
+        self.mU = radix ** u
+        self.mV = self.mU
+        if u != v:
+            self.mV *= radix
+
+        PQ = bytearray(
+            [0] * (BLKSZ + ((len(T) + b + 1 + 15) // BLKSZ) * BLKSZ))
+
+        # initialize the P portion of PQ
+        PQ[:8] = [1, 2, 1,
+                  radix >> 16 & 0xff,
+                  radix >> 8 & 0xff,
+                  radix & 0xff,
+                  10, u & 0xff]
+        PQ[8:12] = n.to_bytes(4, byteorder='big')
+        PQ[12:16] = len(T).to_bytes(4, byteorder='big')
+
+        # initialize the constant portion of Q
+        PQ[BLKSZ:BLKSZ + len(T)] = T
+
+        # every block before the one holding the round number is constant
+        k = ((len(PQ) - b - 1) // BLKSZ) * BLKSZ
+        self.m = len(PQ) - k
+
+        chain = int.from_bytes(ctx.PRF(PQ[:k]), byteorder='big')
+        base = (int.from_bytes(PQ[k:], byteorder='big') ^
+                (chain << (8 * (self.m - BLKSZ))))
+        self.rounds = [base ^ (i << (8 * b)) for i in range(10)]
+
+def Expand(aes, R, nR):
+    """
+    Extend the first block of R to nR blocks
+
+    Block j of R is the encryption of the first block with j xor'ed into
+    its last four bytes. All of the counter blocks are built up front and
+    encrypted with a single ECB call.
+    """
+    BLKSZ = aes.BLKSZ
+    w = int.from_bytes(R, byteorder='big')
+    return R + aes.ecb(b''.join(
+        (w ^ j).to_bytes(BLKSZ, byteorder='big') for j in range(1, nR)))
+
+def MacMany(aes, Q, m):
+    """
+    CBC-MAC a list of m-byte integers in lockstep
+
+    Each ECB call encrypts the same block position of every value, so the
+    number of calls depends on m and not on the number of values.
+    Returns the concatenated final blocks.
+    """
+    BLKSZ = aes.BLKSZ
+    mask = (1 << (8 * BLKSZ)) - 1
+
+    R = None
+    for p in range(m - BLKSZ, -BLKSZ, -BLKSZ):
+        shift = 8 * p
+        if R is None:
+            buf = b''.join([(q >> shift).to_bytes(BLKSZ, byteorder='big')
+                            for q in Q])
+        else:
+            buf = b''.join([
+                (((q >> shift) & mask) ^
+                 int.from_bytes(R[k:k + BLKSZ], byteorder='big')).to_bytes(
+                     BLKSZ, byteorder='big')
+                for k, q in zip(range(0, len(R), BLKSZ), Q)])
+        R = aes.ecb(buf)
+    return R
+
+def ExpandMany(aes, R, nR):
+    """
+    Extend each block of R (see Expand) to nR blocks with one ECB call
+
+    Returns one bytes object of nR blocks per input block.
+    """
+    BLKSZ = aes.BLKSZ
+    W = [R[k:k + BLKSZ] for k in range(0, len(R), BLKSZ)]
+    E = aes.ecb(b''.join([
+        (w ^ j).to_bytes(BLKSZ, byteorder='big')
+        for w in [int.from_bytes(r, byteorder='big') for r in W]
+        for j in range(1, nR)]))
+
+    step = (nR - 1) * BLKSZ
+    return [r + E[k:k + step] for r, k in zip(W, range(0, len(E), step))]
 
 class Context:
     def __init__(self,
                  key, twk,
                  mintwklen, maxtwklen,
-                 radix, alpha = ffx.DEFAULT_ALPHABET):
+                 radix, alpha = ffx.DEFAULT_ALPHABET,
+                 backend = None):
         self.ffx = ffx.Context(key, twk,
                                2**32,
                                mintwklen, maxtwklen,
-                               radix, alpha)
+                               radix, alpha, backend)
+        self._params = {}
 
-    def cipher(self, X, T, ENC):
-        BLKSZ = self.ffx.BLKSZ
-
-        n = len(X)
-        u = int(n / 2)
-        v = n - u
+    def params(self, n, T):
+        P = self._params.get((n, T))
+        if P is None:
+            if (n < self.ffx.mintxtlen or
+                n > self.ffx.maxtxtlen or
+                len(T) < self.ffx.mintwklen or
+                (self.ffx.maxtwklen > 0 and
+                 len(T) > self.ffx.maxtwklen)):
+                raise RuntimeError('Input or tweak length error')
 
-        b = int((math.ceil(math.log2(self.ffx.radix) * v) + 7) / 8)
-        d = 4 * int((b + 3) / 4) + 4
-
-        R = bytearray([0] * int((d + (BLKSZ - 1)) / BLKSZ) * BLKSZ)
+            # one entry per input length and tweak in use
+            if len(self._params) >= 1024:
+                self._params.clear()
+            P = _Params(self.ffx, n, T)
+            self._params[(n, T)] = P
+        return P
 
+    def cipher(self, X, T, ENC):
         if T == None:
             T = self.ffx.twk
         if T == None:
             T = bytes([])
 
-        if (n < self.ffx.mintxtlen or
-            n > self.ffx.maxtxtlen or
-            len(T) < self.ffx.mintwklen or
-            (self.ffx.maxtwklen > 0 and
-             len(T) > self.ffx.maxtwklen)):
-            raise RuntimeError('Input or tweak length error')
-
-        PQ = bytearray(
-            [0] * (BLKSZ + int((len(T) + b + 1 + 15) / BLKSZ) * BLKSZ))
+        n = len(X)
+        P = self.params(n, bytes(T))
+        u, v, d, m = P.u, P.v, P.d, P.m
 
-        # initialize the P portion of PQ
-        PQ[:8] = [1, 2, 1,
-                  self.ffx.radix >> 16 & 0xff,
-                  self.ffx.radix >> 8 & 0xff,
-                  self.ffx.radix & 0xff,
-                  10, u & 0xff]
-        PQ[8:12] = n.to_bytes(4, byteorder='big')
-        PQ[12:16] = len(T).to_bytes(4, byteorder='big')
+        conv = self.ffx.converter
 
-        # initialize the constant portion of Q
-        PQ[BLKSZ:BLKSZ + len(T)] = T
-
-        nA = ffx.StringToNumber(self.ffx.radix, self.ffx.alpha, X[:u])
-        nB = ffx.StringToNumber(self.ffx.radix, self.ffx.alpha, X[u:])
+        nA = conv.StringToNumber(X[:u])
+        nB = conv.StringToNumber(X[u:])
         if not ENC:
             nA, nB = nB, nA
 
-        mU = self.ffx.radix ** u
-        mV = mU
-        if u != v:
-            mV *= self.ffx.radix
+        mU = P.mU
+        mV = P.mV
 
+        aes = self.ffx.aes
         for i in range(10):
             if ENC:
-                PQ[-b - 1] = i
+                Q = (P.rounds[i] ^ nB).to_bytes(m, byteorder='big')
             else:
-                PQ[-b - 1] = 9 - i
-
-            PQ[-b:] = nB.to_bytes(b, byteorder='big')
+                Q = (P.rounds[9 - i] ^ nB).to_bytes(m, byteorder='big')
 
-            R[:BLKSZ] = self.ffx.PRF(PQ)
-
-            for j in range(int(len(R) / BLKSZ) - 1):
-                w = int.from_bytes(R[12:BLKSZ], byteorder='big')
-
-                R[12:BLKSZ] = (w ^ (j + 1)).to_bytes(4, byteorder='big')
-                R[BLKSZ * (j + 1):BLKSZ * (j + 2)] = self.ffx.Ciph(R)
-                R[12:BLKSZ] = w.to_bytes(4, byteorder='big')
+            R = aes.mac(Q)
+            if P.nR > 1:
+                R = Expand(aes, R, P.nR)
 
             y = int.from_bytes(R[:d], byteorder='big')
             if ENC:
@@ -96,11 +185,100 @@ class Context:
         if not ENC:
             nA, nB = nB, nA
 
-        return (ffx.NumberToString(self.ffx.radix, self.ffx.alpha, nA, u) +
-                ffx.NumberToString(self.ffx.radix, self.ffx.alpha, nB, v))
+        return conv.NumberToString(nA, u) + conv.NumberToString(nB, v)
+
+    def cipherBatch(self, X, T, ENC):
+        """
+        Run the FF1 rounds for a list of values of the same length
+
+        Each round packs the PRF input of every value into a single
+        buffer so that the AES work is one native call per round,
+        regardless of how many values there are.
+        """
+        BLKSZ = self.ffx.BLKSZ
+
+        n = len(X[0])
+        if (len(X) >= ff1_numpy.MIN_BATCH and
+            ff1_numpy.Supported(self, n, T)):
+            return ff1_numpy.cipher(self, X, T, ENC).tolist()
+
+        P = self.params(n, T)
+        u, v, d, m = P.u, P.v, P.d, P.m
+
+        conv = self.ffx.converter
+
+        nA = [conv.StringToNumber(x[:u]) for x in X]
+        nB = [conv.StringToNumber(x[u:]) for x in X]
+        if not ENC:
+            nA, nB = nB, nA
+
+        aes = self.ffx.aes
+        for i in range(10):
+            if ENC:
+                base = P.rounds[i]
+            else:
+                base = P.rounds[9 - i]
+
+            if m == BLKSZ:
+                R = aes.ecb(b''.join([
+                    (base ^ b).to_bytes(m, byteorder='big') for b in nB]))
+            else:
+                R = MacMany(aes, [base ^ b for b in nB], m)
+
+            if P.nR > 1:
+                Y = [int.from_bytes(r[:d], byteorder='big')
+                     for r in ExpandMany(aes, R, P.nR)]
+            else:
+                Y = [int.from_bytes(R[k:k + d], byteorder='big')
+                     for k in range(0, len(R), BLKSZ)]
+
+            if int(ENC) == i % 2:
+                mod = P.mV
+            else:
+                mod = P.mU
+
+            if ENC:
+                nA, nB = nB, [(a + y) % mod for a, y in zip(nA, Y)]
+            else:
+                nA, nB = nB, [(a - y) % mod for a, y in zip(nA, Y)]
+
+        if not ENC:
+            nA, nB = nB, nA
+
+        return [conv.NumberToString(a, u) + conv.NumberToString(b, v)
+                for a, b in zip(nA, nB)]
+
+    def cipherMany(self, X, T, ENC):
+        if T == None:
+            T = self.ffx.twk
+        if T == None:
+            T = bytes([])
+        T = bytes(T)
+        X = list(X)
+
+        # values are processed in batches of the same length;
+        # the results are put back in the order of the input
+        buckets = {}
+        for i, x in enumerate(X):
+            buckets.setdefault(len(x), []).append(i)
+
+        if len(buckets) == 1:
+            return self.cipherBatch(X, T, ENC)
+
+        Y = [None] * len(X)
+        for idx in buckets.values():
+            for i, y in zip(idx, self.cipherBatch([X[i] for i in idx], T, ENC)):
+                Y[i] = y
+        return Y
 
     def Encrypt(self, pt, twk = None):
         return self.cipher(pt, twk, True)
 
     def Decrypt(self, ct, twk = None):
         return self.cipher(ct, twk, False)
+
+    def EncryptMany(self, pts, twk = None):
+        return self.cipherMany(pts, twk, True)
+
+    def DecryptMany(self, cts, twk = None):
+        return self.cipherMany(cts, twk, False)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# Vectorized FF1 for short inputs, using NumPy when it is installed.
+#
+# When B fits in 4 bytes (b <= 4), d is 8, the round function output is
+# the first 8 bytes of a single AES block, and both Feistel halves are
+# less than 2**32. All of the per-value arithmetic then fits in 64-bit
+# integers and a whole column of values can be processed with array
+# operations, leaving one contiguous AES-ECB call per round.
+#
+# NumPy is only imported when a batch of such values is first seen, so
+# that programs which never use this path do not load it.
+
+numpy = None
+
+# inputs shorter than this are not worth converting to arrays
+MIN_BATCH = 64
+
+def _load():
+    # import NumPy into this module. returns False if it is not installed
+    global numpy
+    if numpy is None and not _load.failed:
+        try:
+            import numpy
+        except ImportError:
+            _load.failed = True
+    return numpy is not None
+_load.failed = False
+
+def Supported(ctx, n, T):
+    """Return True if values of length n can be processed by this module"""
+    if ctx.params(n, T).b > 4 or not _load():
+        return False
+    return _tables(ctx.ffx.converter) is not None
+
+def _tables(conv):
+    # codepoint -> digit lookup and digit -> codepoint lookup.
+    # alphabets outside of the basic multilingual plane would
+    # need lookup tables that are too large to be worthwhile
+    key = (conv.radix, conv.alpha)
+    if key not in _tables.cache:
+        tables = None
+        codes = [ord(c) for c in conv.alpha]
+        if max(codes) < 0x10000:
+            digits = numpy.full(max(codes) + 1, -1, dtype=numpy.int64)
+            for i in range(len(codes) - 1, -1, -1):
+                digits[codes[i]] = i
+            tables = (digits, numpy.array(codes, dtype=numpy.uint32))
+        _tables.cache[key] = tables
+    return _tables.cache[key]
+_tables.cache = {}
+
+def _toNumbers(digits, radix):
+    n = numpy.zeros(digits.shape[0], dtype=numpy.uint64)
+    for j in range(digits.shape[1]):
+        n = n * numpy.uint64(radix) + digits[:, j].astype(numpy.uint64)
+    return n
+
+def _toDigits(n, radix, l):
+    digits = numpy.empty((n.shape[0], l), dtype=numpy.int64)
+    r = numpy.uint64(radix)
+    for j in range(l - 1, -1, -1):
+        digits[:, j] = n % r
+        n = n // r
+    return digits
+
+def cipher(ctx, X, T, ENC):
+    """
+    Encrypt or decrypt an array of strings that all have the same length
+
+    X may be any sequence of str or a NumPy string array. The result is
+    a NumPy array of str in the same order.
+    """
+    if not _load():
+        raise RuntimeError('NumPy is not installed')
+
+    BLKSZ = ctx.ffx.BLKSZ
+
+    if T == None:
+        T = ctx.ffx.twk
+    if T == None:
+        T = bytes([])
+    T = bytes(T)
+
+    X = numpy.asarray(X, dtype=numpy.str_)
+    if X.ndim != 1:
+        raise RuntimeError('Input must be a one-dimensional array')
+    N = X.shape[0]
+    if N == 0:
+        return X
+
+    n = int(numpy.char.str_len(X).max())
+    X = numpy.ascontiguousarray(X, dtype=(numpy.str_, n))
+
+    P = ctx.params(n, T)
+    if P.b > 4:
+        raise RuntimeError('Input length not supported by vectorized FF1')
+    u, v = P.u, P.v
+
+    conv = ctx.ffx.converter
+    radix = conv.radix
+    tables = _tables(conv)
+    if tables is None:
+        raise RuntimeError('Alphabet not supported by vectorized FF1')
+    lookup, codes = tables
+
+    C = X.view(numpy.uint32).reshape(N, n)
+    if C.max(initial=0) >= lookup.shape[0]:
+        raise ValueError('Invalid character(s) for alphabet')
+    D = lookup[C]
+    if (D < 0).any():
+        # includes values shorter than n (padded with NUL)
+        raise ValueError('Invalid character(s) for alphabet')
+
+    nA = _toNumbers(D[:, :u], radix)
+    nB = _toNumbers(D[:, u:], radix)
+    if not ENC:
+        nA, nB = nB, nA
+
+    mU = numpy.uint64(P.mU)
+    mV = numpy.uint64(P.mV)
+
+    mask = (1 << 64) - 1
+    Q = numpy.empty((N, 2), dtype='>u8')
+
+    aes = ctx.ffx.aes
+    for i in range(10):
+        if ENC:
+            base = P.rounds[i]
+        else:
+            base = P.rounds[9 - i]
+
+        Q[:, 0] = base >> 64
+        Q[:, 1] = numpy.uint64(base & mask) ^ nB
+
+        R = numpy.frombuffer(aes.ecb(Q.tobytes()), dtype='>u8')
+        y = R[::BLKSZ // 8].astype(numpy.uint64)
+
+        if int(ENC) == i % 2:
+            mod = mV
+        else:
+            mod = mU
+
+        y %= mod
+        if ENC:
+            y = (nA + y) % mod
+        else:
+            y = (nA + (mod - y)) % mod
+
+        nA, nB = nB, y
+
+    if not ENC:
+        nA, nB = nB, nA
+
+    D = numpy.concatenate(
+        (_toDigits(nA, radix, u), _toDigits(nB, radix, v)), axis=1)
+    return codes[D].view((numpy.str_, n)).reshape(N)
+
+def Encrypt(ctx, pts, twk = None):
+    return cipher(ctx, pts, twk, True)
+
+def Decrypt(ctx, cts, twk = None):
+    return cipher(ctx, cts, twk, False)
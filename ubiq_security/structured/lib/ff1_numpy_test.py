@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import importlib
+import importlib.util
+ff1 = importlib.import_module('ubiq_security.structured.lib.ff1')
+ff1_numpy = importlib.import_module('ubiq_security.structured.lib.ff1_numpy')
+
+@unittest.skipIf(importlib.util.find_spec('numpy') is None,
+                 'NumPy is not installed')
+class TestFF1Numpy(unittest.TestCase):
+    def cipherTest(self, key, twk, pt, ct, radix, alpha = '0123456789'):
+        ctx = ff1.Context(bytes(key), bytes(twk), 0, len(twk), radix, alpha)
+        self.assertTrue(ff1_numpy.Supported(ctx, len(pt), bytes(twk)))
+        res = ff1_numpy.Encrypt(ctx, [pt] * 3)
+        self.assertEqual(res.tolist(), [ct] * 3)
+        res = ff1_numpy.Decrypt(ctx, [ct] * 3)
+        self.assertEqual(res.tolist(), [pt] * 3)
+
+    def test_nist1(self):
+        self.cipherTest(
+            [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6,
+             0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c],
+            [],
+            '0123456789', '2433477484', 10)
+
+    def test_nist2_custom(self):
+        self.cipherTest(
+            [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6,
+             0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c],
+            [0x39, 0x38, 0x37, 0x36, 0x35, 0x34, 0x33, 0x32, 0x31, 0x30],
+            '2345678901', '8346422995', 10, '2345678901')
+
+    def test_nist8(self):
+        self.cipherTest(
+            [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6,
+             0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c,
+             0xef, 0x43, 0x59, 0xd8, 0xd5, 0x80, 0xaa, 0x4f,
+             0x7f, 0x03, 0x6d, 0x6f, 0x04, 0xfc, 0x6a, 0x94],
+            [0x39, 0x38, 0x37, 0x36, 0x35, 0x34, 0x33, 0x32, 0x31, 0x30],
+            '0123456789', '1001623463', 10)
+
+    def test_matches_scalar(self):
+        ctx = ff1.Context(bytes(range(16)), bytes([]), 0, 8, 10)
+        pts = ['%016d' % (i * 7919) for i in range(500)]
+        cts = ctx.EncryptMany(pts)
+        self.assertEqual(cts, [ctx.Encrypt(pt) for pt in pts])
+        self.assertEqual(ff1_numpy.Decrypt(ctx, cts).tolist(), pts)
+
+    def test_unsupported(self):
+        ctx = ff1.Context(bytes(range(16)), bytes([]), 0, 8, 10)
+        self.assertFalse(ff1_numpy.Supported(ctx, 20, bytes([])))
+        with self.assertRaises(RuntimeError):
+            ff1_numpy.Encrypt(ctx, ['0' * 20])
+
+    def test_invalid_character(self):
+        ctx = ff1.Context(bytes(range(16)), bytes([]), 0, 8, 10)
+        with self.assertRaises(ValueError):
+            ff1_numpy.Encrypt(ctx, ['012345678a'])
+        with self.assertRaises(ValueError):
+            ff1_numpy.Encrypt(ctx, ['0123456789', '012345678'])
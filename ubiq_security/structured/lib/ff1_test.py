@@ -106,3 +106,61 @@ class TestFF1(unittest.TestCase):
              0x7f, 0x03, 0x6d, 0x6f, 0x04, 0xfc, 0x6a, 0x94],
             [0x37, 0x37, 0x37, 0x37, 0x70, 0x71, 0x72, 0x73, 0x37, 0x37, 0x37],
             '0123456789abcdefghi', 'xs8a0azh2avyalyzuwd', 36)
+
+    def test_long_input(self):
+        # B spans more than one block and R needs more than one block
+        self.cipherTest(
+            [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6,
+             0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c],
+            [0x37, 0x37, 0x37, 0x37, 0x70, 0x71, 0x72, 0x73, 0x37, 0x37, 0x37],
+            '0123456789' * 10,
+            '1478149090011274626941928800255534966293778923439686572765383249232383730379611723366097450206803654',
+            10)
+
+    def test_large_radix(self):
+        alpha = ('ÑÒÓķĸĹϺϻϼϽϾÔÕϿは世界abcdefghijklmnopqrstuvwxyzこんにちÊʑʒʓËÌÍÎÏðñòóôĵĶʔʕ'
+                 '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+        self.cipherTest(
+            [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6,
+             0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c],
+            [0x37, 0x37, 0x37, 0x37, 0x70, 0x71, 0x72, 0x73, 0x37, 0x37, 0x37],
+            (alpha * 3)[5:190],
+            'hÊUWpGVÒにx3ķQϺ界31lÌrちb3MaʒiqϿÕϺóÕKBh2óTzϾÑϺん3ĵyrlʕhkʔkĶϻwMh6はBorĵaQ0zちBϼDð0ちòYfqxĶwsÎqĵrIcĸCʕôÒU5Ͽz3bϻʕJķʔcÊX8ðÏwyこPGSĶBϽgϺĶ界òfoñPこJ1ðÒYÌrNSmôEpc9ĸHsCg45jhoËʔϼÏônn9iはこÎnxBYSĵqAZZAcÒ0ÏÍ6',
+            len(alpha), alpha)
+
+    def test_tweak_override(self):
+        ctx = ff1.Context(bytes(range(16)), bytes([]), 0, 16, 10)
+        pt = '0123456789'
+        ct = [ctx.Encrypt(pt, bytes([i] * 8)) for i in range(3)]
+        self.assertEqual(len(set(ct)), 3)
+        for i in range(3):
+            self.assertEqual(ctx.Encrypt(pt, bytes([i] * 8)), ct[i])
+            self.assertEqual(ctx.Decrypt(ct[i], bytes([i] * 8)), pt)
+
+    def test_many(self):
+        ctx = ff1.Context(
+            bytes([0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6,
+                   0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]),
+            bytes([0x37, 0x37, 0x37, 0x37, 0x70, 0x71, 0x72, 0x73, 0x37, 0x37, 0x37]),
+            0, 11, 36)
+
+        pts = ['0123456789abcdefghi',
+               '0123456789abcdefghijklmnopqrstuvwxyz012345',
+               '0123456789',
+               '0123456789' * 10,
+               '0123456789abcdefghi']
+        cts = ctx.EncryptMany(pts)
+        self.assertEqual(cts[0], 'a9tv40mll9kdu509eum')
+        self.assertEqual(cts[1], 'l4zpm8zauhw2zkke9o0i7oi17iojfqog7dmjze3her')
+        self.assertEqual(cts[4], 'a9tv40mll9kdu509eum')
+        self.assertEqual(cts, [ctx.Encrypt(pt) for pt in pts])
+        self.assertEqual(ctx.DecryptMany(cts), pts)
+
+        twk = bytes([1, 2, 3])
+        cts = ctx.EncryptMany(pts, twk)
+        self.assertEqual(cts, [ctx.Encrypt(pt, twk) for pt in pts])
+        self.assertEqual(ctx.DecryptMany(cts, twk), pts)
+
+        # any iterable will do
+        self.assertEqual(ctx.DecryptMany(iter(cts), twk), pts)
+        self.assertEqual(ctx.EncryptMany([]), [])
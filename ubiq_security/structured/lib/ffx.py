@@ -1,27 +1,10 @@
 #!/usr/bin/env python3
 
 import math
-import sys
+import threading
 import typing
 
-VALID_M2CRYPTO_VERSIONS = ['0.42.0', '0.41.0']    
-from importlib.metadata import version, PackageNotFoundError
-class InvalidLibraryVersionException(Exception):
-    pass
-     
-# Check if M2Crypto on system. (Faster, but possible compatibility issues.)
-try:
-    m2_ver = version('M2Crypto')
-    if m2_ver in VALID_M2CRYPTO_VERSIONS:
-        from M2Crypto import EVP
-        M2CRYPTO = True
-    else:
-        print(f'Version {m2_ver} is not supported by ubiq_security for Python. Defaulting to Cryptography.')
-        raise InvalidLibraryVersionException()
-except (ImportError, PackageNotFoundError, InvalidLibraryVersionException) as e :
-    import cryptography.hazmat.primitives.ciphers as crypto
-    M2CRYPTO = False
-
+from . import aes
 
 DEFAULT_ALPHABET: typing.Final[str] = '0123456789abcdefghijklmnopqrstuvwxyz'
 
@@ -29,7 +12,7 @@ class Context:
     def __init__(self,
                  key, twk,
                  maxtxtlen, mintwklen, maxtwklen,
-                 radix, alpha):
+                 radix, alpha, backend = None):
         self.BLKSZ = (int)(16)
         self.key = key
 
@@ -47,6 +30,7 @@ class Context:
             raise RuntimeError('Unsupported radix or incompatible alphabet')
 
         self.alpha = alpha
+        self.converter = RadixConverter(radix, alpha)
 
         #
         # for both ff1 and ff3-1: radix**minlen >= 1000000
@@ -74,6 +58,22 @@ class Context:
 
         self.twk = twk
 
+        # the AES implementation, by name or the fastest available
+        if not isinstance(backend, aes.Backend):
+            backend = aes.Get(backend)
+        self.backend = backend
+
+        self._local = threading.local()
+
+    @property
+    def aes(self):
+        # each thread gets its own engine for this key
+        try:
+            return self._local.aes
+        except AttributeError:
+            self._local.aes = self.backend.new(self.key)
+            return self._local.aes
+
     def PRF(self, buf):
         BLKSZ = self.BLKSZ
 
@@ -82,32 +82,146 @@ class Context:
                 'Plaintext length must be a multiple of ' +
                 str(BLKSZ))
 
-        if M2CRYPTO:
-            cipher = EVP.Cipher(alg=self.alg, key=self.key, iv=bytearray(16), op=1)
-            dst = cipher.update(buf)
-        else:
-            cipher = crypto.Cipher(crypto.algorithms.AES(self.key), crypto.modes.CBC(bytearray(16))).encryptor()
-            dst = cipher.update(buf) + cipher.finalize()
-        
-        return dst[-BLKSZ:]
+        return self.aes.mac(buf)
 
     def Ciph(self, buf):
-        return self.PRF(buf[0:self.BLKSZ])
+        return self.aes.ecb(buf[0:self.BLKSZ])
+
+# conversions of more digits than this are split in half recursively
+SPLIT_DIGITS = 64
+
+class Radix:
+    """
+    Converts between integers and strings of digits from an alphabet
+
+    Digit values are looked up in a precomputed table. When the radix
+    is small enough for the built-in conversions, strings are translated
+    to and from the default alphabet and handed to int() and str() or
+    format(). Long strings and large numbers are split in half around a
+    cached power of the radix so that the work is not quadratic in the
+    number of digits.
+    """
+    def __init__(self, radix, alpha):
+        self.radix = radix
+        self.alpha = alpha[:radix]
+
+        # a repeated character takes the value of its first occurrence
+        self.digits = {}
+        for i, c in enumerate(self.alpha):
+            self.digits.setdefault(c, i)
+        self.chars = frozenset(self.alpha)
+        self.powers = {}
+
+        self.builtin = (radix <= len(DEFAULT_ALPHABET) and
+                        len(self.digits) == radix)
+        self.to_default = None
+        self.from_default = None
+        if self.builtin and self.alpha != DEFAULT_ALPHABET[:radix]:
+            self.to_default = str.maketrans(
+                self.alpha, DEFAULT_ALPHABET[:radix])
+            self.from_default = str.maketrans(
+                DEFAULT_ALPHABET[:radix], self.alpha)
+
+        self.format = None
+        if radix == 2:
+            self.format = 'b'
+        elif radix == 8:
+            self.format = 'o'
+        elif radix == 16:
+            self.format = 'x'
+
+    def power(self, e):
+        p = self.powers.get(e)
+        if p is None:
+            p = self.radix ** e
+            self.powers[e] = p
+        return p
+
+    def StringToNumber(self, s):
+        if not self.chars.issuperset(s):
+            raise ValueError('Invalid character(s) for alphabet')
+
+        if self.builtin:
+            t = s.translate(self.to_default) if self.to_default else s
+            try:
+                return int(t, self.radix) if t else 0
+            except ValueError:
+                # longer than the interpreter allows (see
+                # sys.set_int_max_str_digits), which may change at any time
+                pass
+
+        return self._toNumber(s)
+
+    def _toNumber(self, s):
+        if len(s) > SPLIT_DIGITS:
+            h = len(s) // 2
+            return (self._toNumber(s[:-h]) * self.power(h) +
+                    self._toNumber(s[-h:]))
+
+        radix = self.radix
+        digits = self.digits
+        n = 0
+        for c in s:
+            n = n * radix + digits[c]
+        return n
+
+    def NumberToString(self, n, l = 1):
+        # the output is at least l digits long, padded with
+        # the first character of the alphabet
+        if n >= self.power(l):
+            l = max(l, 1)
+            while n >= self.power(l):
+                l *= 2
+            while l > 1 and n < self.power(l - 1):
+                l -= 1
+
+        if self.builtin:
+            s = None
+            if self.radix == 10:
+                try:
+                    s = str(n)
+                except ValueError:
+                    # too many digits for the interpreter; see above
+                    pass
+            elif self.format:
+                s = format(n, self.format)
+
+            if s is not None and (n or l):
+                if self.from_default:
+                    s = s.translate(self.from_default)
+                return s.rjust(l, self.alpha[0])
+
+        return self._toString(n, l)
+
+    def _toString(self, n, l):
+        # exactly l digits; n must be less than radix**l
+        if l > SPLIT_DIGITS:
+            h = l // 2
+            hi, lo = divmod(n, self.power(h))
+            return self._toString(hi, l - h) + self._toString(lo, h)
+
+        radix = self.radix
+        alpha = self.alpha
+        s = [alpha[0]] * l
+        while n:
+            l -= 1
+            n, r = divmod(n, radix)
+            s[l] = alpha[r]
+        return ''.join(s)
+
+def RadixConverter(radix, alpha):
+    """Return the (shared) converter for the radix and alphabet"""
+    conv = RadixConverter.cache.get((radix, alpha))
+    if conv is None:
+        if len(RadixConverter.cache) >= 256:
+            RadixConverter.cache.clear()
+        conv = Radix(radix, alpha)
+        RadixConverter.cache[(radix, alpha)] = conv
+    return conv
+RadixConverter.cache = {}
 
 def StringToNumber(radix, alpha, s):
-    p = 1
-    n = 0
-    for i in range(len(s)):
-        x = alpha.index(s[len(s) - i - 1])
-        n += x * p
-        p *= radix
-    return n
+    return RadixConverter(radix, alpha).StringToNumber(s)
 
 def NumberToString(radix, alpha, n, l = 1):
-    s = ''
-    while n:
-        s = alpha[int(n % radix)] + s
-        n //= radix
-    while len(s) < l:
-        s = alpha[0] + s
-    return s
+    return RadixConverter(radix, alpha).NumberToString(n, l)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import sys
 import unittest
 
 import importlib
@@ -12,3 +13,84 @@ class TestFFX(unittest.TestCase):
                         2**32,
                         0, 7,
                         10, ffx.DEFAULT_ALPHABET))
+
+    def test_prf_reuse(self):
+        ctx = ffx.Context(bytes(range(16)), bytes([]),
+                          2**32,
+                          0, 0,
+                          10, ffx.DEFAULT_ALPHABET)
+
+        # the engine is reused between calls; every MAC must
+        # still start from a zero IV
+        buf = bytes(range(48))
+        res = ctx.PRF(buf)
+        for i in range(3):
+            self.assertEqual(ctx.PRF(buf), res)
+        self.assertEqual(ctx.PRF(buf[32:]), ctx.Ciph(buf[32:]))
+        self.assertEqual(ctx.PRF(buf), res)
+
+    def test_engine_per_thread(self):
+        import threading
+
+        ctx = ffx.Context(bytes(range(16)), bytes([]),
+                          2**32,
+                          0, 0,
+                          10, ffx.DEFAULT_ALPHABET)
+        engines = [ctx.aes]
+
+        t = threading.Thread(target=lambda: engines.append(ctx.aes))
+        t.start()
+        t.join()
+
+        self.assertIs(ctx.aes, engines[0])
+        self.assertIsNot(engines[0], engines[1])
+
+    def convertTest(self, radix, alpha, s, n):
+        self.assertEqual(ffx.StringToNumber(radix, alpha, s), n)
+        self.assertEqual(ffx.NumberToString(radix, alpha, n, len(s)), s)
+
+    def test_radix_default(self):
+        self.convertTest(10, ffx.DEFAULT_ALPHABET, '0012345', 12345)
+        self.convertTest(16, ffx.DEFAULT_ALPHABET, '00ff', 255)
+        self.convertTest(36, ffx.DEFAULT_ALPHABET, 'zz', 36 * 36 - 1)
+
+    def test_radix_custom(self):
+        self.convertTest(10, '2345678901', '2234567', 12345)
+        self.convertTest(3, 'abc', 'aacb', 7)
+        self.convertTest(40, ffx.DEFAULT_ALPHABET + 'ABCD', 'A0D', 40 * 40 * 36 + 39)
+
+    def test_radix_long(self):
+        alpha = ffx.DEFAULT_ALPHABET + 'ABCDEFGHIJ'
+        s = ''.join(alpha[(i * 7) % len(alpha)] for i in range(1000))
+        n = 0
+        for c in s:
+            n = n * len(alpha) + alpha.index(c)
+        self.convertTest(len(alpha), alpha, s, n)
+        self.convertTest(len(alpha), alpha, alpha[0] * 5 + s, n)
+
+    @unittest.skipUnless(hasattr(sys, 'set_int_max_str_digits'),
+                         'no limit on int/str conversions')
+    def test_radix_digit_limit(self):
+        # the limit is read when converting, not when ffx is imported
+        s = ''.join(str((i * 7) % 10) for i in range(2000))
+        n = 0
+        for c in s:
+            n = n * 10 + int(c)
+
+        limit = sys.get_int_max_str_digits()
+        self.addCleanup(sys.set_int_max_str_digits, limit)
+        sys.set_int_max_str_digits(640)
+        self.convertTest(10, '0123456789', s, n)
+        self.convertTest(10, 'abcdefghij', s.translate(
+            str.maketrans('0123456789', 'abcdefghij')), n)
+
+    def test_radix_short_length(self):
+        # the length is a minimum, not a limit
+        self.assertEqual(ffx.NumberToString(10, '0123456789', 12345, 2), '12345')
+        self.assertEqual(ffx.NumberToString(3, 'abc', 7, 1), 'cb')
+
+    def test_radix_invalid(self):
+        with self.assertRaises(ValueError):
+            ffx.StringToNumber(10, ffx.DEFAULT_ALPHABET, '12a')
+        with self.assertRaises(ValueError):
+            ffx.StringToNumber(10, ffx.DEFAULT_ALPHABET, ' 12')
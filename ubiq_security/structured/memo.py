@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Memo cache of structured encryption results.
+#
+# Structured encryption is deterministic: a value encrypted with the
+# same dataset, key and tweak always produces the same cipher text. For
+# columns with few distinct values, remembering the results avoids most
+# of the FF1 work. Each result is remembered in both directions, so that
+# decrypting a value that was encrypted (or the reverse) is also a hit.
+#
+# Entries belong to the key number that produced them and are dropped
+# when that key expires or is flushed. Only values and results are
+# stored; no key material is kept here.
+
+import collections
+import sys
+import threading
+import time
+
+# estimate of the memory used by an entry, other than its strings
+OVERHEAD = 200
+
+class Memo:
+    """
+    Two-way LRU cache of formatted plain and cipher texts, bounded by
+    an estimate of the memory that it uses
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # (papi, dataset, n, twk, ENC, value) -> (result, scope)
+        # n is None for decryption; the key number is part of the value
+        self._entries = collections.OrderedDict()
+        # (papi, dataset, n) -> [expiration time, set of entry keys]
+        self._scopes = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(k, v):
+        return OVERHEAD + sys.getsizeof(k[5]) + sys.getsizeof(v[0])
+
+    def _remove(self, k):
+        v = self._entries.pop(k)
+        self._bytes -= self._size(k, v)
+        scope = self._scopes.get(v[1])
+        if scope:
+            scope[1].discard(k)
+
+    def _drop(self, scope):
+        entry = self._scopes.pop(scope, None)
+        if entry:
+            for k in entry[1]:
+                v = self._entries.pop(k)
+                self._bytes -= self._size(k, v)
+
+    def get(self, papi, dataset_name, n, twk, ENC, value):
+        """
+        Return the result of encrypting (or decrypting) value and the
+        number of the key that produced it, or None if it is not known.
+        n is the key number when encrypting and is ignored when
+        decrypting.
+        """
+        k = (papi, dataset_name, n if ENC else None, twk, ENC, value)
+        with self._lock:
+            v = self._entries.get(k)
+            if v != None and self._scopes[v[1]][0] < time.time():
+                self._drop(v[1])
+                v = None
+            if v == None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(k)
+            self.hits += 1
+            return v[0], v[1][2]
+
+    def put(self, papi, dataset_name, n, twk, pt, ct, ttl):
+        """Remember that pt encrypts to ct with key number n"""
+        scope = (papi, dataset_name, n)
+        with self._lock:
+            if scope in self._scopes and self._scopes[scope][0] < time.time():
+                self._drop(scope)
+            if not scope in self._scopes:
+                self._scopes[scope] = [time.time() + ttl, set()]
+
+            for k, v in (((papi, dataset_name, n, twk, True, pt), (ct, scope)),
+                         ((papi, dataset_name, None, twk, False, ct), (pt, scope))):
+                if k in self._entries:
+                    self._remove(k)
+                size = self._size(k, v)
+                if size > self.max_bytes:
+                    continue
+                self._entries[k] = v
+                self._scopes[scope][1].add(k)
+                self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def flush(self, papi = None, dataset_name = None, n = None):
+        with self._lock:
+            for scope in list(self._scopes):
+                if ((papi == None or scope[0] == papi) and
+                    (dataset_name == None or scope[1] == dataset_name) and
+                    (n == None or scope[2] == n)):
+                    self._drop(scope)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+def fetchMemo(creds):
+    """
+    Return the process-wide memo cache, or None if it is not enabled by
+    the configuration. Entries live as long as the keys that they were
+    made with, so the cache is not used unless structured keys are
+    cached.
+    """
+    config = creds.configuration
+    if not config.memo_enabled or not config.key_caching_structured:
+        return None
+
+    if fetchMemo.memo == None:
+        with fetchMemo.lock:
+            if fetchMemo.memo == None:
+                fetchMemo.memo = Memo(config.memo_max_bytes)
+    fetchMemo.memo.max_bytes = config.memo_max_bytes
+    return fetchMemo.memo
+fetchMemo.memo = None
+fetchMemo.lock = threading.Lock()
+
+def flushMemo(papi = None, dataset_name = None, n = None):
+    if fetchMemo.memo != None:
+        fetchMemo.memo.flush(papi, dataset_name, n)
+
+def Stats():
+    """Return hit and size statistics for the memo cache"""
+    if fetchMemo.memo == None:
+        return Memo(0).stats()
+    return fetchMemo.memo.stats()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+
+import importlib
+memo = importlib.import_module('ubiq_security.structured.memo')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+decrypt = importlib.import_module('ubiq_security.structured.decrypt')
+common = importlib.import_module('ubiq_security.structured.common')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestMemo(unittest.TestCase):
+    def test_two_way(self):
+        m = memo.Memo(1 << 20)
+        self.assertIsNone(m.get('papi', 'SSN', 0, None, True, '123'))
+
+        m.put('papi', 'SSN', 0, None, '123', 'abc', 60)
+        self.assertEqual(m.get('papi', 'SSN', 0, None, True, '123'), ('abc', 0))
+        self.assertEqual(m.get('papi', 'SSN', 7, None, False, 'abc'), ('123', 0))
+
+        # other keys, tweaks and datasets are separate
+        self.assertIsNone(m.get('papi', 'SSN', 1, None, True, '123'))
+        self.assertIsNone(m.get('papi', 'SSN', 0, b'x', True, '123'))
+        self.assertIsNone(m.get('papi', 'DOB', 0, None, True, '123'))
+
+        stats = m.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 4))
+        self.assertEqual(stats['hit_rate'], 2 / 6)
+        self.assertEqual(stats['entries'], 2)
+
+    def test_budget(self):
+        m = memo.Memo(10 * (memo.OVERHEAD + 200))
+        for i in range(100):
+            m.put('papi', 'SSN', 0, None, '%06d' % i, 'c%05d' % i, 60)
+            # keep the first value in use
+            m.get('papi', 'SSN', 0, None, True, '000000')
+
+        stats = m.stats()
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+        self.assertGreater(stats['entries'], 0)
+        self.assertIsNotNone(m.get('papi', 'SSN', 0, None, True, '000000'))
+        self.assertIsNotNone(m.get('papi', 'SSN', 0, None, True, '000099'))
+        self.assertIsNone(m.get('papi', 'SSN', 0, None, True, '000050'))
+
+    def test_expiry_and_flush(self):
+        m = memo.Memo(1 << 20)
+        m.put('papi', 'SSN', 0, None, '123', 'abc', 0.05)
+        m.put('papi', 'SSN', 1, None, '123', 'def', 60)
+        m.put('papi', 'DOB', 1, None, '456', 'ghi', 60)
+        time.sleep(0.1)
+        self.assertIsNone(m.get('papi', 'SSN', 0, None, True, '123'))
+        self.assertIsNone(m.get('papi', 'SSN', None, None, False, 'abc'))
+        self.assertIsNotNone(m.get('papi', 'SSN', 1, None, True, '123'))
+
+        m.flush('papi', 'SSN', 1)
+        self.assertIsNone(m.get('papi', 'SSN', 1, None, True, '123'))
+        self.assertIsNotNone(m.get('papi', 'DOB', 1, None, True, '456'))
+        m.flush()
+        self.assertEqual(m.stats()['entries'], 0)
+        self.assertEqual(m.stats()['bytes'], 0)
+
+class TestMemoized(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [encrypt, decrypt])
+        memo.flushMemo()
+
+    def test_memo(self):
+        creds = testutil.Creds()
+        pts = ['%03d-45-%04d' % (i % 7, i % 7) for i in range(100)]
+        cts = encrypt.EncryptMany(creds, 'SSN', pts)
+
+        creds = testutil.Creds({'memo': {'enabled': True}})
+        before = memo.Stats()
+        self.assertEqual(encrypt.EncryptMany(creds, 'SSN', pts), cts)
+        self.assertEqual(decrypt.DecryptMany(creds, 'SSN', cts), pts)
+        self.assertEqual(encrypt.Encrypt(creds, 'SSN', pts[0]), cts[0])
+        self.assertEqual(decrypt.Decrypt(creds, 'SSN', cts[1]), pts[1])
+        self.assertEqual(creds.count(), 202)
+
+        after = memo.Stats()
+        # only the first 7 values were encrypted
+        self.assertEqual(after['misses'] - before['misses'], 100)
+        self.assertEqual(after['hits'] - before['hits'], 102)
+        self.assertEqual(after['entries'], 14)
+
+        common.flushKey('papi', 'SSN')
+        self.assertEqual(memo.Stats()['entries'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
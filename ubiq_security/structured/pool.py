@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+# Process pool for bulk structured encryption and decryption.
+#
+# FF1 is pure Python and holds the GIL, so threads do not help with
+# large batches. A ProcessPool starts worker processes once, with the
+# dataset definition and its unwrapped data keys, and then spreads each
+# batch across them.
+#
+# Values are not pickled. Each batch is split into windows; the values
+# of a window are written to a shared memory block as an array of
+# 32-bit lengths, counted in characters, followed by the UTF-8 encoding
+# of all of the values, one chunk after another. Workers write their
+# results to a second block in the same form. Only the names and
+# offsets of the blocks travel through the pool's queues.
+
+import array
+import base64
+import collections
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .common import fetchDataset, fetchKey, fetchAllKeys, aesBackend
+from .encrypt import encryptMany
+from .decrypt import decryptMany
+from .reencrypt import reencryptMany
+from .lib import ff1
+
+# operations performed by the workers
+ENCRYPT = 'encrypt'
+DECRYPT = 'decrypt'
+REENCRYPT = 'reencrypt'
+
+# number of values in a unit of work
+CHUNK = 4096
+# number of values written to shared memory at a time
+WINDOW = 1 << 18
+
+def _pack(values):
+    # -> (character counts, encoded values)
+    lens = array.array('I', map(len, values))
+    return lens, ''.join(values).encode('utf-8', 'surrogatepass')
+
+def _unpack(lens, data):
+    s = data.decode('utf-8', 'surrogatepass')
+    values = []
+    pos = 0
+    for l in lens:
+        values.append(s[pos:pos + l])
+        pos += l
+    return values
+
+def _attach(name):
+    # workers keep the blocks of the window they are working on mapped
+    # and let go of the blocks of previous windows
+    shm = _attach.cache.get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        if len(_attach.cache) >= 4:
+            for old in _attach.cache.values():
+                old.close()
+            _attach.cache.clear()
+        _attach.cache[name] = shm
+    return shm
+_attach.cache = {}
+
+def _init(dataset, keys, current, backend):
+    # runs once in each worker process
+    _init.dataset = dataset
+    _init.keys = keys
+    _init.current = current
+    _init.backend = backend
+    _init.ctxs = {}
+
+def _context(n):
+    ctx = _init.ctxs.get(n)
+    if ctx is None:
+        key = _init.keys.get(n)
+        if key is None:
+            raise RuntimeError('Unknown key number: %s' % (n))
+        dataset = _init.dataset
+        ctx = ff1.Context(
+            key['unwrapped_data_key'],
+            dataset['tweak'],
+            dataset['tweak_min_len'], dataset['tweak_max_len'],
+            len(dataset['input_character_set']),
+            dataset['input_character_set'],
+            backend=_init.backend)
+        _init.ctxs[n] = ctx
+    return ctx
+
+def _work(task):
+    src, off, count, size, dst, dstoff, cap, twk, op = task
+
+    buf = _attach(src).buf
+    lens = array.array('I')
+    lens.frombytes(buf[off:off + 4 * count])
+    values = _unpack(lens, bytes(buf[off + 4 * count:off + size]))
+
+    # counts of values by the key number they were encrypted with,
+    # before the operation
+    if op == ENCRYPT:
+        ctx = _context(_init.current)
+        values = encryptMany(_init.dataset, _init.keys[_init.current],
+                             lambda l: ctx, values, twk)
+        counts = {_init.current: len(values)}
+    elif op == DECRYPT:
+        values, nums = decryptMany(_init.dataset,
+                                   lambda n, l: _context(n), values, twk)
+        counts = dict(collections.Counter(nums))
+    else:
+        values, nums = reencryptMany(_init.dataset, _init.current,
+                                     lambda n, l: _context(n), values, twk)
+        counts = dict(collections.Counter(nums))
+
+    lens, data = _pack(values)
+    if 4 * count + len(data) > cap:
+        raise RuntimeError('Output does not fit in shared memory')
+    buf = _attach(dst).buf
+    buf[dstoff:dstoff + 4 * count] = lens.tobytes()
+    buf[dstoff + 4 * count:dstoff + 4 * count + len(data)] = data
+    return len(data), counts
+
+class ProcessPool:
+    """
+    Encrypt and decrypt batches of values for one structured dataset
+    using a pool of worker processes
+
+    The dataset and all of its keys are fetched when the pool is
+    created and passed to each worker once. Results are the same as
+    those of Encrypt and Decrypt, in the same order as the input.
+    """
+    def __init__(self, creds, dataset_name, processes = None,
+                 chunk_size = CHUNK):
+        if not creds.set():
+            raise RuntimeError("credentials not set")
+
+        self._creds = creds
+        self._dataset = fetchDataset(creds, dataset_name)
+        if self._dataset['encryption_algorithm'] != 'FF1':
+            raise RuntimeError('unsupported algorithm: ' +
+                               self._dataset['encryption_algorithm'])
+
+        current = fetchKey(creds, dataset_name)
+        keys = {}
+        for n, key in fetchAllKeys(creds, dataset_name).items():
+            keys[int(n)] = {'key_number': int(n),
+                            'unwrapped_data_key': key['unwrapped_data_key']}
+        self._current = int(current['key_number'])
+        keys[self._current] = {
+            'key_number': self._current,
+            'unwrapped_data_key': current['unwrapped_data_key']}
+
+        # the tweak is decoded once, here, rather than in each worker
+        dataset = dict(self._dataset)
+        dataset['tweak'] = base64.b64decode(dataset['tweak'])
+
+        if processes == None:
+            processes = os.cpu_count() or 1
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+        self._pool = ProcessPoolExecutor(
+            processes, initializer=_init,
+            initargs=(dataset, keys, self._current,
+                      aesBackend(creds).name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown()
+
+    def _submit(self, values, twk, op):
+        chunks = []
+        size = 0
+        cap = 0
+        for i in range(0, len(values), self.chunk_size):
+            lens, data = _pack(values[i:i + self.chunk_size])
+            chunks.append((lens, data, size, cap))
+            size += 4 * len(lens) + len(data)
+            # results have as many characters as their inputs and a
+            # character takes at most 4 bytes in UTF-8
+            cap += 4 * len(lens) + 4 * sum(lens)
+
+        src = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            dst = shared_memory.SharedMemory(create=True, size=max(cap, 1))
+        except:
+            src.close()
+            src.unlink()
+            raise
+
+        futures = []
+        try:
+            for i, (lens, data, off, dstoff) in enumerate(chunks):
+                src.buf[off:off + 4 * len(lens)] = lens.tobytes()
+                src.buf[off + 4 * len(lens):
+                        off + 4 * len(lens) + len(data)] = data
+                if i + 1 < len(chunks):
+                    end = chunks[i + 1][3]
+                else:
+                    end = cap
+                futures.append(self._pool.submit(
+                    _work, (src.name, off, len(lens),
+                            4 * len(lens) + len(data),
+                            dst.name, dstoff, end - dstoff, twk, op)))
+        except:
+            self._discard((src, dst, None, futures))
+            raise
+        return src, dst, [(len(c[0]), c[3]) for c in chunks], futures
+
+    @staticmethod
+    def _release(*blocks):
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    def _discard(self, job):
+        src, dst, chunks, futures = job
+        for f in futures:
+            f.cancel()
+        # tasks that already started must finish before their
+        # blocks can be released
+        for f in futures:
+            if not f.cancelled():
+                f.exception()
+        self._release(src, dst)
+
+    def _collect(self, job, counts):
+        src, dst, chunks, futures = job
+        results = []
+        try:
+            for (count, off), future in zip(chunks, futures):
+                size, n = future.result()
+                lens = array.array('I')
+                lens.frombytes(dst.buf[off:off + 4 * count])
+                results.extend(_unpack(
+                    lens, bytes(dst.buf[off + 4 * count:
+                                        off + 4 * count + size])))
+                for k, v in n.items():
+                    counts[k] = counts.get(k, 0) + v
+        except:
+            self._discard(job)
+            raise
+        self._release(src, dst)
+        return results
+
+    def cipher(self, values, twk, op):
+        """
+        Perform op on all of the values. Returns the results and the
+        number of values that were encrypted with each key number
+        before the operation
+        """
+        values = list(values)
+        if twk != None:
+            twk = bytes(twk)
+
+        # the next window is packed while the workers process the
+        # current one
+        results = []
+        counts = {}
+        pending = collections.deque()
+        try:
+            for i in range(0, len(values), WINDOW):
+                pending.append(self._submit(values[i:i + WINDOW], twk, op))
+                if len(pending) > 1:
+                    results.extend(self._collect(pending.popleft(), counts))
+            while pending:
+                results.extend(self._collect(pending.popleft(), counts))
+        finally:
+            while pending:
+                self._discard(pending.popleft())
+
+        events = {}
+        if op == ENCRYPT:
+            events = {(ENCRYPT, n): c for n, c in counts.items()}
+        else:
+            moved = 0
+            for n, count in counts.items():
+                if op == DECRYPT or n != self._current:
+                    events[(DECRYPT, n)] = count
+                    moved += count
+            if op == REENCRYPT and moved:
+                events[(ENCRYPT, self._current)] = moved
+
+        for (action, n), count in events.items():
+            self._creds.add_event(
+                dataset_name=self._dataset['name'], dataset_group_name="",
+                billing_action=action,
+                dataset_type="structured", key_number=n, count=count)
+        return results, counts
+
+    def Encrypt(self, pts, twk = None):
+        return self.cipher(pts, twk, ENCRYPT)[0]
+
+    def Decrypt(self, cts, twk = None):
+        return self.cipher(cts, twk, DECRYPT)[0]
+
+    def ReEncrypt(self, cts, twk = None):
+        """
+        Re-encrypt values with the current key of the dataset. Returns
+        the new values and the counts of the key numbers that they were
+        found with, as ReEncryption.CipherMany does
+        """
+        return self.cipher(cts, twk, REENCRYPT)
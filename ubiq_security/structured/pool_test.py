@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+import unittest.mock
+
+import importlib
+pool = importlib.import_module('ubiq_security.structured.pool')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+ff1 = importlib.import_module('ubiq_security.structured.lib.ff1')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+# output characters to spare for the key number, and a prefix rule
+DATASET = dict(testutil.DATASET, name = 'TEST',
+               output_character_set = '9876543210ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+               min_input_length = 6, max_input_length = 12,
+               msb_encoding_bits = 4,
+               passthrough_rules = [
+                   {'type': 'prefix', 'value': 1, 'priority': 2}])
+
+KEYS = {n: {'key_number': n, 'unwrapped_data_key': bytes([n] * 32)}
+        for n in range(2)}
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        testutil.Fetches(self, [pool], DATASET, KEYS)
+        self.creds = testutil.Creds()
+
+    def test_matches_serial(self):
+        rnd = random.Random(0)
+        pts = ['%d%03d-%02d-%04d' % (rnd.randrange(10), rnd.randrange(1000),
+                                     rnd.randrange(100), rnd.randrange(10000))
+               for i in range(1000)]
+
+        ctxs = {n: ff1.Context(k['unwrapped_data_key'], bytes(range(8)),
+                               0, 16, 10)
+                for n, k in KEYS.items()}
+        old = encrypt.encryptMany(DATASET, KEYS[0], lambda l: ctxs[0],
+                                  pts[:300])
+
+        with pool.ProcessPool(self.creds, 'TEST', processes=2,
+                              chunk_size=64) as p:
+            cts = p.Encrypt(pts)
+            self.assertEqual(cts, encrypt.encryptMany(DATASET, KEYS[1],
+                                                      lambda l: ctxs[1], pts))
+            self.assertEqual(p.Decrypt(cts), pts)
+            # values encrypted with older keys are decrypted too
+            self.assertEqual(p.Decrypt(old + cts), pts[:300] + pts)
+
+            new, counts = p.ReEncrypt(old + cts)
+            self.assertEqual(new, cts[:300] + cts)
+            self.assertEqual(counts, {0: 300, 1: 1000})
+
+            self.assertEqual(p.Encrypt([]), [])
+            with self.assertRaises(RuntimeError):
+                p.Encrypt(pts[:10] + ['12345'])
+
+        counts = [(e['billing_action'], e['key_number'], e['count'])
+                  for e in self.creds.events]
+        self.assertEqual(counts, [('encrypt', 1, 1000),
+                                  ('decrypt', 1, 1000),
+                                  ('decrypt', 0, 300),
+                                  ('decrypt', 1, 1000),
+                                  ('decrypt', 0, 300),
+                                  ('encrypt', 1, 300)])
+
+if __name__ == '__main__':
+    unittest.main()
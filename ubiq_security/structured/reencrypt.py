@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import collections
+
+from .common import datasetFormat, strConvertRadix, encKeyNumber, decKeyNumber
+from .common import fetchDataset, fetchContext
+from .codebook import fetchCodebook
+
+class ReEncryption:
+    """
+    Move structured cipher texts to the current key of their dataset
+
+    Values that are already encrypted with the current key are returned
+    unchanged. The others are decrypted with the key whose number is
+    encoded in them and encrypted again with the current key, in
+    batches grouped by key number.
+    """
+    def __init__(self, creds, dataset_name):
+        if not creds.set():
+            raise RuntimeError("credentials not set")
+
+        self._creds = creds
+        self._dataset = fetchDataset(self._creds, dataset_name)
+        self._key, _ = fetchContext(self._creds, self._dataset)
+        self._ctxs = {}
+
+    def context(self, n):
+        """Return the key with number n and its FF1 context"""
+        entry = self._ctxs.get(n)
+        if entry is None:
+            if n == int(self._key['key_number']):
+                entry = fetchContext(self._creds, self._dataset, key=self._key)
+            else:
+                entry = fetchContext(self._creds, self._dataset, n)
+            self._ctxs[n] = entry
+        return entry
+
+    def CipherMany(self, cts, twk = None):
+        """
+        Re-encrypt a list of values
+
+        Returns the new cipher texts, in the order of the input, and a
+        dictionary of the number of values that were found encrypted
+        with each key number. The count for the current key number is
+        the number of values that did not need to change.
+        """
+        def context(n, l):
+            key, ctx = self.context(n)
+            cb = fetchCodebook(self._creds, self._dataset, key, l, twk)
+            return cb if cb else ctx
+
+        current = int(self._key['key_number'])
+        results, nums = reencryptMany(self._dataset, current, context, cts, twk)
+
+        counts = dict(collections.Counter(nums))
+        moved = 0
+        for n, count in counts.items():
+            if n != current:
+                self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="decrypt",
+                    dataset_type="structured", key_number=n, count=count)
+                moved += count
+        if moved:
+            self._creds.add_event(dataset_name=self._dataset['name'], dataset_group_name="", billing_action="encrypt",
+                dataset_type="structured", key_number=current, count=moved)
+        return results, counts
+
+def reencryptMany(dataset, current, context, cts, twk = None):
+    """
+    Re-encrypt a list of values with key number current
+
+    context(n, l) must return the object (an FF1 context or a codebook)
+    for values of length l and key number n. Each value is formatted
+    once; the layout that is removed before decryption is put back
+    around the new cipher text. Returns the new cipher texts and the key
+    number that each value was encrypted with. Events are not recorded;
+    that is up to the caller.
+    """
+    ics = dataset['input_character_set']
+    ocs = dataset['output_character_set']
+    sft = dataset['msb_encoding_bits']
+    plan = datasetFormat(dataset)
+
+    input_min = dataset['min_input_length']
+    input_max = dataset['max_input_length']
+
+    results = list(cts)
+    nums = [None] * len(results)
+    fmts = {}
+    groups = {}
+    for i, ct in enumerate(results):
+        fmt, trm = plan.Input(ct, False)
+
+        input_len = len(trm)
+        if input_len < input_min or input_len > input_max:
+            raise RuntimeError('Invalid input len (%s) min: %s max %s'%(input_len, input_min, input_max))
+
+        trm, n = decKeyNumber(trm, ocs, sft)
+        nums[i] = n
+        if n == current:
+            continue
+
+        fmts[i] = fmt
+        groups.setdefault((n, input_len), ([], []))
+        groups[(n, input_len)][0].append(i)
+        groups[(n, input_len)][1].append(strConvertRadix(trm, ocs, ics))
+
+    for (n, input_len), (idx, grp) in groups.items():
+        pts = context(n, input_len).DecryptMany(grp, twk)
+        for i, ct in zip(idx, context(current, input_len).EncryptMany(pts, twk)):
+            ct = strConvertRadix(ct, ics, ocs)
+            ct = encKeyNumber(ct, ocs, current, sft)
+            results[i] = plan.Output(fmts[i], ct)
+    return results, nums
+
+def ReEncrypt(creds, dataset_name, cts, twk = None):
+    """
+    Re-encrypt every value of an iterable with the current key of the
+    dataset. Returns the new values and the counts of the key numbers
+    that they were found with.
+    """
+    results = ReEncryption(creds, dataset_name).CipherMany(list(cts), twk)
+    if creds.configuration.get_event_reporting_synchronous():
+        creds.process_events()
+    return results
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import base64
+import unittest
+
+import importlib
+reencrypt = importlib.import_module('ubiq_security.structured.reencrypt')
+encrypt = importlib.import_module('ubiq_security.structured.encrypt')
+ff1 = importlib.import_module('ubiq_security.structured.lib.ff1')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+DATASET = {
+    'name': 'TEST', 'encryption_algorithm': 'FF1',
+    'passthrough': '-',
+    'input_character_set': '0123456789',
+    'output_character_set': '9876543210ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    'min_input_length': 6, 'max_input_length': 12,
+    'tweak': base64.b64encode(bytes(range(8))).decode(),
+    'tweak_min_len': 0, 'tweak_max_len': 16,
+    'msb_encoding_bits': 4,
+    'passthrough_rules': [{'type': 'suffix', 'value': 2, 'priority': 2}],
+}
+
+KEYS = {n: {'key_number': n, 'unwrapped_data_key': bytes([n] * 32)}
+        for n in range(3)}
+
+class TestReEncrypt(unittest.TestCase):
+    def setUp(self):
+        self.server = testutil.Fetches(self, [reencrypt], DATASET, KEYS)
+
+    def test_reencrypt(self):
+        pts = ['%04d-%04d-%02d' % (i, i * 3, i % 100) for i in range(300)]
+        cts = {}
+        for n in range(3):
+            ctx = ff1.Context(KEYS[n]['unwrapped_data_key'], bytes(range(8)),
+                              0, 16, 10)
+            cts[n] = encrypt.encryptMany(DATASET, KEYS[n], lambda l: ctx, pts)
+
+        # a column with values from all three keys, interleaved
+        mixed = [cts[i % 3][i] for i in range(len(pts))]
+
+        creds = testutil.Creds()
+        new, counts = reencrypt.ReEncrypt(creds, 'TEST', mixed)
+        self.assertEqual(new, cts[2])
+        self.assertEqual(counts, {0: 100, 1: 100, 2: 100})
+        events = [(e['billing_action'], e['key_number'], e['count'])
+                  for e in creds.events]
+        self.assertEqual(sorted(events), [('decrypt', 0, 100),
+                                          ('decrypt', 1, 100),
+                                          ('encrypt', 2, 200)])
+        # each key was fetched once
+        self.assertEqual(sorted(self.server.numbers), [-1, 0, 1])
+
+        creds = testutil.Creds()
+        new, counts = reencrypt.ReEncrypt(creds, 'TEST', cts[2])
+        self.assertEqual(new, cts[2])
+        self.assertEqual(counts, {2: 300})
+        self.assertEqual(creds.events, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Persistent cache of structured datasets and keys.
+#
+# A program that runs for a short time, like the command line tool,
+# spends most of its time fetching the dataset and keys that it needs.
+# The in-memory caches can be saved to a file when a program ends and
+# loaded by the next one, so that entries that have not expired are
+# used without going back to the server.
+#
+# Only wrapped keys are written: the encrypted private key and the data
+# keys encrypted with it, as they are received from the server. The
+# secret crypto access key is still needed to use them, and it is not
+# saved.
+
+import json
+import os
+import time
+
+from .common import fetchDataset, fetchKey, fetchAllKeys
+
+# version of the file format
+VERSION = 1
+
+def SaveCache(creds, path):
+    """
+    Write the datasets and wrapped keys cached for the credentials'
+    access key to path. The file is only readable by its owner.
+    """
+    papi = creds.access_key_id
+    now = time.time()
+
+    datasets = {name: entry
+                for name, entry in fetchDataset.cache.get(papi, {}).items()
+                if entry['expires'] > now}
+
+    keys = {}
+    for name, entries in fetchKey.cache.get(papi, {}).items():
+        for n, entry in entries.items():
+            # the pointer to the current key can still be used, and
+            # is checked again, until its limit
+            if max(entry['expires'], entry.get('limit', 0)) > now:
+                key = {k: v for k, v in entry['key'].items()
+                       if k != 'unwrapped_data_key'}
+                keys.setdefault(name, {})[str(n)] = dict(entry, key=key)
+
+    allkeys = {name: entry
+               for name, entry in fetchAllKeys.cache.get(papi, {}).items()
+               if entry['expires'] > now}
+
+    data = json.dumps({'version': VERSION, 'papi': papi,
+                       'datasets': datasets, 'keys': keys,
+                       'all_keys': allkeys})
+
+    # write a new file and move it into place, so that a reader never
+    # sees a partial file
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def LoadCache(creds, path):
+    """
+    Add the entries of a file written by SaveCache to the in-memory
+    caches. Entries that have expired, or that belong to a different
+    access key, are ignored, as is a missing or unreadable file. Nothing
+    is loaded if structured key caching is disabled. Returns the number
+    of entries loaded.
+    """
+    if not creds.configuration.key_caching_structured:
+        return 0
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    papi = creds.access_key_id
+    if data.get('version') != VERSION or data.get('papi') != papi:
+        return 0
+
+    now = time.time()
+    count = 0
+    for name, entry in data['datasets'].items():
+        if entry['expires'] > now:
+            fetchDataset.cache.setdefault(papi, {}).setdefault(name, entry)
+            count += 1
+    for name, entries in data['keys'].items():
+        cache = fetchKey.cache.setdefault(papi, {}).setdefault(name, {})
+        for n, entry in entries.items():
+            if max(entry['expires'], entry.get('limit', 0)) > now:
+                cache.setdefault(int(n), entry)
+                count += 1
+    for name, entry in data['all_keys'].items():
+        if entry['expires'] > now:
+            fetchAllKeys.cache.setdefault(papi, {}).setdefault(name, entry)
+            count += 1
+    return count
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import stat
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import importlib
+warm = importlib.import_module('ubiq_security.structured.warm')
+common = importlib.import_module('ubiq_security.structured.common')
+testutil = importlib.import_module('ubiq_security.structured._testutil')
+
+class TestWarmCache(unittest.TestCase):
+    def setUp(self):
+        common.flushDataset()
+        common.flushKey()
+        self.addCleanup(common.flushDataset)
+        self.addCleanup(common.flushKey)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'cache')
+
+    def test_roundtrip(self):
+        now = time.time()
+        key = {'key_number': 1, 'encrypted_private_key': 'pem',
+               'wrapped_data_key': 'wrapped', 'unwrapped_data_key': b'k' * 32}
+        common.fetchDataset.cache['papi'] = {
+            'SSN': {'dataset': {'name': 'SSN'}, 'expires': now + 100},
+            'OLD': {'dataset': {'name': 'OLD'}, 'expires': now - 1},
+        }
+        common.fetchKey.cache['papi'] = {'SSN': {
+            -1: {'key': key, 'expires': now + 100},
+            1: {'key': key, 'expires': now + 100},
+            0: {'key': dict(key, key_number=0), 'expires': now - 1},
+        }}
+        common.fetchKey.cache['other'] = {'SSN': {
+            1: {'key': key, 'expires': now + 100}}}
+        common.fetchAllKeys.cache['papi'] = {
+            'SSN': {'keys': {'SSN': {'keys': ['a', 'b']}},
+                    'expires': now + 100}}
+
+        warm.SaveCache(testutil.Creds(), self.path)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        with open(self.path) as f:
+            data = f.read()
+        # unwrapped keys never reach the file
+        self.assertNotIn('unwrapped_data_key', data)
+        self.assertNotIn('other', json.loads(data)['keys'])
+
+        common.flushDataset()
+        common.flushKey()
+        self.assertEqual(warm.LoadCache(testutil.Creds(), self.path), 4)
+        self.assertEqual(list(common.fetchDataset.cache['papi']), ['SSN'])
+        self.assertEqual(sorted(common.fetchKey.cache['papi']['SSN']), [-1, 1])
+        self.assertEqual(common.fetchKey.cache['papi']['SSN'][1]['key'],
+                         {'key_number': 1, 'encrypted_private_key': 'pem',
+                          'wrapped_data_key': 'wrapped'})
+        self.assertEqual(
+            common.fetchAllKeys.cache['papi']['SSN']['keys']['SSN']['keys'],
+            ['a', 'b'])
+
+    def test_expiry(self):
+        pem, wrapped = testutil.wrapKeys([bytes(32)])
+        key = {'key_number': 1, 'encrypted_private_key': pem,
+               'wrapped_data_key': wrapped[0]}
+        now = time.time()
+        common.fetchKey.cache['papi'] = {'SSN': {
+            -1: {'key': key, 'expires': now + 5, 'limit': now + 5},
+            1: {'key': key, 'expires': now + 5},
+        }}
+        warm.SaveCache(testutil.Creds(), self.path)
+        common.flushKey()
+        warm.LoadCache(testutil.Creds(), self.path)
+
+        def get(url, auth = None):
+            self.fail('unexpected request: %s' % (url))
+        with unittest.mock.patch.object(common.requests, 'get', get):
+            creds = testutil.Creds()
+            for n in (-1, 1):
+                self.assertEqual(
+                    common.fetchKey(creds, 'SSN', n)['unwrapped_data_key'],
+                    bytes(32))
+
+        # unwrapping the loaded keys does not extend their lifetime
+        entries = common.fetchKey.cache['papi']['SSN']
+        self.assertEqual(entries[-1]['expires'], now + 5)
+        self.assertEqual(entries[-1]['limit'], now + 5)
+        self.assertEqual(entries[1]['expires'], now + 5)
+        self.assertEqual(entries[1]['key']['unwrapped_data_key'], bytes(32))
+
+    def test_ignored(self):
+        common.fetchDataset.cache['papi'] = {
+            'SSN': {'dataset': {'name': 'SSN'}, 'expires': time.time() + 100}}
+        warm.SaveCache(testutil.Creds(), self.path)
+        common.flushDataset()
+
+        other = testutil.Creds(papi = 'other')
+        disabled = testutil.Creds({'key_caching': {'structured': False}})
+        self.assertEqual(warm.LoadCache(other, self.path), 0)
+        self.assertEqual(warm.LoadCache(disabled, self.path), 0)
+        self.assertEqual(
+            warm.LoadCache(testutil.Creds(), self.path + '.missing'), 0)
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual(warm.LoadCache(testutil.Creds(), self.path), 0)
+        self.assertEqual(common.fetchDataset.cache, {})
+
+if __name__ == '__main__':
+    unittest.main()